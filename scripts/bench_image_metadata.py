@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+add_image_metadata.py 性能基准测试
+生成合成图片语料（小图标、192/512 px 图标、数 MB 的截图、带大 EXIF/缩略图的照片），
+测量 read_metadata / update_metadata_jpeg / update_metadata_png 的冷/热延迟、批处理吞吐量和峰值内存，
+结果写入 JSON，可用 --compare 与其他提交的结果对比
+
+依赖: pip install Pillow piexif（仅用于生成语料）
+
+用法:
+    python scripts/bench_image_metadata.py -o bench.json
+    python scripts/bench_image_metadata.py --quick -o new.json --compare bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+import image_metadata_cli as cli  # noqa: E402
+import image_metadata as meta  # noqa: E402
+
+# 语料规格: 名称 -> (格式, 宽, 高, 是否写入大 EXIF/缩略图)
+CORPUS = {
+    'icon-32': ('png', 32, 32, False),
+    'icon-192': ('png', 192, 192, False),
+    'icon-512': ('png', 512, 512, False),
+    'screenshot': ('png', 1920, 1080, False),
+    'photo': ('jpeg', 4000, 3000, False),
+    'photo-big-exif': ('jpeg', 4000, 3000, True),
+}
+QUICK_CORPUS = {
+    'icon-32': ('png', 32, 32, False),
+    'icon-512': ('png', 512, 512, False),
+    'screenshot': ('png', 1280, 720, False),
+    'photo-big-exif': ('jpeg', 1600, 1200, True),
+}
+
+SAMPLE_METADATA = [
+    {'Comment': '基准测试 A', 'Description': 'benchmark', 'Source': 'bench', 'URL': 'https://example.com/a'},
+    {'Comment': '基准测试 B', 'Description': 'benchmark', 'Source': 'bench', 'URL': 'https://example.com/b'},
+]
+
+
+def generate_image(path, fmt, width, height, big_exif):
+    """生成一张带噪声的合成图片（噪声让压缩后的大小接近真实素材）"""
+    from PIL import Image
+
+    img = Image.frombytes('RGB', (width, height), os.urandom(width * height * 3))
+    if fmt == 'png':
+        img.save(path, format='PNG')
+        return
+
+    exif_bytes = None
+    if big_exif:
+        import piexif
+        import io
+        thumb = io.BytesIO()
+        img.resize((160, 120)).save(thumb, format='JPEG', quality=95)
+        exif_bytes = piexif.dump({
+            '0th': {piexif.ImageIFD.Make: b'Bench', piexif.ImageIFD.Model: b'Synthetic'},
+            'Exif': {piexif.ExifIFD.MakerNote: os.urandom(24 * 1024)},
+            'GPS': {piexif.GPSIFD.GPSVersionID: (2, 2, 0, 0)},
+            '1st': {piexif.ImageIFD.JPEGInterchangeFormat: 0},
+            'thumbnail': thumb.getvalue(),
+        })
+    img.save(path, format='JPEG', quality=90, **({'exif': exif_bytes} if exif_bytes else {}))
+
+
+def generate_corpus(directory, spec):
+    """生成语料，返回 {名称: 路径}"""
+    paths = {}
+    for name, (fmt, width, height, big_exif) in spec.items():
+        path = os.path.join(directory, f"{name}.{'png' if fmt == 'png' else 'jpg'}")
+        generate_image(path, fmt, width, height, big_exif)
+        paths[name] = path
+    return paths
+
+
+def drop_page_cache(path):
+    """尽量把文件移出页缓存，用于冷读测量（不支持的平台上为空操作）"""
+    if not hasattr(os, 'posix_fadvise'):
+        return False
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    return True
+
+
+def summarize(samples):
+    """把耗时样本（秒）汇总为毫秒统计"""
+    ms = sorted(s * 1000 for s in samples)
+    return {
+        'n': len(ms),
+        'mean_ms': statistics.fmean(ms),
+        'p50_ms': ms[len(ms) // 2],
+        'p95_ms': ms[min(len(ms) - 1, int(len(ms) * 0.95))],
+        'min_ms': ms[0],
+        'max_ms': ms[-1],
+    }
+
+
+def peak_rss_kb():
+    """当前进程的峰值常驻内存（KB），不支持时返回 None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 以字节为单位，Linux 以 KB 为单位
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def run_case(op, path, iterations, cold):
+    """在当前进程中运行一个测量用例，返回统计结果"""
+    update = meta.update_metadata_jpeg if path.endswith('.jpg') else meta.update_metadata_png
+    samples = []
+    for i in range(iterations):
+        if cold:
+            drop_page_cache(path)
+        start = time.perf_counter()
+        if op == 'read':
+            meta.read_metadata(path)
+        else:
+            # 交替写入两组值，确保每次都真正改写文件
+            if not update(path, SAMPLE_METADATA[i % 2]):
+                raise RuntimeError(f"写入失败: {path}")
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def run_case_isolated(op, name, path, iterations, cold):
+    """在独立子进程中运行用例，使峰值内存只反映该用例本身"""
+    cmd = [sys.executable, os.path.abspath(__file__), '--case', op, path,
+           '--iterations', str(iterations)] + (['--cold'] if cold else [])
+    output = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result.update({'op': op, 'kind': name, 'cold': cold, 'bytes': os.path.getsize(path)})
+    return result
+
+
+def run_throughput(corpus, directory, copies, jobs):
+    """复制语料组成批次，测量 run_batch 的 get/set 吞吐量"""
+    batch_dir = os.path.join(directory, f'batch-{jobs}')
+    os.makedirs(batch_dir)
+    files = []
+    for name, path in corpus.items():
+        for i in range(copies):
+            target = os.path.join(batch_dir, f"{name}-{i}{os.path.splitext(path)[1]}")
+            shutil.copyfile(path, target)
+            files.append(target)
+    total_bytes = sum(os.path.getsize(f) for f in files)
+
+    results = []
+    for command, changes in (('get', None), ('set', {'Comment': f'throughput {jobs}'})):
+        start = time.perf_counter()
+        counts = cli.run_batch(command, files, changes, jobs=jobs)
+        elapsed = time.perf_counter() - start
+        if counts['failed']:
+            raise RuntimeError(f"批处理 {command} 有 {counts['failed']} 个文件失败")
+        results.append({
+            'op': f'batch-{command}', 'jobs': jobs, 'files': len(files), 'bytes': total_bytes,
+            'seconds': elapsed, 'files_per_sec': len(files) / elapsed,
+            'mb_per_sec': total_bytes / elapsed / (1024 * 1024),
+        })
+    shutil.rmtree(batch_dir)
+    return results
+
+
+def git_revision():
+    """当前仓库的提交号，不在 git 仓库中时返回 None"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPT_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def case_key(result):
+    """用于对比的用例标识"""
+    if 'jobs' in result:
+        return f"{result['op']}/jobs={result['jobs']}"
+    return f"{result['op']}/{result['kind']}/{'cold' if result['cold'] else 'warm'}"
+
+
+def compare(old_path, results):
+    """与之前的结果对比，打印每个用例的变化比例"""
+    with open(old_path, 'r', encoding='utf-8') as f:
+        old = {case_key(r): r for r in json.load(f)['results']}
+    print(f"\n与 {old_path} 对比（<1.00 表示更快）:")
+    for result in results:
+        key = case_key(result)
+        if key not in old:
+            continue
+        if 'p50_ms' in result:
+            ratio = result['p50_ms'] / old[key]['p50_ms'] if old[key]['p50_ms'] else float('nan')
+        else:
+            ratio = old[key]['files_per_sec'] / result['files_per_sec']
+        print(f"  {ratio:5.2f}x  {key}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="add_image_metadata.py 性能基准测试")
+    parser.add_argument('-o', '--output', default='bench_results.json', help="结果 JSON 文件")
+    parser.add_argument('--quick', action='store_true', help="使用更小的语料快速运行")
+    parser.add_argument('--iterations', type=int, default=20, help="每个延迟用例的迭代次数")
+    parser.add_argument('--copies', type=int, default=50, help="吞吐量测试中每种语料的副本数")
+    parser.add_argument('--compare', metavar='OLD_JSON', help="与之前的结果文件对比")
+    parser.add_argument('--case', nargs=2, metavar=('OP', 'PATH'), help=argparse.SUPPRESS)
+    parser.add_argument('--cold', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        # 子进程模式：运行单个用例并输出一行 JSON
+        op, path = args.case
+        result = run_case(op, path, args.iterations, args.cold)
+        result['peak_rss_kb'] = peak_rss_kb()
+        print(json.dumps(result))
+        return 0
+
+    spec = QUICK_CORPUS if args.quick else CORPUS
+    iterations = min(args.iterations, 5) if args.quick else args.iterations
+    copies = min(args.copies, 10) if args.quick else args.copies
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='bench-image-metadata-') as directory:
+        print("生成语料...")
+        corpus = generate_corpus(directory, spec)
+
+        for name, path in corpus.items():
+            size_kb = os.path.getsize(path) / 1024
+            for op in ('read', 'update'):
+                for cold in (True, False):
+                    result = run_case_isolated(op, name, path, iterations, cold)
+                    results.append(result)
+                    print(f"  {op:6} {name:15} {size_kb:9.1f} KB {'cold' if cold else 'warm'}  "
+                          f"p50 {result['p50_ms']:8.3f} ms  p95 {result['p95_ms']:8.3f} ms  "
+                          f"RSS {result['peak_rss_kb']} KB")
+
+        for jobs in sorted({1, os.cpu_count() or 1}):
+            for result in run_throughput(corpus, directory, copies, jobs):
+                results.append(result)
+                print(f"  {result['op']:9} jobs={jobs:<3} {result['files']} 个文件  "
+                      f"{result['files_per_sec']:9.1f} 文件/秒  {result['mb_per_sec']:8.1f} MB/秒")
+
+    report = {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'has_piexif': meta._load_piexif(),
+        'quick': args.quick,
+        'iterations': iterations,
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已写入: {args.output}")
+
+    if args.compare:
+        compare(args.compare, results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
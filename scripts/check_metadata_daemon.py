@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+add_image_metadata.py 常驻服务检查
+启动使用进程池的常驻服务，从两个不同的工作目录依次转发 set/get 多个同名的相对路径（经由进程池处理），
+确认每个请求都作用于各自目录下的文件（进程池中的工作进程不会沿用其他请求的工作目录）
+
+用法:
+    python scripts/check_metadata_daemon.py
+    python scripts/check_metadata_daemon.py --jobs 4 path/to/image.png
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPT = os.path.join(SCRIPT_DIR, 'add_image_metadata.py')
+DEFAULT_IMAGE = os.path.join(SCRIPT_DIR, '..', 'assets', 'images', 'demo', '2025-12-31.png')
+
+# 每个目录中复制的图片数（多于 1 个时批处理才会分发给进程池）
+FILES_PER_DIR = 4
+
+sys.path.insert(0, SCRIPT_DIR)
+
+
+def run_client(args, cwd, env):
+    """在 cwd 下运行客户端命令（会转发给常驻服务），返回 (退出码, stdout)"""
+    result = subprocess.run([sys.executable, SCRIPT] + args, cwd=cwd, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    return result.returncode, result.stdout
+
+
+def wait_for_socket(path, server, timeout=10.0):
+    """等待常驻服务创建套接字，服务提前退出或超时返回 False"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if os.path.exists(path):
+            return True
+        if server.poll() is not None:
+            return False
+        time.sleep(0.05)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检查常驻服务按请求的工作目录解析相对路径")
+    parser.add_argument('image', nargs='?', default=DEFAULT_IMAGE, help="复制到各目录的示例图片")
+    parser.add_argument('-j', '--jobs', type=int, default=2, help="常驻进程池的工作进程数（默认 2，须大于 1）")
+    args = parser.parse_args()
+
+    import image_metadata
+
+    jobs = str(max(2, args.jobs))
+    names = [f"image-{i}.png" for i in range(FILES_PER_DIR)]
+    ok = True
+    workdir = tempfile.mkdtemp(prefix='image_metadata_daemon_')
+    socket_path = os.path.join(workdir, 'daemon.sock')
+    env = dict(os.environ, IMAGE_METADATA_SOCKET=socket_path)
+    env.pop('IMAGE_METADATA_NO_DAEMON', None)
+    server = subprocess.Popen([sys.executable, SCRIPT, 'serve', '--socket', socket_path, '-j', jobs],
+                              env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_for_socket(socket_path, server):
+            print("[FAIL] 常驻服务未能启动")
+            return 1
+
+        directories = []
+        for name in ('first', 'second'):
+            directory = os.path.join(workdir, name)
+            os.mkdir(directory)
+            for filename in names:
+                shutil.copyfile(args.image, os.path.join(directory, filename))
+            directories.append(directory)
+
+        # 依次从两个目录修改同名的相对路径
+        for directory in directories:
+            name = os.path.basename(directory)
+            code, _ = run_client(['set', '-q', '-j', jobs, '--description', name] + names, directory, env)
+            if code != 0:
+                ok = False
+                print(f"[FAIL] {name}: set 退出码 {code}")
+
+        for directory in directories:
+            name = os.path.basename(directory)
+            for filename in names:
+                actual = image_metadata.read_metadata(os.path.join(directory, filename)).get('Description')
+                if actual != name:
+                    ok = False
+                    print(f"[FAIL] {name}/{filename} 的 Description 为 {actual!r}，应为 {name!r}")
+
+            code, stdout = run_client(['get', '-j', jobs] + names, directory, env)
+            if code != 0 or stdout.count(name) < len(names):
+                ok = False
+                print(f"[FAIL] {name}: get 没有读到本目录的文件（退出码 {code}）")
+    finally:
+        subprocess.run([sys.executable, SCRIPT, 'serve', '--stop', '--socket', socket_path], env=env,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            server.wait(10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if ok:
+        print("[OK] 常驻服务按各请求的工作目录处理相对路径")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
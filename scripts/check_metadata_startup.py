@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+add_image_metadata.py 启动耗时检查
+使用 -X importtime 统计脚本自身的导入耗时，并测量 `get` 单个文件的端到端耗时
+（扣除空解释器的启动时间），超出预算或导入了不该在只读路径上加载的重量级依赖时返回非 0
+测量前先编译 image_metadata_cli 和 image_metadata 的字节码缓存（即使设置了 PYTHONDONTWRITEBYTECODE），
+预算针对已缓存字节码的正常启动，入口脚本本身只有几行，每次编译的开销可以忽略
+
+用法:
+    python scripts/check_metadata_startup.py
+    python scripts/check_metadata_startup.py --budget-ms 30 --runs 10 path/to/image.png
+"""
+
+import argparse
+import os
+import py_compile
+import statistics
+import subprocess
+import sys
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPT = os.path.join(SCRIPT_DIR, 'add_image_metadata.py')
+DEFAULT_IMAGE = os.path.join(SCRIPT_DIR, '..', 'assets', 'images', 'demo', '2025-12-31.png')
+# 入口脚本导入的模块（测量前写好字节码缓存）
+MODULES = ('image_metadata_cli.py', 'image_metadata.py')
+
+# 只读命令不应加载的模块
+HEAVY_MODULES = ('PIL', 'piexif', 'tkinter', 'ctypes', 'sqlite3', 'multiprocessing')
+
+
+def parse_importtime(stderr):
+    """解析 -X importtime 输出，返回 [(模块名, 自身微秒, 累计微秒, 缩进层级), ...]"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line.split(':', 1)[1].split('|', 2)
+        # 模块名前第一个空格是分隔符，其后每两个空格表示一层嵌套
+        name = name[1:]
+        level = (len(name) - len(name.lstrip(' '))) // 2
+        entries.append((name.strip(), int(self_us), int(cumulative_us), level))
+    return entries
+
+
+def measure_wall(cmd, runs):
+    """多次运行命令，返回耗时中位数（毫秒）"""
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检查 add_image_metadata.py 的启动耗时预算")
+    parser.add_argument('image', nargs='?', default=DEFAULT_IMAGE, help="用于 get 命令的示例图片")
+    parser.add_argument('--budget-ms', type=float, default=35.0,
+                        help="扣除解释器启动后允许的额外耗时（毫秒，默认 35）")
+    parser.add_argument('--runs', type=int, default=7, help="端到端测量次数（取中位数）")
+    parser.add_argument('--top', type=int, default=10, help="列出最慢的导入数量")
+    args = parser.parse_args()
+
+    ok = True
+    for name in MODULES:
+        py_compile.compile(os.path.join(SCRIPT_DIR, name), doraise=True)
+
+    # 1. 导入耗时明细
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', SCRIPT, 'get', '-q', '-j', '1', args.image],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True
+    )
+    baseline = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'pass'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True
+    )
+    baseline_modules = {name for name, _, _, _ in parse_importtime(baseline.stderr)}
+    entries = [e for e in parse_importtime(result.stderr) if e[0] not in baseline_modules]
+
+    import_us = sum(cumulative for _, _, cumulative, level in entries if level == 0)
+    print(f"脚本额外导入耗时: {import_us / 1000:.1f} ms（{len(entries)} 个模块）")
+    for name, _, cumulative, level in sorted(entries, key=lambda e: e[2], reverse=True)[:args.top]:
+        print(f"  {cumulative / 1000:7.2f} ms  {'  ' * level}{name}")
+
+    loaded_heavy = sorted({name for name, _, _, _ in entries if name.split('.')[0] in HEAVY_MODULES})
+    if loaded_heavy:
+        ok = False
+        print(f"[FAIL] get 路径加载了重量级依赖: {', '.join(loaded_heavy)}")
+
+    # 2. 端到端耗时（扣除空解释器启动）
+    interpreter_ms = measure_wall([sys.executable, '-c', 'pass'], args.runs)
+    get_ms = measure_wall([sys.executable, SCRIPT, 'get', '-q', '-j', '1', args.image], args.runs)
+    overhead_ms = get_ms - interpreter_ms
+    print(f"解释器启动: {interpreter_ms:.1f} ms，get 单个文件: {get_ms:.1f} ms，额外耗时: {overhead_ms:.1f} ms")
+
+    if overhead_ms > args.budget_ms:
+        ok = False
+        print(f"[FAIL] 额外耗时超出预算 {args.budget_ms:.1f} ms")
+
+    if ok:
+        print("[OK] 启动耗时在预算内")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,2689 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片元数据核心库
+读写 Comment、Description、Source、URL 四个字段，支持 JPEG、PNG、WebP 和 ICO (内嵌 PNG)
+字段默认保存在 XMP 数据包中（预留填充，之后的修改可原地覆盖），
+也可以用 set_metadata_format('legacy') 沿用 EXIF 标签 (JPEG/WebP) 和 PNG 文本块；两种表示都能读取
+
+所有修改都只改动容器层的元数据段/块，像素数据不解码也不重新编码。
+交互模式和批处理命令行见 image_metadata_cli.py（入口脚本 add_image_metadata.py）
+
+用法:
+    from image_metadata import read_metadata, update_metadata
+    update_metadata('photo.jpg', {'Comment': '', 'Description': '说明', 'Source': '', 'URL': ''})
+    
+    # 内存中的图片（如上传服务收到的数据），不落盘
+    from image_metadata import read_metadata_buffer, update_metadata_buffer
+    new_bytes = update_metadata_buffer(upload_bytes, {'Description': '说明'})
+    update_metadata_buffer(request.stream, metadata, output=response_stream)
+"""
+
+import errno
+import mmap
+import os
+import stat
+import sys
+import time
+import zlib
+from collections import Counter, namedtuple
+
+# PIL、piexif 等较重的依赖只在需要它们的代码路径中导入，
+# 这样只读操作无需加载它们，启动更快（见 check_metadata_startup.py）
+piexif = None
+HAS_PIEXIF = None  # None 表示尚未尝试导入
+
+
+def _load_piexif():
+    """按需导入 piexif，返回是否可用（只尝试一次）"""
+    global piexif, HAS_PIEXIF
+    if HAS_PIEXIF is None:
+        try:
+            import piexif as module
+            piexif = module
+            HAS_PIEXIF = True
+        except ImportError:
+            HAS_PIEXIF = False
+            print("警告: 未安装 piexif 库，JPEG 的 EXIF 处理可能受限。", file=sys.stderr)
+            print("建议安装: pip install piexif", file=sys.stderr)
+    return HAS_PIEXIF
+
+
+# 最近一次失败的原因（update_metadata 等返回 False/None 时，批处理把它记入检查点日志）
+LAST_ERROR = None
+
+
+def _report_error(message):
+    """把错误信息打印到 stderr（stdout 可能是 dump 的 JSON 输出）并记为 LAST_ERROR"""
+    global LAST_ERROR
+    LAST_ERROR = message
+    print(f"[ERROR] {message}", file=sys.stderr)
+
+
+# ============================================================
+# 性能分析（--profile）
+# ============================================================
+
+# 未启用时为 None，各埋点只做一次 None 判断
+PROFILER = None
+
+
+class Profiler:
+    """
+    收集每个文件各阶段的耗时和字节数，以及计数器
+    阶段: open、parse、build、write、fsync、rename、file（单个文件总耗时）等
+    """
+    
+    def __init__(self):
+        # (path, phase, start_ns, duration_ns, nbytes, pid)
+        self.events = []
+        self.counters = Counter()
+        self.path = None
+    
+    def record(self, phase, start, duration, nbytes=0):
+        self.events.append((self.path, phase, start, duration, nbytes, os.getpid()))
+    
+    def drain(self):
+        """取出并清空已收集的数据（工作进程把它随结果发回主进程）"""
+        data = (self.events, self.counters)
+        self.events, self.counters = [], Counter()
+        return data
+    
+    def merge(self, data):
+        events, counters = data
+        self.events.extend(events)
+        self.counters.update(counters)
+    
+    def summary(self, wall_seconds=None):
+        """按阶段汇总为百分位统计（毫秒）"""
+        by_phase = {}
+        for _, phase, _, duration, nbytes, _ in self.events:
+            durations, total_bytes = by_phase.setdefault(phase, ([], [0]))
+            durations.append(duration)
+            total_bytes[0] += nbytes
+        
+        phases = {}
+        for phase, (durations, total_bytes) in sorted(by_phase.items()):
+            durations.sort()
+            
+            def percentile(q):
+                return durations[min(len(durations) - 1, int(len(durations) * q))] / 1e6
+            
+            phases[phase] = {
+                'count': len(durations),
+                'total_ms': sum(durations) / 1e6,
+                'mean_ms': sum(durations) / len(durations) / 1e6,
+                'p50_ms': percentile(0.50),
+                'p90_ms': percentile(0.90),
+                'p99_ms': percentile(0.99),
+                'max_ms': durations[-1] / 1e6,
+                'bytes': total_bytes[0],
+            }
+        return {
+            'wall_ms': wall_seconds * 1000 if wall_seconds is not None else None,
+            'files': phases.get('file', {}).get('count', 0),
+            'phases': phases,
+            'counters': dict(sorted(self.counters.items())),
+        }
+    
+    def write_trace(self, trace_path):
+        """写出 Chrome trace-event 格式（chrome://tracing 或 Perfetto 可直接打开）"""
+        import json
+        
+        trace = [{
+            'name': phase, 'cat': 'metadata', 'ph': 'X', 'pid': pid, 'tid': pid,
+            'ts': start / 1000, 'dur': duration / 1000,
+            'args': {'path': path, 'bytes': nbytes},
+        } for path, phase, start, duration, nbytes, pid in self.events]
+        with open(trace_path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
+
+
+def enable_profiling(enabled=True):
+    """启用（或关闭）性能分析"""
+    global PROFILER
+    PROFILER = Profiler() if enabled else None
+    return PROFILER
+
+
+def _prof_start():
+    """阶段开始时间（未启用分析时返回 0）"""
+    return time.perf_counter_ns() if PROFILER is not None else 0
+
+
+def _prof_end(phase, start, nbytes=0):
+    """记录从 start 到现在的阶段耗时"""
+    if PROFILER is not None:
+        PROFILER.record(phase, start, time.perf_counter_ns() - start, nbytes)
+
+
+def _prof_count(name, n=1):
+    """累加计数器"""
+    if PROFILER is not None:
+        PROFILER.counters[name] += n
+
+
+def read_metadata(image_path):
+    """
+    读取图片的元数据
+    返回字典: {'Comment': '', 'Description': '', 'Source': '', 'URL': ''}
+    只扫描文件头（JPEG 的 APPn 段 / PNG 的块头），不解析完整 EXIF，也不解码像素；
+    边车模式（见 set_sidecar_mode）下只读取 .xmp 边车文件，或用边车中的字段覆盖图片内嵌的值
+    文件无法读取时抛出 OSError，结构损坏时抛出 ValueError（不再返回空字段，以免被当作"没有元数据"写回）
+    """
+    image_path = os.fspath(image_path)
+    if SIDECAR_MODE == 'only':
+        metadata = {key: '' for key in METADATA_KEYS}
+    else:
+        metadata = _read_embedded_metadata(image_path)
+    if SIDECAR_MODE != 'off':
+        metadata.update(_read_sidecar_fields(image_path))
+    return metadata
+
+
+def _read_embedded_metadata(image_path):
+    """读取图片内嵌的元数据（不考虑边车文件），出错时抛出 OSError / ValueError"""
+    metadata = {'Comment': '', 'Description': '', 'Source': '', 'URL': ''}
+    
+    ext = os.path.splitext(image_path)[1].lower()
+    
+    if ext in ['.jpg', '.jpeg']:
+        reader = _read_jpeg_fields
+    elif ext == '.png':
+        reader = _read_png_fields
+    elif ext == '.webp':
+        reader = _read_webp_fields
+    elif ext == '.ico':
+        reader = _read_ico_fields
+    else:
+        return metadata
+    
+    start = _prof_start()
+    with open(image_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            raise ValueError(f"文件为空: {image_path}")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            _prof_end('open', start, size)
+            start = _prof_start()
+            try:
+                metadata.update(reader(buf))
+            except Exception as e:
+                raise ValueError(f"解析 {image_path} 的元数据时出错: {e}") from e
+            _prof_end('parse', start)
+    
+    return metadata
+
+
+# JPEG 标记
+JPEG_SOI = b'\xff\xd8'
+JPEG_APP0 = 0xE0
+JPEG_APP1 = 0xE1
+JPEG_SOS = 0xDA
+JPEG_EOI = 0xD9
+EXIF_HEADER = b'Exif\x00\x00'
+# JPEG 中 XMP APP1 段负载的开头
+XMP_JPEG_HEADER = b'http://ns.adobe.com/xap/1.0/\x00'
+# 无长度字段的独立标记: TEM、RST0-RST7
+JPEG_STANDALONE_MARKERS = {0x01} | set(range(0xD0, 0xD8))
+# 单个 APPn 段的最大负载（长度字段为 2 字节，包含自身）
+JPEG_MAX_SEGMENT_PAYLOAD = 0xFFFF - 2
+
+# 拼接复制时的缓冲区大小（无法使用零拷贝系统调用时）
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def _read_jpeg_header(f):
+    """
+    读取 JPEG 从 SOI 到 SOS 之前的文件头（不读取扫描数据）
+    返回 (header, segments)
+    header: 文件开头到 SOS 标记之前的全部字节
+    segments: [(marker, start, end), ...]，start/end 为段在 header 中的范围（含标记）
+    """
+    if f.read(2) != JPEG_SOI:
+        raise ValueError("不是有效的 JPEG 文件")
+    
+    header = bytearray(JPEG_SOI)
+    segments = []
+    while True:
+        start = len(header)
+        byte = f.read(1)
+        if byte != b'\xff':
+            raise ValueError(f"JPEG 段结构损坏（偏移 {start}）")
+        # 填充的 0xFF 原样保留在 header 中，保证 header 中的偏移与文件偏移一致
+        marker = 0xFF
+        while marker == 0xFF:
+            byte = f.read(1)
+            if not byte:
+                raise ValueError("JPEG 文件在 SOS 之前意外结束")
+            marker = byte[0]
+            if marker == 0xFF:
+                header += b'\xff'
+                start += 1
+        
+        if marker == JPEG_SOS:
+            # SOS 及其后的熵编码数据原样保留，不再读取
+            return bytes(header[:start]), segments
+        if marker == JPEG_EOI:
+            raise ValueError("JPEG 文件缺少扫描数据 (SOS)")
+        
+        header += b'\xff' + byte
+        if marker in JPEG_STANDALONE_MARKERS:
+            segments.append((marker, start, len(header)))
+            continue
+        
+        length_bytes = f.read(2)
+        if len(length_bytes) != 2:
+            raise ValueError("JPEG 文件在段长度处意外结束")
+        length = int.from_bytes(length_bytes, 'big')
+        if length < 2:
+            raise ValueError(f"JPEG 段长度无效（偏移 {start}）")
+        payload = f.read(length - 2)
+        if len(payload) != length - 2:
+            raise ValueError("JPEG 文件在段数据处意外结束")
+        header += length_bytes + payload
+        segments.append((marker, start, len(header)))
+
+
+def _find_app1_segment(header, segments, signature):
+    """返回负载以 signature 开头的第一个 APP1 段 (marker, start, end)，不存在则返回 None"""
+    for segment in segments:
+        marker, start, end = segment
+        if marker == JPEG_APP1 and header[start + 4:start + 4 + len(signature)] == signature:
+            return segment
+    return None
+
+
+def _find_exif_segment(header, segments):
+    """返回 EXIF APP1 段 (marker, start, end)，不存在则返回 None"""
+    return _find_app1_segment(header, segments, EXIF_HEADER)
+
+
+# 表示"保持原样"的占位值（与 None 表示的"删除"区分）
+_KEEP = object()
+
+
+def _build_jpeg_header(header, segments, exif_bytes=_KEEP, xmp_bytes=_KEEP):
+    """
+    生成替换 EXIF / XMP 段后的新文件头
+    exif_bytes: 以 'Exif\\0\\0' 开头的 EXIF 数据；xmp_bytes: 以 XMP 命名空间开头的 XMP 数据
+    为 None 时删除对应的段，为 _KEEP 时保持不变
+    """
+    # 新段插入到 SOI 及紧随其后的 APP0 (JFIF) 段之后，XMP 段紧跟在 EXIF 段之后
+    insert_at = len(JPEG_SOI)
+    for marker, _, seg_end in segments:
+        if marker != JPEG_APP0:
+            break
+        insert_at = seg_end
+    
+    edits = []
+    for order, (signature, payload) in enumerate(((EXIF_HEADER, exif_bytes), (XMP_JPEG_HEADER, xmp_bytes))):
+        existing = _find_app1_segment(header, segments, signature)
+        if signature == XMP_JPEG_HEADER and existing is None:
+            exif_segment = _find_exif_segment(header, segments)
+            if exif_segment is not None:
+                insert_at = exif_segment[2]
+        if payload is _KEEP:
+            continue
+        if payload is not None and len(payload) > JPEG_MAX_SEGMENT_PAYLOAD:
+            raise ValueError(f"APP1 数据过大 ({len(payload)} 字节)，超出单个段的上限")
+        
+        new_segment = b''
+        if payload is not None:
+            new_segment = b'\xff\xe1' + (len(payload) + 2).to_bytes(2, 'big') + payload
+        start, end = existing[1:] if existing is not None else (insert_at, insert_at)
+        edits.append((start, order, end, new_segment))
+    
+    parts = []
+    pos = 0
+    for start, _, end, new_segment in sorted(edits):
+        parts += [header[pos:start], new_segment]
+        pos = end
+    parts.append(header[pos:])
+    return b''.join(parts)
+
+
+# fsync 策略: always 每个文件写完都 fsync；batch 由批处理结束时统一 sync；never 不主动同步
+FSYNC_MODES = ('always', 'batch', 'never')
+FSYNC_MODE = 'always'
+
+# 当前进程中可用的零拷贝方式，遇到不支持的文件系统或内核时逐级降级
+_zero_copy_methods = ['copy_file_range', 'sendfile']
+
+
+def set_fsync_mode(mode):
+    """设置写入后的 fsync 策略（见 FSYNC_MODES）"""
+    global FSYNC_MODE
+    if mode not in FSYNC_MODES:
+        raise ValueError(f"未知的 fsync 策略: {mode}")
+    FSYNC_MODE = mode
+
+
+# 表示"此方式不可用"的错误码（不同内核/文件系统返回的值不同）
+_ZERO_COPY_UNSUPPORTED = {
+    getattr(errno, name) for name in ('ENOSYS', 'EXDEV', 'EINVAL', 'EOPNOTSUPP', 'ENOTSUP', 'EBADF', 'ENOTSOCK')
+    if hasattr(errno, name)
+}
+
+
+def _write_all(fd, data):
+    """把 data 完整写入 fd（处理部分写入）"""
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+
+
+def _copy_range(src_fd, dst_fd, offset, count):
+    """
+    把源文件 [offset, offset + count) 追加到目标文件当前位置
+    优先使用 copy_file_range / sendfile 在内核中完成复制，失败时退回大缓冲区读写
+    """
+    while count > 0:
+        method = _zero_copy_methods[0] if _zero_copy_methods else None
+        try:
+            if method == 'copy_file_range':
+                copied = os.copy_file_range(src_fd, dst_fd, count, offset)
+            elif method == 'sendfile':
+                copied = os.sendfile(dst_fd, src_fd, offset, count)
+            else:
+                chunk = os.pread(src_fd, min(COPY_BUFFER_SIZE, count), offset)
+                _write_all(dst_fd, chunk)
+                copied = len(chunk)
+        except (AttributeError, OSError) as e:
+            if method is None or (isinstance(e, OSError) and e.errno not in _ZERO_COPY_UNSUPPORTED):
+                raise
+            # 该方式在此平台或文件系统上不可用，之后不再尝试
+            _zero_copy_methods.remove(method)
+            continue
+        if copied == 0:
+            raise ValueError("源文件在复制过程中被截断")
+        offset += copied
+        count -= copied
+
+
+def _fsync_directory(directory):
+    """同步目录项，确保 rename 持久化（Windows 不支持，直接跳过）"""
+    if sys.platform == 'win32':
+        return
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _write_spliced(image_path, pieces, source=None):
+    """
+    按顺序拼接若干片段，原子地替换 image_path
+    pieces: 元素为 bytes（新数据）或 (start, end)（原文件中的字节区间，零拷贝复制）
+    source: (start, end) 区间所在的文件，默认为 image_path 本身
+    先写入同目录下的临时文件，fsync 后 rename 覆盖原文件；中途失败时原文件保持不变
+    返回写入的字节数
+    """
+    import tempfile
+    
+    image_path = os.fspath(image_path)
+    directory, name = os.path.split(os.path.abspath(image_path))
+    start = _prof_start()
+    tmp_fd, tmp_name = tempfile.mkstemp(prefix=f".{name}.", suffix='.tmp', dir=directory)
+    written = 0
+    try:
+        src_fd = os.open(os.fspath(source or image_path), os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        try:
+            for piece in pieces:
+                if isinstance(piece, (bytes, bytearray, memoryview)):
+                    _write_all(tmp_fd, piece)
+                    written += len(piece)
+                else:
+                    start, end = piece
+                    _copy_range(src_fd, tmp_fd, start, end - start)
+                    written += end - start
+            os.chmod(tmp_name, stat.S_IMODE(os.stat(image_path).st_mode))
+        finally:
+            os.close(src_fd)
+        _prof_end('write', start, written)
+        if FSYNC_MODE == 'always':
+            start = _prof_start()
+            os.fsync(tmp_fd)
+            _prof_end('fsync', start)
+        os.close(tmp_fd)
+        tmp_fd = None
+        start = _prof_start()
+        os.replace(tmp_name, image_path)
+        _prof_end('rename', start)
+    except BaseException:
+        if tmp_fd is not None:
+            os.close(tmp_fd)
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+        raise
+    if FSYNC_MODE == 'always':
+        start = _prof_start()
+        _fsync_directory(directory)
+        _prof_end('fsync', start)
+    _prof_count('spliced_rewrites')
+    return written
+
+
+# Linux 的 FICLONE ioctl：在支持写时复制的文件系统（btrfs、XFS 等）上克隆整个文件
+FICLONE = 0x40049409
+# 重复文件的复制方式
+REPLICATE_MODES = ('copy', 'reflink', 'hardlink')
+
+
+def _clone_file(src_fd, dst_fd):
+    """尝试用 FICLONE 克隆文件内容，不支持时返回 False"""
+    if not sys.platform.startswith('linux'):
+        return False
+    import fcntl
+    
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return True
+    except OSError as e:
+        if e.errno in _ZERO_COPY_UNSUPPORTED or e.errno in (errno.EPERM, errno.ENOTTY):
+            return False
+        raise
+
+
+def _replicate_file(source, target, mode='copy'):
+    """
+    用 source 的内容原子地替换 target（内容相同的重复文件共享一次修改的结果）
+    mode: copy 复制数据；reflink 优先写时复制克隆，不支持时退回复制；hardlink 把 target 换成 source 的硬链接
+    返回 (写入的字节数, 是否为克隆/硬链接)
+    """
+    import tempfile
+    
+    target = os.fspath(target)
+    directory, name = os.path.split(os.path.abspath(target))
+    if mode == 'hardlink':
+        tmp_name = os.path.join(directory, f".{name}.{os.getpid()}.link")
+        os.link(source, tmp_name)
+        try:
+            os.replace(tmp_name, target)
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+        if FSYNC_MODE == 'always':
+            _fsync_directory(directory)
+        return 0, True
+    
+    if mode == 'reflink':
+        tmp_fd, tmp_name = tempfile.mkstemp(prefix=f".{name}.", suffix='.tmp', dir=directory)
+        try:
+            src_fd = os.open(source, os.O_RDONLY)
+            try:
+                cloned = _clone_file(src_fd, tmp_fd)
+            finally:
+                os.close(src_fd)
+            if cloned:
+                os.chmod(tmp_name, stat.S_IMODE(os.stat(target).st_mode))
+                if FSYNC_MODE == 'always':
+                    os.fsync(tmp_fd)
+                os.close(tmp_fd)
+                tmp_fd = None
+                os.replace(tmp_name, target)
+                if FSYNC_MODE == 'always':
+                    _fsync_directory(directory)
+                return 0, True
+        finally:
+            if tmp_fd is not None:
+                os.close(tmp_fd)
+                os.unlink(tmp_name)
+    
+    return _write_spliced(target, [(0, os.path.getsize(source))], source=source), False
+
+
+def _patch_in_place(image_path, offset, data):
+    """
+    用一次 pwrite 在 offset 处覆盖写入 data，文件大小不变
+    只用于与原内容等长的替换（XMP 数据包）；不经过临时文件，所以不是原子的，
+    但写入的只有数据包本身，中途失败最多留下一个不完整的 XMP 数据包
+    """
+    start = _prof_start()
+    fd = os.open(os.fspath(image_path), os.O_WRONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        view = memoryview(data)
+        if hasattr(os, 'pwrite'):
+            while view:
+                written = os.pwrite(fd, view, offset)
+                view = view[written:]
+                offset += written
+        else:
+            os.lseek(fd, offset, os.SEEK_SET)
+            _write_all(fd, view)
+        _prof_end('write', start, len(data))
+        if FSYNC_MODE == 'always':
+            start = _prof_start()
+            os.fsync(fd)
+            _prof_end('fsync', start)
+    finally:
+        os.close(fd)
+    _prof_count('in_place_patches')
+    return len(data)
+
+
+# 一次元数据修改的规划结果（由各格式的 _plan_*_edit 生成，与写入方式无关）
+# patches 不为 None 时为 [(offset, data), ...]，只需等长覆盖这些字节；否则 pieces 为拼接片段
+EditPlan = namedtuple('EditPlan', 'patches pieces')
+
+
+def _stream_size(f):
+    """文件对象的总长度（不改变当前读取位置）"""
+    pos = f.tell()
+    size = f.seek(0, os.SEEK_END)
+    f.seek(pos)
+    return size
+
+
+def _apply_edit_plan(image_path, plan):
+    """把规划好的修改写入文件；plan 为 None 表示元数据未变化，不改写文件"""
+    if plan is None:
+        _prof_count('unchanged_skips')
+    elif plan.patches is not None:
+        for offset, data in plan.patches:
+            _patch_in_place(image_path, offset, data)
+    else:
+        _write_spliced(image_path, plan.pieces)
+
+
+# ============================================================
+# XMP 数据包
+# ============================================================
+
+# 字段的存储格式: xmp 写入 XMP 数据包（默认）；legacy 沿用 EXIF 标签 / PNG 文本块
+METADATA_FORMATS = ('xmp', 'legacy')
+METADATA_FORMAT = 'xmp'
+
+XMP_NS_X = 'adobe:ns:meta/'
+XMP_NS_RDF = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#'
+XMP_NS_DC = 'http://purl.org/dc/elements/1.1/'
+XMP_NS_EXIF = 'http://ns.adobe.com/exif/1.0/'
+XMP_NS_RIGHTS = 'http://ns.adobe.com/xap/1.0/rights/'
+XMP_NS_XML = 'http://www.w3.org/XML/1998/namespace'
+XMP_PREFIXES = {'x': XMP_NS_X, 'rdf': XMP_NS_RDF, 'dc': XMP_NS_DC,
+                'exif': XMP_NS_EXIF, 'xmpRights': XMP_NS_RIGHTS}
+# 字段 -> (命名空间, 属性名, 是否为多语言文本 rdf:Alt)
+XMP_PROPERTIES = {
+    'Comment': (XMP_NS_EXIF, 'UserComment', True),
+    'Description': (XMP_NS_DC, 'description', True),
+    'Source': (XMP_NS_DC, 'source', False),
+    'URL': (XMP_NS_RIGHTS, 'WebStatement', False),
+}
+XMP_PACKET_BEGIN = '<?xpacket begin="\ufeff" id="W5M0MpCehiHzreSzNTczkc9d"?>\n'
+XMP_PACKET_END = '<?xpacket end="w"?>'
+# 新数据包预留的空白填充字节数，之后的修改只要能放进填充就可以原地覆盖
+XMP_PADDING = 2048
+
+
+def set_metadata_format(metadata_format):
+    """设置字段的存储格式（见 METADATA_FORMATS）"""
+    global METADATA_FORMAT
+    if metadata_format not in METADATA_FORMATS:
+        raise ValueError(f"未知的存储格式: {metadata_format}")
+    METADATA_FORMAT = metadata_format
+
+
+def _xmp_body(packet):
+    """去掉 <?xpacket?> 包装和填充，返回 XML 文本"""
+    text = bytes(packet).decode('utf-8', errors='replace')
+    if text.startswith('<?xpacket'):
+        text = text[text.find('?>') + 2:]
+    end = text.rfind('<?xpacket')
+    if end != -1:
+        text = text[:end]
+    return text.strip()
+
+
+def _xmp_padding(size):
+    """生成 size 字节的空白填充（每 100 字节换一次行）"""
+    return (' ' * 99 + '\n') * (size // 100) + ' ' * (size % 100)
+
+
+def _xmp_descriptions(root):
+    """返回数据包中所有的 rdf:Description 元素"""
+    return list(root.iter(f'{{{XMP_NS_RDF}}}Description'))
+
+
+def _parse_xmp_fields(packet):
+    """从 XMP 数据包中取出 Comment/Description/Source/URL，多语言文本优先取 x-default"""
+    packet = bytes(packet)
+    # 不含相关命名空间的数据包（如只有编辑历史）不必解析 XML
+    if not any(ns.encode() in packet for ns in (XMP_NS_DC, XMP_NS_EXIF, XMP_NS_RIGHTS)):
+        return {}
+    from xml.etree import ElementTree
+    
+    try:
+        root = ElementTree.fromstring(_xmp_body(packet))
+    except ElementTree.ParseError:
+        return {}
+    
+    fields = {}
+    for description in _xmp_descriptions(root):
+        for key, (ns, name, _) in XMP_PROPERTIES.items():
+            tag = f'{{{ns}}}{name}'
+            if key in fields:
+                continue
+            if tag in description.attrib:
+                fields[key] = description.attrib[tag]
+                continue
+            element = description.find(tag)
+            if element is None:
+                continue
+            items = list(element.iter(f'{{{XMP_NS_RDF}}}li'))
+            if not items:
+                fields[key] = (element.text or '').strip()
+                continue
+            default = [li for li in items if li.get(f'{{{XMP_NS_XML}}}lang') == 'x-default']
+            fields[key] = (default or items)[0].text or ''
+    return fields
+
+
+def _build_xmp_packet(metadata, existing=None, size=None, padding=XMP_PADDING, explicit=False):
+    """
+    生成写入 metadata 后的 XMP 数据包
+    existing: 原有数据包，其中其他软件写入的属性原样保留
+    size: 指定时生成恰好 size 字节的数据包（用原有填充吸收长度变化），放不下时返回 None；
+          未指定时预留 padding 字节的填充，数据包中没有任何属性时返回 b''（删除数据包）
+    explicit: 为 True 时空字段也写成空属性（merge 边车模式用它覆盖图片内嵌的值）
+    字段与 existing 中的值完全相同时直接返回 existing
+    """
+    wanted = {key: metadata.get(key) or '' for key in METADATA_KEYS}
+    if existing is not None:
+        current = _parse_xmp_fields(existing)
+        if current == {key: value for key, value in wanted.items() if value or explicit}:
+            return existing
+    
+    from xml.etree import ElementTree
+    
+    for prefix, ns in XMP_PREFIXES.items():
+        ElementTree.register_namespace(prefix, ns)
+    rdf = f'{{{XMP_NS_RDF}}}'
+    
+    root = None
+    if existing is not None:
+        try:
+            root = ElementTree.fromstring(_xmp_body(existing))
+        except ElementTree.ParseError:
+            root = None
+    if root is None:
+        root = ElementTree.Element(f'{{{XMP_NS_X}}}xmpmeta')
+    rdf_root = next(root.iter(f'{rdf}RDF'), None)
+    if rdf_root is None:
+        rdf_root = ElementTree.SubElement(root, f'{rdf}RDF')
+    
+    # 先删除所有 rdf:Description 中本工具的属性（属性和子元素两种写法），再写入第一个 Description
+    descriptions = _xmp_descriptions(rdf_root)
+    for description in descriptions:
+        for ns, name, _ in XMP_PROPERTIES.values():
+            tag = f'{{{ns}}}{name}'
+            description.attrib.pop(tag, None)
+            for element in description.findall(tag):
+                description.remove(element)
+    if descriptions:
+        target = descriptions[0]
+    else:
+        target = ElementTree.SubElement(rdf_root, f'{rdf}Description', {f'{rdf}about': ''})
+    
+    for key, (ns, name, alt) in XMP_PROPERTIES.items():
+        if not wanted[key] and not explicit:
+            continue
+        element = ElementTree.SubElement(target, f'{{{ns}}}{name}')
+        if alt:
+            li = ElementTree.SubElement(ElementTree.SubElement(element, f'{rdf}Alt'), f'{rdf}li',
+                                        {f'{{{XMP_NS_XML}}}lang': 'x-default'})
+            li.text = wanted[key]
+        else:
+            element.text = wanted[key]
+    
+    # 没有任何属性的 Description 不再保留
+    for description in _xmp_descriptions(rdf_root):
+        if not len(description) and not set(description.attrib) - {f'{rdf}about'}:
+            rdf_root.remove(description)
+    if size is None and not len(rdf_root):
+        return b''
+    
+    content = (XMP_PACKET_BEGIN + ElementTree.tostring(root, encoding='unicode') + '\n').encode('utf-8')
+    end = XMP_PACKET_END.encode('utf-8')
+    if size is not None:
+        padding = size - len(content) - len(end)
+    if padding < 0:
+        return None
+    return content + _xmp_padding(padding).encode('ascii') + end
+
+
+def _plan_xmp(metadata, old_packet, has_legacy, padding=XMP_PADDING):
+    """
+    按当前存储格式计算 XMP 数据包的新内容，返回 (packet, in_place)
+    packet: _KEEP 保持不变 / None 删除 / bytes 新数据包
+    in_place: 为 True 时 packet 与原数据包等长（或完全相同），可以直接原地覆盖
+    has_legacy: 文件中是否还有旧格式（EXIF 标签 / PNG 文本块）的字段，有则需要整体改写以删除它们
+    padding: 新数据包预留的填充字节数
+    """
+    if METADATA_FORMAT == 'xmp':
+        if old_packet is not None and not has_legacy:
+            packet = _build_xmp_packet(metadata, old_packet, size=len(old_packet))
+            if packet is not None:
+                return packet, True
+        return _build_xmp_packet(metadata, old_packet, padding=padding) or None, False
+    if old_packet is not None and _parse_xmp_fields(old_packet):
+        # legacy 格式下删除 XMP 中本工具的旧值，避免读取时覆盖新写入的字段
+        return _build_xmp_packet({}, old_packet) or None, False
+    return _KEEP, False
+
+
+def _merge_xmp_fields(fields, xmp_fields):
+    """合并两种表示：XMP 中的非空值优先于 EXIF 标签 / PNG 文本块"""
+    fields.update({key: value for key, value in xmp_fields.items() if value})
+    return fields
+
+
+def _build_exif_piexif(exif_segment_payload, metadata):
+    """使用 piexif 根据现有 EXIF 数据生成新的 EXIF 字节，无需保留时返回 None"""
+    exif_dict = {}
+    
+    # 读取现有 EXIF 数据
+    try:
+        exif_dict = piexif.load(exif_segment_payload) if exif_segment_payload else None
+    except Exception:
+        exif_dict = None
+    if not exif_dict:
+        exif_dict = {"0th": {}, "Exif": {}, "GPS": {}, "1st": {}, "thumbnail": None}
+    
+    # 确保必要的字典存在
+    if "Exif" not in exif_dict:
+        exif_dict["Exif"] = {}
+    if "0th" not in exif_dict:
+        exif_dict["0th"] = {}
+    
+    # 更新 Comment (UserComment)
+    if metadata.get('Comment'):
+        unicode_comment = b"UNICODE\0" + metadata['Comment'].encode('utf-8')
+        exif_dict["Exif"][piexif.ExifIFD.UserComment] = unicode_comment
+    else:
+        # 删除 Comment
+        exif_dict["Exif"].pop(piexif.ExifIFD.UserComment, None)
+    
+    # 更新 Description (ImageDescription)
+    if metadata.get('Description'):
+        exif_dict["0th"][piexif.ImageIFD.ImageDescription] = metadata['Description'].encode('utf-8')
+    else:
+        exif_dict["0th"].pop(piexif.ImageIFD.ImageDescription, None)
+    
+    # 注意：JPEG EXIF 不支持 Source 和 URL 字段，我们使用其他字段存储
+    # 使用 Artist 存储 Source
+    if metadata.get('Source'):
+        exif_dict["0th"][piexif.ImageIFD.Artist] = metadata['Source'].encode('utf-8')
+    else:
+        exif_dict["0th"].pop(piexif.ImageIFD.Artist, None)
+    
+    # 使用 Copyright 存储 URL
+    if metadata.get('URL'):
+        exif_dict["0th"][piexif.ImageIFD.Copyright] = metadata['URL'].encode('utf-8')
+    else:
+        exif_dict["0th"].pop(piexif.ImageIFD.Copyright, None)
+    
+    # 清理空的字典
+    if not exif_dict["Exif"]:
+        exif_dict.pop("Exif", None)
+    if not exif_dict["0th"]:
+        exif_dict.pop("0th", None)
+    
+    return piexif.dump(exif_dict) if exif_dict.get("0th") or exif_dict.get("Exif") else None
+
+
+def _build_exif_pil(exif_segment_payload, metadata):
+    """未安装 piexif 时使用 PIL 的 Exif 容器生成 EXIF 字节（不打开图像、不解码像素）"""
+    from PIL import Image
+    
+    exif = Image.Exif()
+    if exif_segment_payload:
+        exif.load(exif_segment_payload)
+    
+    for tag, key in ((EXIF_TAG_IMAGE_DESCRIPTION, 'Description'), (EXIF_TAG_ARTIST, 'Source'),
+                     (EXIF_TAG_COPYRIGHT, 'URL')):
+        if metadata.get(key):
+            exif[tag] = metadata[key]
+        else:
+            exif.pop(tag, None)
+    
+    exif_ifd = exif.get_ifd(EXIF_TAG_EXIF_IFD)
+    if metadata.get('Comment'):
+        exif_ifd[EXIF_TAG_USER_COMMENT] = b"UNICODE\0" + metadata['Comment'].encode('utf-8')
+    else:
+        exif_ifd.pop(EXIF_TAG_USER_COMMENT, None)
+    if not exif_ifd:
+        exif.pop(EXIF_TAG_EXIF_IFD, None)
+    
+    if not len(exif):
+        return None
+    exif_bytes = exif.tobytes()
+    if not exif_bytes.startswith(EXIF_HEADER):
+        exif_bytes = EXIF_HEADER + exif_bytes
+    return exif_bytes
+
+
+def _build_exif(exif_segment_payload, metadata):
+    """生成新的 EXIF 字节（优先使用 piexif），无需保留时返回 None"""
+    if _load_piexif():
+        return _build_exif_piexif(exif_segment_payload, metadata)
+    # 使用 PIL 的基础方法
+    return _build_exif_pil(exif_segment_payload, metadata)
+
+
+def _legacy_exif_fields(exif_segment_payload):
+    """EXIF 中以旧格式保存的字段（标签存在即算，值可能为空）"""
+    if not exif_segment_payload or exif_segment_payload[:6] != EXIF_HEADER:
+        return {}
+    return _parse_exif_fields(memoryview(exif_segment_payload)[6:])
+
+
+def _plan_jpeg_edit(f, metadata):
+    """
+    规划 JPEG 元数据的修改，返回 EditPlan，无需修改时返回 None
+    xmp 格式写入 APP1/XMP 段，新值能放进原数据包的填充时只覆盖数据包；legacy 格式写入 APP1/EXIF 段
+    SOS 及之后的压缩数据作为原文件区间引用，不解码也不重新压缩像素
+    """
+    start = _prof_start()
+    header, segments = _read_jpeg_header(f)
+    file_size = _stream_size(f)
+    _prof_end('open', start, len(header))
+    
+    start = _prof_start()
+    existing = _find_exif_segment(header, segments)
+    exif_payload = header[existing[1] + 4:existing[2]] if existing else None
+    xmp_segment = _find_app1_segment(header, segments, XMP_JPEG_HEADER)
+    packet_offset = xmp_segment[1] + 4 + len(XMP_JPEG_HEADER) if xmp_segment else None
+    old_packet = header[packet_offset:xmp_segment[2]] if xmp_segment else None
+    
+    if METADATA_FORMAT == 'xmp':
+        legacy = _legacy_exif_fields(exif_payload)
+        packet, in_place = _plan_xmp(metadata, old_packet, bool(legacy))
+        if in_place:
+            _prof_end('build', start)
+            return EditPlan([(packet_offset, packet)], None) if packet != old_packet else None
+        # 删除 EXIF 中旧格式的字段，其余 EXIF 数据保留
+        exif_bytes = _build_exif(exif_payload, {}) if legacy else _KEEP
+    else:
+        packet, _ = _plan_xmp(metadata, old_packet, False)
+        exif_bytes = _build_exif(exif_payload, metadata)
+    
+    if packet is not _KEEP and packet is not None:
+        packet = XMP_JPEG_HEADER + packet
+    new_header = _build_jpeg_header(header, segments, exif_bytes, packet)
+    _prof_end('build', start, len(new_header))
+    if new_header == header:
+        # 元数据未变化，不改写文件
+        return None
+    return EditPlan(None, [new_header, (len(header), file_size)])
+
+
+def update_metadata_jpeg(image_path, metadata):
+    """
+    更新 JPEG 图片的元数据
+    metadata: {'Comment': '', 'Description': '', 'Source': '', 'URL': ''}
+    只替换 APP1 段（XMP 数据包能放下时原地覆盖），SOS 及之后的压缩数据逐字节复制
+    """
+    try:
+        with open(image_path, 'rb') as f:
+            plan = _plan_jpeg_edit(f, metadata)
+        _apply_edit_plan(image_path, plan)
+        return True
+            
+    except Exception as e:
+        _report_error(f"更新 JPEG 元数据时出错: {e}")
+        return False
+
+
+# PNG 文件签名与文本块
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_TEXT_CHUNKS = (b'tEXt', b'zTXt', b'iTXt')
+# 本工具管理的文本字段
+METADATA_KEYS = ('Comment', 'Description', 'Source', 'URL')
+# PNG 关键字最长 79 字节，再加上结尾的 NUL
+PNG_MAX_KEYWORD = 80
+# 存放 XMP 数据包的 iTXt 块: 关键字、不压缩、空的语言标签和翻译关键字
+XMP_PNG_KEYWORD = 'XML:com.adobe.xmp'
+XMP_PNG_PREFIX = XMP_PNG_KEYWORD.encode('latin-1') + b'\0\0\0\0\0'
+
+
+def _iter_png_chunks(f, base=0):
+    """
+    逐块扫描 PNG 数据（从文件偏移 base 处的签名开始），只读取 8 字节的块头，块数据直接跳过
+    生成 (chunk_type, start, end)，start/end 为整个块（含长度、类型和 CRC）在文件中的范围
+    """
+    f.seek(base)
+    if f.read(8) != PNG_SIGNATURE:
+        raise ValueError("不是有效的 PNG 文件")
+    
+    pos = base + len(PNG_SIGNATURE)
+    while True:
+        head = f.read(8)
+        if not head:
+            raise ValueError("PNG 文件缺少 IEND 块")
+        if len(head) != 8:
+            raise ValueError("PNG 文件在块头处意外结束")
+        length = int.from_bytes(head[:4], 'big')
+        chunk_type = head[4:8]
+        end = pos + 12 + length
+        yield chunk_type, pos, end
+        if chunk_type == b'IEND':
+            return
+        f.seek(end)
+        pos = end
+
+
+def _png_chunk(chunk_type, data):
+    """组装一个完整的 PNG 块（长度 + 类型 + 数据 + CRC）"""
+    return (len(data).to_bytes(4, 'big') + chunk_type + data
+            + zlib.crc32(chunk_type + data).to_bytes(4, 'big'))
+
+
+def _png_text_chunk(key, value, compress):
+    """
+    按 PIL PngInfo.add_text 的规则生成文本块
+    Latin-1 可表示的文本写入 tEXt（compress 时为 zTXt），否则写入 UTF-8 的 iTXt
+    """
+    keyword = key.encode('latin-1')
+    try:
+        text = value.encode('latin-1')
+    except UnicodeEncodeError:
+        text = value.encode('utf-8')
+        if compress:
+            return _png_chunk(b'iTXt', keyword + b'\0\x01\x00' + b'\0' + b'\0' + zlib.compress(text))
+        return _png_chunk(b'iTXt', keyword + b'\0\x00\x00' + b'\0' + b'\0' + text)
+    
+    if compress:
+        return _png_chunk(b'zTXt', keyword + b'\0\x00' + zlib.compress(text))
+    return _png_chunk(b'tEXt', keyword + b'\0' + text)
+
+
+def _split_itxt(data):
+    """拆分 iTXt 块数据，返回 (文本, 文本在块数据中的偏移)；压缩的文本解压后返回，偏移为 None"""
+    keyword_end = data.index(b'\0')
+    compressed = data[keyword_end + 1] == 1
+    language_end = data.index(b'\0', keyword_end + 3)
+    offset = data.index(b'\0', language_end + 1) + 1
+    if compressed:
+        return zlib.decompress(data[offset:]), None
+    return bytes(data[offset:]), offset
+
+
+def _plan_png_text_edit(f, metadata, base=0, in_place=True, padding=XMP_PADDING):
+    """
+    规划 PNG 文本块的修改（PNG 数据从文件偏移 base 处开始），padding 为新 XMP 数据包预留的填充
+    返回 (pieces, changed, patch)：pieces 可直接交给 _write_spliced，changed 为 False 表示无需改写；
+    patch 不为 None 时为 (offset, data)，表示只需原地覆盖 XMP 数据包及其块 CRC，不必改写整个文件
+    （此时 pieces 为 None）；in_place 为 False 时总是规划整体改写
+    """
+    prof_start = _prof_start()
+    legacy_chunks = []
+    xmp_chunk = None
+    chunks = []
+    for chunk_type, start, end in _iter_png_chunks(f, base):
+        managed = False
+        if chunk_type in PNG_TEXT_CHUNKS:
+            f.seek(start + 8)
+            keyword = f.read(min(end - start - 12, PNG_MAX_KEYWORD)).split(b'\0', 1)[0].decode('latin-1')
+            if keyword in METADATA_KEYS:
+                managed = True
+                f.seek(start)
+                legacy_chunks.append(f.read(end - start))
+            elif keyword == XMP_PNG_KEYWORD and chunk_type == b'iTXt' and xmp_chunk is None:
+                f.seek(start)
+                xmp_chunk = (start, f.read(end - start))
+        chunks.append((chunk_type, start, end, managed))
+    
+    old_packet = None
+    packet_offset = None
+    if xmp_chunk is not None:
+        start, chunk = xmp_chunk
+        old_packet, text_offset = _split_itxt(chunk[8:-4])
+        if text_offset is not None:
+            packet_offset = start + 8 + text_offset
+    
+    _prof_end('parse', prof_start, end - base)
+    
+    prof_start = _prof_start()
+    # 压缩的 XMP 数据包无法原地覆盖，与有旧格式字段时一样整体改写
+    packet, in_place = _plan_xmp(metadata, old_packet,
+                                 bool(legacy_chunks) or packet_offset is None or not in_place, padding)
+    if in_place:
+        start, chunk = xmp_chunk
+        crc = zlib.crc32(chunk[4:8] + chunk[8:packet_offset - start] + packet).to_bytes(4, 'big')
+        _prof_end('build', prof_start, len(packet))
+        return None, packet != old_packet, (packet_offset, packet + crc)
+    
+    if METADATA_FORMAT == 'xmp':
+        new_chunks = []
+    else:
+        # 检查是否有非 ASCII 字符
+        has_non_ascii = any(any(ord(c) > 127 for c in value) for value in metadata.values() if value)
+        # 有值则生成新文本块；值为空则不生成，即删除该字段
+        new_chunks = [
+            _png_text_chunk(key, metadata[key], compress=has_non_ascii)
+            for key in METADATA_KEYS if metadata.get(key)
+        ]
+    old_chunks = list(legacy_chunks)
+    if packet is not _KEEP:
+        old_chunks.append(xmp_chunk[1] if xmp_chunk else None)
+        new_chunks.append(_png_chunk(b'iTXt', XMP_PNG_PREFIX + packet) if packet else None)
+    
+    pieces = []
+    insert_at = None
+    copy_start = base
+    for chunk_type, start, end, managed in chunks:
+        if packet is not _KEEP and xmp_chunk is not None and start == xmp_chunk[0]:
+            managed = True
+        
+        if chunk_type == b'IDAT' and insert_at is None:
+            # 新文本块放在第一个 IDAT 之前
+            if copy_start is not None:
+                pieces.append((copy_start, start))
+                copy_start = None
+            insert_at = len(pieces)
+            pieces.append(b'')
+        
+        if managed:
+            if copy_start is not None:
+                pieces.append((copy_start, start))
+                copy_start = None
+        elif copy_start is None:
+            copy_start = start
+    
+    if copy_start is not None:
+        pieces.append((copy_start, end))
+    
+    if insert_at is None:
+        raise ValueError("PNG 文件缺少 IDAT 块")
+    
+    pieces[insert_at] = b''.join(chunk for chunk in new_chunks if chunk)
+    _prof_end('build', prof_start, len(pieces[insert_at]))
+    return pieces, old_chunks != new_chunks, None
+
+
+def _pieces_size(pieces):
+    """计算拼接结果的总字节数"""
+    return sum(len(p) if isinstance(p, (bytes, bytearray, memoryview)) else p[1] - p[0] for p in pieces)
+
+
+def _plan_png_edit(f, metadata):
+    """规划 PNG 文本元数据的修改，返回 EditPlan，无需修改时返回 None"""
+    pieces, changed, patch = _plan_png_text_edit(f, metadata)
+    if not changed:
+        return None
+    if patch is not None:
+        return EditPlan([patch], None)
+    return EditPlan(None, pieces)
+
+
+def update_metadata_png(image_path, metadata):
+    """
+    更新 PNG 图片的文本元数据
+    metadata: {'Comment': '', 'Description': '', 'Source': '', 'URL': ''}
+    只替换、添加或删除这四个字段对应的文本块，IDAT 及其他所有块原样复制
+    """
+    try:
+        with open(image_path, 'rb') as f:
+            plan = _plan_png_edit(f, metadata)
+        _apply_edit_plan(image_path, plan)
+        return True
+        
+    except Exception as e:
+        _report_error(f"更新 PNG 元数据时出错: {e}")
+        return False
+
+
+# WebP (RIFF) 容器
+WEBP_VP8X_FLAG_XMP = 0x04
+WEBP_VP8X_FLAG_EXIF = 0x08
+WEBP_VP8X_FLAG_ALPHA = 0x10
+
+
+def _iter_riff_chunks(f):
+    """
+    扫描 WebP 的 RIFF 块，只读取 8 字节的块头
+    生成 (fourcc, start, end)，end 包含奇数长度块的填充字节
+    """
+    head = f.read(12)
+    if len(head) != 12 or head[:4] != b'RIFF' or head[8:12] != b'WEBP':
+        raise ValueError("不是有效的 WebP 文件")
+    riff_end = 8 + int.from_bytes(head[4:8], 'little')
+    
+    pos = 12
+    while pos + 8 <= riff_end:
+        f.seek(pos)
+        chunk_head = f.read(8)
+        if len(chunk_head) != 8:
+            raise ValueError("WebP 文件在块头处意外结束")
+        size = int.from_bytes(chunk_head[4:8], 'little')
+        end = pos + 8 + size + (size & 1)
+        yield chunk_head[:4], pos, end
+        pos = end
+
+
+def _webp_canvas(fourcc, data):
+    """从 VP8 / VP8L 码流头取得画布尺寸和是否含 Alpha，返回 (width, height, alpha)"""
+    if fourcc == b'VP8 ':
+        if data[3:6] != b'\x9d\x01\x2a':
+            raise ValueError("VP8 码流头无效")
+        width = int.from_bytes(data[6:8], 'little') & 0x3FFF
+        height = int.from_bytes(data[8:10], 'little') & 0x3FFF
+        return width, height, False
+    if fourcc == b'VP8L':
+        if data[0] != 0x2F:
+            raise ValueError("VP8L 码流头无效")
+        bits = int.from_bytes(data[1:5], 'little')
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1, bool((bits >> 28) & 1)
+    raise ValueError(f"无法识别的 WebP 图像块: {fourcc!r}")
+
+
+def _riff_chunk(fourcc, data):
+    """组装一个 RIFF 块（奇数长度时补一个填充字节）"""
+    return fourcc + len(data).to_bytes(4, 'little') + data + (b'\0' if len(data) & 1 else b'')
+
+
+def _plan_webp_edit(f, metadata):
+    """
+    规划 WebP 元数据的修改，返回 EditPlan，无需修改时返回 None
+    xmp 格式写入 XMP 块（能放进原数据包时原地覆盖），legacy 格式写入 EXIF 块；
+    只替换元数据块、调整 VP8X 标志位和 RIFF 长度，图像码流原样引用，不重新编码
+    简单格式（无 VP8X）的文件需要写入元数据时会补上 VP8X 块
+    """
+    prof_start = _prof_start()
+    chunks = list(_iter_riff_chunks(f))
+    file_size = _stream_size(f)
+    
+    def read_chunk(start, end):
+        f.seek(start)
+        return f.read(end - start)
+    
+    vp8x = None
+    found = {b'EXIF': [], b'XMP ': []}
+    image_chunk = None
+    for fourcc, start, end in chunks:
+        if fourcc == b'VP8X':
+            vp8x = read_chunk(start, end)
+        elif fourcc in found:
+            found[fourcc].append((start, end))
+        elif fourcc in (b'VP8 ', b'VP8L') and image_chunk is None:
+            image_chunk = (fourcc, start, end)
+    
+    # 各元数据块的第一个块及其负载
+    old_chunks = {fourcc: read_chunk(*spans[0]) for fourcc, spans in found.items() if spans}
+    payloads = {fourcc: chunk[8:8 + int.from_bytes(chunk[4:8], 'little')]
+                for fourcc, chunk in old_chunks.items()}
+    exif_payload = None
+    if b'EXIF' in payloads:
+        tiff = payloads[b'EXIF']
+        exif_payload = tiff if tiff.startswith(EXIF_HEADER) else EXIF_HEADER + tiff
+    old_packet = payloads.get(b'XMP ')
+    _prof_end('parse', prof_start, file_size)
+    
+    prof_start = _prof_start()
+    if METADATA_FORMAT == 'xmp':
+        legacy = _legacy_exif_fields(exif_payload)
+        packet, in_place = _plan_xmp(metadata, old_packet, bool(legacy) or len(found[b'XMP ']) > 1)
+        if in_place:
+            _prof_end('build', prof_start)
+            if packet == old_packet:
+                return None
+            return EditPlan([(found[b'XMP '][0][0] + 8, packet)], None)
+        exif_bytes = _build_exif(exif_payload, {}) if legacy else _KEEP
+    else:
+        packet, _ = _plan_xmp(metadata, old_packet, False)
+        exif_bytes = _build_exif(exif_payload, metadata)
+    
+    # 新的元数据块: fourcc -> 完整的块（None 表示删除），未列出的块保持不变
+    # WebP 的 EXIF 块直接存放 TIFF 数据，不带 'Exif\0\0' 前缀
+    new_chunks = {}
+    if exif_bytes is not _KEEP:
+        new_chunks[b'EXIF'] = _riff_chunk(b'EXIF', exif_bytes[len(EXIF_HEADER):]) if exif_bytes else None
+    if packet is not _KEEP:
+        new_chunks[b'XMP '] = _riff_chunk(b'XMP ', packet) if packet else None
+    for fourcc in list(new_chunks):
+        if new_chunks[fourcc] == old_chunks.get(fourcc) and len(found[fourcc]) <= 1:
+            del new_chunks[fourcc]
+    _prof_end('build', prof_start)
+    if not new_chunks:
+        return None
+    
+    if vp8x is None:
+        if not any(new_chunks.values()):
+            return None
+        if image_chunk is None:
+            raise ValueError("WebP 文件缺少图像数据块")
+        fourcc, start, end = image_chunk
+        width, height, alpha = _webp_canvas(fourcc, read_chunk(start + 8, min(end, start + 18)))
+        vp8x = _riff_chunk(b'VP8X', bytes([WEBP_VP8X_FLAG_ALPHA if alpha else 0]) + b'\0\0\0'
+                           + (width - 1).to_bytes(3, 'little') + (height - 1).to_bytes(3, 'little'))
+    
+    flags = vp8x[8]
+    for fourcc, flag in ((b'EXIF', WEBP_VP8X_FLAG_EXIF), (b'XMP ', WEBP_VP8X_FLAG_XMP)):
+        if fourcc in new_chunks:
+            flags = flags | flag if new_chunks[fourcc] else flags & ~flag
+    vp8x = vp8x[:8] + bytes([flags]) + vp8x[9:]
+    
+    # 块顺序: VP8X、原有块，元数据块放在原位置；原来没有的 EXIF 放在 XMP 之前，XMP 放在末尾
+    body = [vp8x]
+    pending = dict(new_chunks)
+    for fourcc, start, end in chunks:
+        if fourcc == b'VP8X':
+            continue
+        if fourcc in new_chunks:
+            chunk = pending.pop(fourcc, None)
+            if chunk:
+                body.append(chunk)
+            continue
+        if fourcc == b'XMP ' and pending.get(b'EXIF'):
+            body.append(pending.pop(b'EXIF'))
+        body.append((start, end))
+    for fourcc in (b'EXIF', b'XMP '):
+        if pending.get(fourcc):
+            body.append(pending[fourcc])
+    
+    riff_size = 4 + _pieces_size(body)
+    pieces = [b'RIFF' + riff_size.to_bytes(4, 'little') + b'WEBP'] + body
+    # RIFF 之后的附加数据原样保留
+    riff_end = chunks[-1][2] if chunks else 12
+    if riff_end < file_size:
+        pieces.append((riff_end, file_size))
+    return EditPlan(None, pieces)
+
+
+def update_metadata_webp(image_path, metadata):
+    """
+    更新 WebP 图片的元数据
+    metadata: {'Comment': '', 'Description': '', 'Source': '', 'URL': ''}
+    """
+    try:
+        with open(image_path, 'rb') as f:
+            plan = _plan_webp_edit(f, metadata)
+        _apply_edit_plan(image_path, plan)
+        return True
+    
+    except Exception as e:
+        _report_error(f"更新 WebP 元数据时出错: {e}")
+        return False
+
+
+def _read_ico_directory(f):
+    """读取 ICO 目录，返回 [(entry_bytes, offset, size), ...]"""
+    head = f.read(6)
+    if len(head) != 6 or head[:4] != b'\0\0\x01\0':
+        raise ValueError("不是有效的 ICO 文件")
+    count = int.from_bytes(head[4:6], 'little')
+    directory = f.read(16 * count)
+    if len(directory) != 16 * count:
+        raise ValueError("ICO 目录不完整")
+    entries = []
+    for i in range(count):
+        entry = directory[i * 16:(i + 1) * 16]
+        entries.append((entry, int.from_bytes(entry[12:16], 'little'), int.from_bytes(entry[8:12], 'little')))
+    return entries
+
+
+# ICO 中每个 PNG 图像都带一份 XMP 数据包，图标通常只有几 KB，整体改写的代价很小，
+# 为原地修改预留填充反而会让文件成倍变大，因此不预留
+ICO_XMP_PADDING = 0
+
+
+def _plan_ico_edit(f, metadata):
+    """
+    规划 ICO 图标中内嵌 PNG 图像的元数据修改，返回 EditPlan，无需修改时返回 None
+    每个 PNG 图像都走与 PNG 相同的块级修改，BMP 图像原样复制，最后重新计算目录中的大小和偏移
+    """
+    entries = _read_ico_directory(f)
+    plans = []
+    patches = []
+    changed = False
+    has_png = False
+    for entry, offset, size in entries:
+        f.seek(offset)
+        if f.read(8) == PNG_SIGNATURE:
+            has_png = True
+            pieces, entry_changed, patch = _plan_png_text_edit(f, metadata, offset, padding=ICO_XMP_PADDING)
+            changed = changed or entry_changed
+            patches.append((patch, entry_changed))
+        else:
+            pieces = [(offset, offset + size)]
+        plans.append((entry, pieces))
+    
+    if not has_png:
+        if any(metadata.values()):
+            raise ValueError("ICO 文件中没有 PNG 图像，无法保存元数据")
+        return None
+    if not changed:
+        return None
+    
+    if all(patch is not None for patch, _ in patches):
+        # 每个 PNG 图像的 XMP 数据包都能原地覆盖，目录和偏移都不变
+        return EditPlan([patch for patch, entry_changed in patches if entry_changed], None)
+    if any(patch is not None for patch, _ in patches):
+        # 部分图像只给出了原地修改方案，需要为它们重新规划整体改写
+        plans = [(entry, _plan_png_text_edit(f, metadata, offset, in_place=False, padding=ICO_XMP_PADDING)[0]
+                  if pieces is None else pieces)
+                 for (entry, pieces), (_, offset, _) in zip(plans, entries)]
+    
+    # 图像数据按目录顺序紧接在目录之后重新排列
+    directory = bytearray(b'\0\0\x01\0' + len(plans).to_bytes(2, 'little'))
+    offset = 6 + 16 * len(plans)
+    body = []
+    for entry, pieces in plans:
+        size = _pieces_size(pieces)
+        directory += entry[:8] + size.to_bytes(4, 'little') + offset.to_bytes(4, 'little')
+        body.extend(pieces)
+        offset += size
+    return EditPlan(None, [bytes(directory)] + body)
+
+
+def update_metadata_ico(image_path, metadata):
+    """
+    更新 ICO 图标中内嵌 PNG 图像的文本元数据
+    metadata: {'Comment': '', 'Description': '', 'Source': '', 'URL': ''}
+    """
+    try:
+        with open(image_path, 'rb') as f:
+            plan = _plan_ico_edit(f, metadata)
+        _apply_edit_plan(image_path, plan)
+        return True
+    
+    except Exception as e:
+        _report_error(f"更新 ICO 元数据时出错: {e}")
+        return False
+
+
+# EXIF 中本工具使用的标签
+EXIF_TAG_IMAGE_DESCRIPTION = 0x010E
+EXIF_TAG_ARTIST = 0x013B
+EXIF_TAG_COPYRIGHT = 0x8298
+EXIF_TAG_EXIF_IFD = 0x8769
+EXIF_TAG_USER_COMMENT = 0x9286
+# TIFF 数据类型对应的单个值字节数
+TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8}
+
+
+def _read_ifd_tags(tiff, offset, byteorder, wanted):
+    """
+    读取 TIFF IFD 中指定标签的原始值，其余条目直接跳过
+    返回 {tag: bytes}
+    """
+    values = {}
+    count = int.from_bytes(tiff[offset:offset + 2], byteorder)
+    for i in range(count):
+        entry = offset + 2 + i * 12
+        if entry + 12 > len(tiff):
+            break
+        tag = int.from_bytes(tiff[entry:entry + 2], byteorder)
+        if tag not in wanted:
+            continue
+        value_type = int.from_bytes(tiff[entry + 2:entry + 4], byteorder)
+        size = TIFF_TYPE_SIZES.get(value_type, 1) * int.from_bytes(tiff[entry + 4:entry + 8], byteorder)
+        if size <= 4:
+            values[tag] = bytes(tiff[entry + 8:entry + 8 + size])
+        else:
+            pointer = int.from_bytes(tiff[entry + 8:entry + 12], byteorder)
+            values[tag] = bytes(tiff[pointer:pointer + size])
+    return values
+
+
+def _decode_exif_ascii(raw):
+    """解码 ASCII 类型的 EXIF 值（去掉结尾的 NUL）"""
+    if raw.endswith(b'\0'):
+        raw = raw[:-1]
+    return raw.decode('utf-8', errors='ignore')
+
+
+def _decode_user_comment(raw):
+    """解码 UserComment，兼容 'UNICODE\\0' 前缀"""
+    if raw.startswith(b"UNICODE\0"):
+        return raw[8:].decode('utf-8', errors='ignore')
+    return raw.decode('utf-8', errors='ignore')
+
+
+def _read_jpeg_fields(buf):
+    """
+    从 JPEG 缓冲区读取字段：只遍历 SOS 之前的 APPn 段，EXIF 段中仅解析 IFD0 和 Exif IFD 中的四个标签
+    （缩略图和厂商注释不会被读取），XMP 段中的值优先
+    """
+    fields = {}
+    xmp_fields = {}
+    if buf[:2] != JPEG_SOI:
+        raise ValueError("不是有效的 JPEG 文件")
+    
+    pos = 2
+    size = len(buf)
+    while True:
+        # 损坏或截断的文件报错，而不是当作"没有元数据"（否则写回时会清空字段）
+        if pos + 4 > size:
+            raise ValueError("JPEG 文件在图像数据之前被截断")
+        if buf[pos] != 0xFF:
+            raise ValueError(f"JPEG 段结构损坏（偏移 {pos}）")
+        marker = buf[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker in (JPEG_SOS, JPEG_EOI):
+            break
+        if marker in JPEG_STANDALONE_MARKERS:
+            pos += 2
+            continue
+        length = int.from_bytes(buf[pos + 2:pos + 4], 'big')
+        if marker == JPEG_APP1 and buf[pos + 4:pos + 10] == EXIF_HEADER and not fields:
+            tiff = memoryview(buf)[pos + 10:pos + 2 + length]
+            try:
+                fields = _parse_exif_fields(tiff)
+            finally:
+                tiff.release()
+        elif marker == JPEG_APP1 and buf[pos + 4:pos + 4 + len(XMP_JPEG_HEADER)] == XMP_JPEG_HEADER:
+            xmp_fields = _parse_xmp_fields(buf[pos + 4 + len(XMP_JPEG_HEADER):pos + 2 + length])
+        pos += 2 + length
+    return _merge_xmp_fields(fields, xmp_fields)
+
+
+def _parse_exif_fields(tiff):
+    """从 TIFF 结构中取出 Comment/Description/Source/URL"""
+    fields = {}
+    byteorder = {b'II': 'little', b'MM': 'big'}.get(bytes(tiff[:2]))
+    if byteorder is None:
+        return fields
+    
+    ifd0 = int.from_bytes(tiff[4:8], byteorder)
+    tags = _read_ifd_tags(tiff, ifd0, byteorder, {
+        EXIF_TAG_IMAGE_DESCRIPTION, EXIF_TAG_ARTIST, EXIF_TAG_COPYRIGHT, EXIF_TAG_EXIF_IFD,
+    })
+    if EXIF_TAG_IMAGE_DESCRIPTION in tags:
+        fields['Description'] = _decode_exif_ascii(tags[EXIF_TAG_IMAGE_DESCRIPTION])
+    # Source 和 URL 分别存放在 Artist 和 Copyright 中（见 update_metadata_jpeg）
+    if EXIF_TAG_ARTIST in tags:
+        fields['Source'] = _decode_exif_ascii(tags[EXIF_TAG_ARTIST])
+    if EXIF_TAG_COPYRIGHT in tags:
+        fields['URL'] = _decode_exif_ascii(tags[EXIF_TAG_COPYRIGHT])
+    
+    if EXIF_TAG_EXIF_IFD in tags:
+        exif_ifd = int.from_bytes(tags[EXIF_TAG_EXIF_IFD][:4], byteorder)
+        exif_tags = _read_ifd_tags(tiff, exif_ifd, byteorder, {EXIF_TAG_USER_COMMENT})
+        if EXIF_TAG_USER_COMMENT in exif_tags:
+            fields['Comment'] = _decode_user_comment(exif_tags[EXIF_TAG_USER_COMMENT])
+    return fields
+
+
+def _decode_png_text(chunk_type, data):
+    """
+    解码文本块，返回 (keyword, value)
+    只有关键字属于本工具管理的字段时才解压和解码内容，否则 value 为 None
+    """
+    keyword, _, rest = bytes(data[:PNG_MAX_KEYWORD]).partition(b'\0')
+    keyword = keyword.decode('latin-1')
+    if keyword not in METADATA_KEYS:
+        return keyword, None
+    
+    rest = bytes(data[len(keyword) + 1:])
+    if chunk_type == b'tEXt':
+        return keyword, rest.decode('latin-1')
+    if chunk_type == b'zTXt':
+        return keyword, zlib.decompress(rest[1:]).decode('latin-1')
+    # iTXt: 压缩标志、压缩方法、语言标签、翻译关键字、文本
+    compressed = rest[0] == 1
+    _, _, rest = rest[2:].partition(b'\0')
+    _, _, text = rest.partition(b'\0')
+    if compressed:
+        text = zlib.decompress(text)
+    return keyword, text.decode('utf-8')
+
+
+def _read_png_fields(buf):
+    """
+    从 PNG 缓冲区读取文本字段：只读取各块的 8 字节块头，
+    IDAT 等数据块按长度直接跳过，文本块在 IDAT 之前或之后都能找到，XMP 数据包中的值优先
+    """
+    fields = {}
+    xmp_fields = {}
+    if buf[:8] != PNG_SIGNATURE:
+        raise ValueError("不是有效的 PNG 文件")
+    
+    pos = 8
+    size = len(buf)
+    while True:
+        if pos + 8 > size:
+            raise ValueError("PNG 文件被截断（缺少 IEND 块）")
+        length = int.from_bytes(buf[pos:pos + 4], 'big')
+        chunk_type = bytes(buf[pos + 4:pos + 8])
+        if chunk_type == b'IEND':
+            break
+        if chunk_type in PNG_TEXT_CHUNKS:
+            data = memoryview(buf)[pos + 8:pos + 8 + length]
+            try:
+                keyword, value = _decode_png_text(chunk_type, data)
+                if keyword == XMP_PNG_KEYWORD and chunk_type == b'iTXt':
+                    xmp_fields = _parse_xmp_fields(_split_itxt(bytes(data))[0])
+            except Exception:
+                keyword, value = None, None
+            finally:
+                data.release()
+            if value is not None:
+                fields[keyword] = value
+        pos += 12 + length
+    return _merge_xmp_fields(fields, xmp_fields)
+
+
+def _read_webp_fields(buf):
+    """从 WebP 缓冲区读取字段：按 RIFF 块长度跳过图像数据，只解析 EXIF 块中的四个标签和 XMP 块（优先）"""
+    fields = {}
+    xmp_fields = {}
+    if buf[:4] != b'RIFF' or buf[8:12] != b'WEBP':
+        raise ValueError("不是有效的 WebP 文件")
+    
+    pos = 12
+    end = min(len(buf), 8 + int.from_bytes(buf[4:8], 'little'))
+    while pos + 8 <= end:
+        size = int.from_bytes(buf[pos + 4:pos + 8], 'little')
+        fourcc = buf[pos:pos + 4]
+        if fourcc == b'EXIF' and not fields:
+            tiff = memoryview(buf)[pos + 8:pos + 8 + size]
+            try:
+                # 部分软件写入的 EXIF 块带有 'Exif\0\0' 前缀
+                if tiff[:6] == EXIF_HEADER:
+                    tiff = tiff[6:]
+                fields = _parse_exif_fields(tiff)
+            finally:
+                tiff.release()
+        elif fourcc == b'XMP ' and not xmp_fields:
+            xmp_fields = _parse_xmp_fields(buf[pos + 8:pos + 8 + size])
+        pos += 8 + size + (size & 1)
+    return _merge_xmp_fields(fields, xmp_fields)
+
+
+def _read_ico_fields(buf):
+    """从 ICO 缓冲区读取字段：依次读取内嵌的 PNG 图像，取每个字段第一个非空的值"""
+    if buf[:4] != b'\0\0\x01\0':
+        raise ValueError("不是有效的 ICO 文件")
+    
+    fields = {}
+    count = int.from_bytes(buf[4:6], 'little')
+    for i in range(count):
+        entry = 6 + i * 16
+        size = int.from_bytes(buf[entry + 8:entry + 12], 'little')
+        offset = int.from_bytes(buf[entry + 12:entry + 16], 'little')
+        if buf[offset:offset + 8] != PNG_SIGNATURE:
+            continue
+        image = memoryview(buf)[offset:offset + size]
+        try:
+            for key, value in _read_png_fields(image).items():
+                if value and not fields.get(key):
+                    fields[key] = value
+        finally:
+            image.release()
+    return fields
+
+
+def update_metadata(image_path, metadata):
+    """
+    更新图片元数据
+    metadata: {'Comment': '', 'Description': '', 'Source': '', 'URL': ''}
+    边车模式（见 set_sidecar_mode）下只写 .xmp 边车文件，图片本身不做任何改动
+    """
+    image_path = os.fspath(image_path)
+    if SIDECAR_MODE != 'off' and os.path.splitext(image_path)[1].lower() in SIDECAR_EXTENSIONS:
+        return _update_sidecar(image_path, metadata)
+    return _update_embedded_metadata(image_path, metadata)
+
+
+def _update_embedded_metadata(image_path, metadata):
+    """更新图片内嵌的元数据（不考虑边车模式）"""
+    if not os.path.exists(image_path):
+        _report_error(f"文件不存在: {image_path}")
+        return False
+    
+    ext = os.path.splitext(image_path)[1].lower()
+    
+    if ext in ['.jpg', '.jpeg']:
+        return update_metadata_jpeg(image_path, metadata)
+    elif ext == '.png':
+        return update_metadata_png(image_path, metadata)
+    elif ext == '.webp':
+        return update_metadata_webp(image_path, metadata)
+    elif ext == '.ico':
+        return update_metadata_ico(image_path, metadata)
+    else:
+        _report_error(f"不支持的图片格式: {ext}")
+        return False
+
+
+# ============================================================
+# XMP 边车文件
+# ============================================================
+
+# 边车模式: off 只使用图片内嵌的字段（默认）；only 只读写边车文件；
+# merge 读取时用边车中的字段覆盖内嵌的值，写入边车文件
+SIDECAR_MODES = ('off', 'only', 'merge')
+SIDECAR_MODE = 'off'
+# 边车文件名为图片文件名加上后缀（photo.jpg -> photo.jpg.xmp），同名不同格式的图片不会共用一个边车
+SIDECAR_SUFFIX = '.xmp'
+SIDECAR_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.ico')
+
+
+def set_sidecar_mode(mode):
+    """设置边车模式（见 SIDECAR_MODES）"""
+    global SIDECAR_MODE
+    if mode not in SIDECAR_MODES:
+        raise ValueError(f"未知的边车模式: {mode}")
+    SIDECAR_MODE = mode
+
+
+def sidecar_path(image_path):
+    """返回图片对应的边车文件路径"""
+    return os.fspath(image_path) + SIDECAR_SUFFIX
+
+
+def _read_sidecar_packet(path):
+    """读取边车文件内容，不存在时返回 None"""
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _read_sidecar_fields(image_path):
+    """读取边车文件中的字段（只包含边车中出现的字段，merge 模式下空属性表示删除）"""
+    try:
+        packet = _read_sidecar_packet(sidecar_path(image_path))
+    except OSError as e:
+        print(f"[WARN] 读取边车文件时出错: {e}", file=sys.stderr)
+        return {}
+    return _parse_xmp_fields(packet) if packet else {}
+
+
+def _write_small_file(path, data, mode):
+    """原子地写入一个小文件（同目录临时文件 + rename），按 FSYNC_MODE 同步"""
+    import tempfile
+    
+    directory, name = os.path.split(os.path.abspath(path))
+    tmp_fd, tmp_name = tempfile.mkstemp(prefix=f".{name}.", suffix='.tmp', dir=directory)
+    try:
+        _write_all(tmp_fd, data)
+        os.chmod(tmp_name, mode)
+        if FSYNC_MODE == 'always':
+            os.fsync(tmp_fd)
+        os.close(tmp_fd)
+        tmp_fd = None
+        os.replace(tmp_name, path)
+    except BaseException:
+        if tmp_fd is not None:
+            os.close(tmp_fd)
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+        raise
+    if FSYNC_MODE == 'always':
+        _fsync_directory(directory)
+
+
+def _remove_file(path):
+    """删除文件（不存在时忽略），按 FSYNC_MODE 同步目录"""
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        return
+    if FSYNC_MODE == 'always':
+        _fsync_directory(os.path.dirname(os.path.abspath(path)))
+
+
+def _update_sidecar(image_path, metadata):
+    """
+    把字段写入边车文件，边车中其他软件写入的属性原样保留
+    only 模式下空字段直接省略，所有字段都为空且没有其他属性时删除边车文件；
+    merge 模式下空字段写成空属性，覆盖图片内嵌的值
+    """
+    if not os.path.exists(image_path):
+        _report_error(f"文件不存在: {image_path}")
+        return False
+    path = sidecar_path(image_path)
+    try:
+        existing = _read_sidecar_packet(path)
+        packet = _build_xmp_packet(metadata, existing, padding=0, explicit=SIDECAR_MODE == 'merge')
+        if packet == existing or not packet and existing is None:
+            return True
+        if not packet:
+            _remove_file(path)
+        else:
+            # 新建的边车文件沿用图片的权限
+            _write_small_file(path, packet, stat.S_IMODE(os.stat(image_path).st_mode))
+        _prof_count('sidecar_writes')
+        return True
+    except Exception as e:
+        _report_error(f"写入边车文件 {path} 时出错: {e}")
+        return False
+
+
+def embed_sidecar(image_path, keep_sidecar=False):
+    """
+    把边车文件中的字段写入图片本身（按当前存储格式），然后从边车中删除这些字段：
+    边车中没有其他软件的属性时删除整个文件；keep_sidecar 为 True 时边车保持不变
+    返回 True 表示已写入，False 表示没有边车文件，出错时返回 None
+    """
+    image_path = os.fspath(image_path)
+    path = sidecar_path(image_path)
+    try:
+        packet = _read_sidecar_packet(path)
+        if packet is None:
+            return False
+        fields = _parse_xmp_fields(packet)
+        current = _read_embedded_metadata(image_path)
+        metadata = dict(current, **fields)
+        if metadata != current and not _update_embedded_metadata(image_path, metadata):
+            return None
+        if not keep_sidecar:
+            remaining = _build_xmp_packet({}, packet, padding=0)
+            if not remaining:
+                _remove_file(path)
+            elif remaining != packet:
+                _write_small_file(path, remaining, stat.S_IMODE(os.stat(path).st_mode))
+        return True
+    except Exception as e:
+        _report_error(f"把边车文件 {path} 写入图片时出错: {e}")
+        return None
+
+
+# ============================================================
+# 精简元数据（strip 子命令）
+# ============================================================
+
+JPEG_APP2 = 0xE2
+JPEG_APP14 = 0xEE
+JPEG_COM = 0xFE
+# 影响显示效果、精简时保留的 PNG 辅助块：透明度、色彩管理、HDR、像素密度和 APNG 动画
+# （关键块总是保留；文本块、tIME、eXIf 和各软件的私有块都会删除）
+PNG_ESSENTIAL_CHUNKS = {
+    b'tRNS', b'gAMA', b'cHRM', b'sRGB', b'iCCP', b'cICP', b'mDCV', b'cLLI',
+    b'sBIT', b'bKGD', b'pHYs', b'acTL', b'fcTL', b'fdAT',
+}
+# 精简时保留的 WebP 块（VP8X 的标志位会重新计算）
+WEBP_ESSENTIAL_CHUNKS = {b'VP8X', b'ICCP', b'ANIM', b'ANMF', b'ALPH', b'VP8 ', b'VP8L'}
+EXIF_TAG_ORIENTATION = 0x0112
+
+
+def _exif_orientation(tiff):
+    """取出 TIFF 结构中 IFD0 的方向标签，不存在或为默认方向 (1) 时返回 None"""
+    if not tiff:
+        return None
+    tiff = bytes(tiff[6:] if tiff[:6] == EXIF_HEADER else tiff)
+    byteorder = {b'II': 'little', b'MM': 'big'}.get(tiff[:2])
+    if byteorder is None:
+        return None
+    tags = _read_ifd_tags(tiff, int.from_bytes(tiff[4:8], byteorder), byteorder, {EXIF_TAG_ORIENTATION})
+    value = int.from_bytes(tags.get(EXIF_TAG_ORIENTATION, b'')[:2], byteorder)
+    return value if 1 < value <= 8 else None
+
+
+def _orientation_tiff(orientation):
+    """只包含方向标签的最小 TIFF 结构（26 字节）"""
+    return (b'MM\x00\x2a' + (8).to_bytes(4, 'big') + (1).to_bytes(2, 'big')
+            + EXIF_TAG_ORIENTATION.to_bytes(2, 'big') + (3).to_bytes(2, 'big') + (1).to_bytes(4, 'big')
+            + orientation.to_bytes(2, 'big') + b'\0\0' + (0).to_bytes(4, 'big'))
+
+
+def _strip_xmp_packet(fields):
+    """精简后要保留的字段写成不带填充的 XMP 数据包，没有字段时返回 b''"""
+    return _build_xmp_packet(fields, padding=0) if any(fields.values()) else b''
+
+
+def _plan_jpeg_strip(f, fields):
+    """
+    规划 JPEG 的精简，返回 EditPlan，无需修改时返回 None
+    保留 JFIF (APP0)、ICC 配置 (APP2)、Adobe 色彩变换 (APP14) 和所有非 APPn 段；
+    EXIF（含缩略图、厂商注释、GPS）、XMP、IPTC 和注释 (COM) 段全部删除，
+    只有非默认的方向标签写回一个最小的 EXIF 段，fields 写回一个不带填充的 XMP 段
+    """
+    start = _prof_start()
+    header, segments = _read_jpeg_header(f)
+    file_size = _stream_size(f)
+    _prof_end('open', start, len(header))
+    
+    start = _prof_start()
+    exif = _find_exif_segment(header, segments)
+    orientation = _exif_orientation(header[exif[1] + 4:exif[2]]) if exif else None
+    new_segments = []
+    if orientation:
+        new_segments.append(EXIF_HEADER + _orientation_tiff(orientation))
+    packet = _strip_xmp_packet(fields)
+    if packet:
+        new_segments.append(XMP_JPEG_HEADER + packet)
+    
+    parts = [JPEG_SOI]
+    for marker, seg_start, seg_end in segments:
+        segment = header[seg_start:seg_end]
+        if marker == JPEG_APP0 and segment[4:9] == b'JFIF\0':
+            parts.append(segment)
+            continue
+        if new_segments:
+            # 新的 APP1 段放在开头的 JFIF 段之后
+            parts += [b'\xff\xe1' + (len(payload) + 2).to_bytes(2, 'big') + payload for payload in new_segments]
+            new_segments = []
+        if marker in (JPEG_APP2, JPEG_APP14) or not (0xE0 <= marker <= 0xEF or marker == JPEG_COM):
+            parts.append(segment)
+    parts += [b'\xff\xe1' + (len(payload) + 2).to_bytes(2, 'big') + payload for payload in new_segments]
+    new_header = b''.join(parts)
+    _prof_end('build', start, len(new_header))
+    if new_header == header:
+        return None
+    return EditPlan(None, [new_header, (len(header), file_size)])
+
+
+def _plan_png_strip_pieces(f, fields, base=0):
+    """
+    规划 PNG 数据（从 base 开始）精简后的拼接片段，返回 (pieces, changed)
+    保留关键块和 PNG_ESSENTIAL_CHUNKS，eXIf 块只保留非默认的方向（位于 IDAT 之后的 eXIf 移到 IDAT 之前），
+    fields 写入 IDAT 之前的 XMP iTXt 块；
+    已经精简过的文件中与新块完全相同的块原样保留，重复精简不会改写文件
+    """
+    prof_start = _prof_start()
+    packet = _strip_xmp_packet(fields)
+    wanted = {b'iTXt': _png_chunk(b'iTXt', XMP_PNG_PREFIX + packet) if packet else None, b'eXIf': None}
+    pieces = [(base, base + len(PNG_SIGNATURE))]
+    changed = False
+    inserted = False
+    insert_at = None
+    exif_seen = False
+    for chunk_type, start, end in _iter_png_chunks(f, base):
+        if chunk_type == b'eXIf' and inserted and not exif_seen:
+            # PNG 1.5 扩展允许 eXIf 位于 IDAT 之后：同样保留非默认的方向，新块放到插入点（IDAT 之前）
+            exif_seen = True
+            f.seek(start)
+            orientation = _exif_orientation(f.read(end - start)[8:-4])
+            if orientation:
+                pieces.insert(insert_at, _png_chunk(b'eXIf', _orientation_tiff(orientation)))
+        elif chunk_type in wanted and not inserted:
+            f.seek(start)
+            chunk = f.read(end - start)
+            if chunk_type == b'eXIf':
+                exif_seen = True
+                orientation = _exif_orientation(chunk[8:-4])
+                wanted[b'eXIf'] = _png_chunk(b'eXIf', _orientation_tiff(orientation)) if orientation else None
+            if chunk == wanted[chunk_type]:
+                pieces.append((start, end))
+                wanted[chunk_type] = None
+                continue
+        if chunk_type == b'IDAT' and not inserted:
+            # 新块插入到第一个 IDAT 之前（eXIf 按规范也必须在 IDAT 之前）
+            inserted = True
+            insert_at = len(pieces)
+            new_chunks = b''.join(wanted[key] for key in (b'eXIf', b'iTXt') if wanted[key])
+            if new_chunks:
+                pieces.append(new_chunks)
+                changed = True
+        # 类型首字母大写的关键块总是保留
+        if not chunk_type[0] & 0x20 or chunk_type in PNG_ESSENTIAL_CHUNKS:
+            pieces.append((start, end))
+        else:
+            changed = True
+    _prof_end('build', prof_start, end - base)
+    return pieces, changed
+
+
+def _plan_png_strip(f, fields):
+    """规划 PNG 的精简，返回 EditPlan，无需修改时返回 None"""
+    pieces, changed = _plan_png_strip_pieces(f, fields)
+    return EditPlan(None, pieces) if changed else None
+
+
+def _plan_webp_strip(f, fields):
+    """
+    规划 WebP 的精简，返回 EditPlan，无需修改时返回 None
+    保留图像、Alpha、动画和 ICC 块，删除 EXIF（WebP 规范要求解码器忽略其中的方向）、XMP 和未知块，
+    以及 RIFF 之后的附加数据；fields 写回不带填充的 XMP 块。
+    不再需要 VP8X 的静态图片（无 Alpha/ICC/动画/元数据）转换为简单格式
+    """
+    prof_start = _prof_start()
+    chunks = list(_iter_riff_chunks(f))
+    file_size = _stream_size(f)
+    
+    packet = _strip_xmp_packet(fields)
+    xmp_chunk = _riff_chunk(b'XMP ', packet) if packet else None
+    vp8x = None
+    body = []
+    changed = chunks[-1][2] != file_size if chunks else False
+    for fourcc, start, end in chunks:
+        if fourcc == b'VP8X':
+            f.seek(start)
+            vp8x = f.read(end - start)
+        elif fourcc in WEBP_ESSENTIAL_CHUNKS:
+            body.append((start, end))
+        elif fourcc == b'XMP ' and xmp_chunk and end - start == len(xmp_chunk):
+            # 已经精简过的 XMP 块与新块相同时原样保留
+            f.seek(start)
+            if f.read(end - start) == xmp_chunk:
+                body.append((start, end))
+                xmp_chunk = None
+            else:
+                changed = True
+        else:
+            changed = True
+    if xmp_chunk:
+        body.append(xmp_chunk)
+        changed = True
+    
+    if vp8x is not None:
+        flags = vp8x[8] & ~(WEBP_VP8X_FLAG_EXIF | WEBP_VP8X_FLAG_XMP)
+        if packet:
+            flags |= WEBP_VP8X_FLAG_XMP
+        if flags or len(body) != 1:
+            body.insert(0, vp8x[:8] + bytes([flags]) + vp8x[9:])
+            changed = changed or flags != vp8x[8]
+        else:
+            changed = True
+    elif packet:
+        # 简单格式的图片需要补上 VP8X 才能携带 XMP
+        fourcc, start, end = next(c for c in chunks if c[0] in (b'VP8 ', b'VP8L'))
+        f.seek(start + 8)
+        width, height, alpha = _webp_canvas(fourcc, f.read(min(end - start - 8, 10)))
+        flags = WEBP_VP8X_FLAG_XMP | (WEBP_VP8X_FLAG_ALPHA if alpha else 0)
+        body.insert(0, _riff_chunk(b'VP8X', bytes([flags]) + b'\0\0\0' + (width - 1).to_bytes(3, 'little')
+                                   + (height - 1).to_bytes(3, 'little')))
+    _prof_end('build', prof_start, file_size)
+    if not changed:
+        return None
+    return EditPlan(None, [b'RIFF' + (4 + _pieces_size(body)).to_bytes(4, 'little') + b'WEBP'] + body)
+
+
+def _plan_ico_strip(f, fields):
+    """规划 ICO 的精简：每个内嵌的 PNG 图像分别精简，BMP 图像原样复制，返回 EditPlan 或 None"""
+    entries = _read_ico_directory(f)
+    plans = []
+    changed = False
+    for entry, offset, size in entries:
+        f.seek(offset)
+        pieces = [(offset, offset + size)]
+        if f.read(8) == PNG_SIGNATURE:
+            png_pieces, png_changed = _plan_png_strip_pieces(f, fields, offset)
+            if png_changed:
+                pieces = png_pieces
+                changed = True
+        plans.append((entry, pieces))
+    if not changed:
+        return None
+    
+    directory = bytearray(b'\0\0\x01\0' + len(plans).to_bytes(2, 'little'))
+    offset = 6 + 16 * len(plans)
+    body = []
+    for entry, pieces in plans:
+        size = _pieces_size(pieces)
+        directory += entry[:8] + size.to_bytes(4, 'little') + offset.to_bytes(4, 'little')
+        body.extend(pieces)
+        offset += size
+    return EditPlan(None, [bytes(directory)] + body)
+
+
+_STRIP_PLANNERS = {'.jpg': _plan_jpeg_strip, '.jpeg': _plan_jpeg_strip, '.png': _plan_png_strip,
+                   '.webp': _plan_webp_strip, '.ico': _plan_ico_strip}
+
+
+def strip_metadata(image_path, keep=()):
+    """
+    删除图片中所有非必要的元数据（无损，不解码像素）
+    EXIF（缩略图、厂商注释、GPS、时间戳）、XMP、IPTC、注释、PNG 文本块和 tIME 等全部删除；
+    影响显示的数据（ICC 配置、非默认的 EXIF 方向、透明度、动画）保留
+    keep: 要保留的字段（METADATA_KEYS 中的名称），其现有值写回一个不带填充的 XMP 数据包
+    返回节省的字节数，出错时返回 None
+    """
+    image_path = os.fspath(image_path)
+    planner = _STRIP_PLANNERS.get(os.path.splitext(image_path)[1].lower())
+    if planner is None:
+        _report_error(f"不支持的图片格式: {image_path}")
+        return None
+    
+    try:
+        current = read_metadata(image_path) if keep else {}
+        fields = {key: current.get(key, '') for key in keep}
+        with open(image_path, 'rb') as f:
+            old_size = _stream_size(f)
+            plan = planner(f, fields)
+        _apply_edit_plan(image_path, plan)
+        saved = old_size - os.path.getsize(image_path)
+        _prof_count('stripped_bytes', saved)
+        return saved
+    except Exception as e:
+        _report_error(f"精简 {image_path} 的元数据时出错: {e}")
+        return None
+
+
+# ============================================================
+# PNG 无损优化（optimize 子命令）
+# ============================================================
+
+# 8 位深度下 PNG 颜色类型与 PIL 模式的对应关系
+PNG_COLOR_MODES = {0: 'L', 2: 'RGB', 3: 'P', 4: 'LA', 6: 'RGBA'}
+PNG_MODE_CHANNELS = {'L': 1, 'RGB': 3, 'P': 1, 'LA': 2, 'RGBA': 4}
+# 规范要求位于 PLTE 之前的辅助块
+PNG_BEFORE_PLTE_CHUNKS = {b'cHRM', b'gAMA', b'iCCP', b'sBIT', b'sRGB', b'cICP', b'mDCV', b'cLLI'}
+# 含义依赖颜色类型的块：颜色类型改变时删除，PLTE/tRNS 由新的编码提供
+PNG_COLOR_DEPENDENT_CHUNKS = {b'PLTE', b'tRNS', b'bKGD', b'sBIT', b'hIST', b'sPLT'}
+
+
+def _png_filter(raw, stride, bpp, filter_type):
+    """
+    对整幅图像统一使用一种滤波器（0 None、1 Sub、2 Up、3 Average），返回带滤波类型字节的扫描行数据
+    逐字节的模 256 减法和平均值用大整数的 SWAR 运算一次算完，不逐像素循环
+    （Paeth 无法这样计算，由 PIL 的自适应滤波覆盖）
+    """
+    rows = range(0, len(raw), stride)
+    if filter_type:
+        n = len(raw)
+        ones = int.from_bytes(b'\x01' * n, 'big')
+        high = ones * 0x80
+        x = int.from_bytes(raw, 'big')
+        # 大端序整数右移 k 字节 = 每个字节取前面第 k 个字节；左侧像素需要屏蔽掉跨行的部分
+        left = (x >> (8 * bpp)) & int.from_bytes((b'\0' * bpp + b'\xff' * (stride - bpp)) * len(rows), 'big')
+        up = x >> (8 * stride)
+        if filter_type == 1:
+            pred = left
+        elif filter_type == 2:
+            pred = up
+        else:
+            pred = (left & up) + (((left ^ up) & (ones * 0xFE)) >> 1)
+        raw = (((x | high) - (pred & (ones * 0x7F))) ^ ((x ^ pred ^ high) & high)).to_bytes(n, 'big')
+    tag = bytes([filter_type])
+    return b''.join(tag + raw[i:i + stride] for i in rows)
+
+
+def _deflate(data, strategy):
+    """zlib 最高压缩级别 + 指定策略"""
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 15, 9, strategy)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _split_png(data):
+    """把 PNG 数据拆成 [(chunk_type, chunk_data), ...]（不校验 CRC）"""
+    if data[:8] != PNG_SIGNATURE:
+        raise ValueError("不是有效的 PNG 文件")
+    chunks = []
+    pos = 8
+    while pos + 8 <= len(data):
+        length = int.from_bytes(data[pos:pos + 4], 'big')
+        chunk_type = bytes(data[pos + 4:pos + 8])
+        chunks.append((chunk_type, bytes(data[pos + 8:pos + 8 + length])))
+        pos += 12 + length
+        if chunk_type == b'IEND':
+            return chunks
+    raise ValueError("PNG 文件缺少 IEND 块")
+
+
+def _assemble_png(chunks, ihdr, plte, trns, idat, color_changed):
+    """
+    用新的 IHDR/PLTE/tRNS/IDAT 替换原有的块，其余块（文本、XMP、色彩管理等）原样保留并保持规范要求的顺序
+    color_changed 时删除依赖颜色类型的块
+    """
+    before_plte, after_plte, after_idat = [], [], []
+    seen_idat = False
+    for chunk_type, data in chunks:
+        if chunk_type in (b'IHDR', b'PLTE', b'tRNS', b'IEND'):
+            continue
+        if chunk_type == b'IDAT':
+            seen_idat = True
+            continue
+        if color_changed and chunk_type in PNG_COLOR_DEPENDENT_CHUNKS:
+            continue
+        target = after_idat if seen_idat else before_plte if chunk_type in PNG_BEFORE_PLTE_CHUNKS else after_plte
+        target.append(_png_chunk(chunk_type, data))
+    parts = [PNG_SIGNATURE, _png_chunk(b'IHDR', ihdr)] + before_plte
+    if plte:
+        parts.append(_png_chunk(b'PLTE', plte))
+    if trns:
+        parts.append(_png_chunk(b'tRNS', trns))
+    parts += after_plte + [_png_chunk(b'IDAT', idat)] + after_idat + [_png_chunk(b'IEND', b'')]
+    return b''.join(parts)
+
+
+def _reduce_png_image(image, has_iccp):
+    """
+    无损的颜色缩减，返回缩减后的 PIL 图像，无法缩减时返回 None
+    不透明的 RGBA → RGB；R=G=B 的图像 → L/LA（有 ICC 配置时不做，灰度图不能使用 RGB 配置）；
+    不超过 256 色 → 调色板（半透明的颜色排在前面，tRNS 块尽量短）
+    """
+    from PIL import Image, ImageChops
+    
+    reduced = image
+    if reduced.mode == 'RGBA' and reduced.getchannel('A').getextrema() == (255, 255):
+        reduced = reduced.convert('RGB')
+    if not has_iccp:
+        r, g, b = (reduced.getchannel(c) for c in 'RGB')
+        if ImageChops.difference(r, g).getbbox() is None and ImageChops.difference(g, b).getbbox() is None:
+            return r if reduced.mode == 'RGB' else Image.merge('LA', (r, reduced.getchannel('A')))
+    
+    colors = reduced.getcolors(256)
+    if colors is not None:
+        if reduced.mode == 'RGB':
+            colors = [(count, color + (255,)) for count, color in colors]
+        colors.sort(key=lambda item: (item[1][3] == 255, -item[0]))
+        palette = [color for _, color in colors]
+        # 逐个通道合并出调色板索引：每一步把 (前几个通道的组合编号, 下一个通道) 查表映射为新编号，
+        # 组合数不超过颜色数（≤ 256），最后一步按调色板顺序编号；查表都在 PIL 内部完成，不逐像素循环
+        channels = reduced.split()
+        index, position = channels[0], {(value,): value for value in range(256)}
+        for c in range(1, len(channels)):
+            keys = list(dict.fromkeys(color[:c + 1] for color in palette))
+            index = _lookup_pairs(index, channels[c], [(position[key[:c]], key[c]) for key in keys])
+            position = {key: i for i, key in enumerate(keys)}
+        paletted = Image.frombytes('P', reduced.size, index.tobytes())
+        paletted.putpalette(b''.join(bytes(color[:3]) for color in palette))
+        alphas = bytes(color[3] for color in palette).rstrip(b'\xff')
+        if alphas:
+            paletted.info['transparency'] = alphas
+        return paletted
+    return reduced if reduced is not image else None
+
+
+def _lookup_pairs(first, second, pairs):
+    """
+    把两个 L 图像逐像素的 (first, second) 映射为它在 pairs 中的位置（pairs 最多 256 项），返回 L 图像
+    两个通道交错成 16 位整数图像，再用 65536 项的查找表转换
+    """
+    from PIL import Image
+    
+    lut = [0] * 65536
+    for i, (a, b) in enumerate(pairs):
+        lut[a | b << 8] = i
+    packed = Image.frombytes('I', first.size, Image.merge('LA', (first, second)).tobytes(), 'raw', 'I;16')
+    return packed.point(lut, 'L')
+
+
+def _pil_png_parts(image):
+    """用 PIL 的自适应滤波（含 Paeth）+ 最高压缩级别编码，返回 (ihdr, plte, trns, idat)"""
+    import io
+    
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', optimize=True)
+    parts = {b'IDAT': b''}
+    for chunk_type, data in _split_png(buffer.getvalue()):
+        if chunk_type == b'IDAT':
+            parts[b'IDAT'] += data
+        elif chunk_type in (b'IHDR', b'PLTE', b'tRNS'):
+            parts[chunk_type] = data
+    return parts[b'IHDR'], parts.get(b'PLTE'), parts.get(b'tRNS'), parts[b'IDAT']
+
+
+def _image_png_parts(image, filter_type, strategy, plte=None, trns=None):
+    """
+    按指定的统一滤波器和 zlib 策略编码 8 位 PIL 图像（不隔行），返回 (ihdr, plte, trns, idat)
+    plte/trns 为原图的块数据；颜色缩减得到的调色板图像从图像本身取调色板和透明度
+    """
+    channels = PNG_MODE_CHANNELS[image.mode]
+    width, height = image.size
+    color_type = {mode: ct for ct, mode in PNG_COLOR_MODES.items()}[image.mode]
+    ihdr = width.to_bytes(4, 'big') + height.to_bytes(4, 'big') + bytes([8, color_type, 0, 0, 0])
+    if image.mode == 'P' and plte is None:
+        plte = bytes(image.getpalette('RGB'))
+        trns = image.info.get('transparency')
+    raw = image.tobytes()
+    return ihdr, plte, trns, _deflate(_png_filter(raw, width * channels, channels, filter_type), strategy)
+
+
+def _decode_rgba(data):
+    """用 PIL 解码 PNG 数据，返回 RGBA 像素（用于比较两种编码的像素是否一致）"""
+    import io
+    from PIL import Image
+    
+    with Image.open(io.BytesIO(data)) as image:
+        return image.convert('RGBA').tobytes()
+
+
+def _optimize_png_data(data, threads=None):
+    """
+    尝试多种无损编码，返回比原数据更小且像素完全一致的 PNG 数据，没有更小的结果时返回 None
+    策略: 保留原滤波只用更强的 zlib 参数重新压缩；统一的 None/Sub/Up/Average 滤波；
+    PIL 的自适应滤波；以及在此之前的无损颜色缩减（RGBA→RGB、灰度、调色板）
+    各策略在线程池中并行压缩（zlib 和 PIL 编码时会释放 GIL）
+    未安装 PIL 时只做重新压缩，结果通过比较解压后的扫描行数据校验
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    
+    chunks = _split_png(data)
+    types = {chunk_type for chunk_type, _ in chunks}
+    if b'acTL' in types:
+        # APNG 的帧数据在 fdAT 中，不处理
+        return None
+    ihdr = chunks[0][1]
+    bit_depth, color_type = ihdr[8], ihdr[9]
+    plte = next((d for t, d in chunks if t == b'PLTE'), None)
+    trns = next((d for t, d in chunks if t == b'tRNS'), None)
+    filtered = zlib.decompress(b''.join(d for t, d in chunks if t == b'IDAT'))
+    
+    # 候选编码: (生成函数, 是否改变颜色类型)
+    candidates = [(lambda s=strategy: (ihdr, plte, trns, _deflate(filtered, s)), False)
+                  for strategy in (zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED)]
+    reference = None
+    try:
+        from PIL import Image
+    except ImportError:
+        Image = None
+    if Image is not None and bit_depth == 8 and color_type in PNG_COLOR_MODES:
+        import io
+        
+        image = Image.open(io.BytesIO(data))
+        image.load()
+        if image.mode == PNG_COLOR_MODES[color_type]:
+            reference = image.convert('RGBA').tobytes()
+            variants = [(image, False)]
+            if color_type in (2, 6) and trns is None:
+                reduced = _reduce_png_image(image, b'iCCP' in types)
+                if reduced is not None:
+                    variants.append((reduced, True))
+            for variant, changed in variants:
+                candidates.append((lambda v=variant: _pil_png_parts(v), changed))
+                # 原图沿用自己的 PLTE/tRNS；重新编码的结果都不隔行（隔行存储通常更大）
+                chunk_args = (None, None) if changed else (plte, trns)
+                for filter_type in range(4):
+                    candidates.append((lambda v=variant, f=filter_type:
+                                       _image_png_parts(v, f, zlib.Z_DEFAULT_STRATEGY, *chunk_args), changed))
+    
+    workers = max(1, min(len(candidates), threads or os.cpu_count() or 1))
+    with ThreadPoolExecutor(workers) as executor:
+        results = list(executor.map(lambda candidate: candidate[0](), candidates))
+    
+    # 从最小的结果开始校验，第一个像素一致的即为最优
+    encoded = sorted(
+        ((_assemble_png(chunks, *parts, color_changed=changed), parts[3])
+         for parts, (_, changed) in zip(results, candidates)),
+        key=lambda item: len(item[0])
+    )
+    for new_data, idat in encoded:
+        if len(new_data) >= len(data):
+            break
+        if reference is not None:
+            if _decode_rgba(new_data) == reference:
+                return new_data
+        elif zlib.decompress(idat) == filtered:
+            return new_data
+    return None
+
+
+def optimize_png(image_path, threads=None):
+    """
+    无损重新压缩 PNG 图片，只有结果更小且像素完全一致时才替换原文件
+    元数据字段和其他辅助块（色彩管理、XMP 等）保留；threads 为并行尝试策略的线程数
+    返回节省的字节数，出错时返回 None
+    """
+    image_path = os.fspath(image_path)
+    try:
+        with open(image_path, 'rb') as f:
+            data = f.read()
+        start = _prof_start()
+        new_data = _optimize_png_data(data, threads)
+        _prof_end('build', start, len(data))
+        if new_data is None:
+            _prof_count('unchanged_skips')
+            return 0
+        _write_spliced(image_path, [new_data])
+        _prof_count('optimized_bytes', len(data) - len(new_data))
+        return len(data) - len(new_data)
+    except Exception as e:
+        _report_error(f"优化 {image_path} 时出错: {e}")
+        return None
+
+
+# ============================================================
+# 结构校验（--verify / verify 子命令）
+# ============================================================
+
+# 是否在每次写入后校验文件
+VERIFY_WRITES = False
+# 校验时每次顺序读取的字节数
+VERIFY_BUFFER_SIZE = 1024 * 1024
+
+
+def set_verify_writes(enabled):
+    """设置是否在写入后校验文件"""
+    global VERIFY_WRITES
+    VERIFY_WRITES = bool(enabled)
+
+
+def _verify_png_stream(f, limit=None):
+    """
+    从当前位置顺序读取一个 PNG 数据流，用增量 zlib.crc32 校验每个块的 CRC
+    limit: PNG 数据允许的结束偏移（ICO 中的图像不能越过目录给出的大小）
+    返回问题列表
+    """
+    base = f.tell()
+    if f.read(8) != PNG_SIGNATURE:
+        return ["PNG 签名无效"]
+    problems = []
+    pos = base + 8
+    while True:
+        head = f.read(8)
+        if len(head) != 8:
+            return problems + ["PNG 数据在块头处意外结束（缺少 IEND）"]
+        length = int.from_bytes(head[:4], 'big')
+        chunk_type = head[4:8]
+        if length > 0x7FFFFFFF:
+            return problems + [f"块长度无效（偏移 {pos}）"]
+        crc = zlib.crc32(chunk_type)
+        remaining = length
+        while remaining:
+            block = f.read(min(remaining, VERIFY_BUFFER_SIZE))
+            if not block:
+                return problems + [f"{chunk_type.decode('latin-1')} 块数据被截断（偏移 {pos}）"]
+            crc = zlib.crc32(block, crc)
+            remaining -= len(block)
+        stored = f.read(4)
+        if len(stored) != 4:
+            return problems + [f"{chunk_type.decode('latin-1')} 块缺少 CRC（偏移 {pos}）"]
+        if int.from_bytes(stored, 'big') != crc:
+            problems.append(f"{chunk_type.decode('latin-1')} 块 CRC 不匹配（偏移 {pos}）")
+        pos += 12 + length
+        if limit is not None and pos > limit:
+            return problems + ["PNG 数据超出了 ICO 目录给出的大小"]
+        if chunk_type == b'IEND':
+            return problems
+
+
+def _verify_jpeg_stream(f):
+    """
+    顺序读取 JPEG，检查 SOS 之前的段结构，并扫描熵编码数据中的标记直到 EOI
+    （渐进式 JPEG 各次扫描之间的 DHT/SOS 等段按长度跳过），不解码像素
+    返回问题列表
+    """
+    try:
+        _read_jpeg_header(f)
+    except ValueError as e:
+        return [str(e)]
+    
+    buf = b''
+    i = 0
+    
+    def fill(n):
+        """保证缓冲区中从 i 开始至少有 n 个字节，文件结束时返回 False"""
+        nonlocal buf, i
+        if len(buf) - i < n:
+            buf = buf[i:] + f.read(max(n, VERIFY_BUFFER_SIZE))
+            i = 0
+        return len(buf) - i >= n
+    
+    def skip_segment():
+        """跳过当前位置开始的带长度字段的段"""
+        nonlocal i
+        if not fill(2):
+            return False
+        remaining = int.from_bytes(buf[i:i + 2], 'big')
+        if remaining < 2:
+            return False
+        while remaining:
+            if not fill(1):
+                return False
+            step = min(remaining, len(buf) - i)
+            i += step
+            remaining -= step
+        return True
+    
+    # _read_jpeg_header 停在 SOS 标记之后
+    if not skip_segment():
+        return ["SOS 段不完整"]
+    while True:
+        j = buf.find(b'\xff', i)
+        if j == -1:
+            i = len(buf)
+            if not fill(1):
+                return ["扫描数据被截断（缺少 EOI）"]
+            continue
+        i = j
+        if not fill(2):
+            return ["扫描数据被截断（缺少 EOI）"]
+        marker = buf[i + 1]
+        if marker == 0x00 or 0xD0 <= marker <= 0xD7:
+            # 字节填充和 RST 标记属于扫描数据
+            i += 2
+            continue
+        if marker == 0xFF:
+            i += 1
+            continue
+        i += 2
+        if marker == JPEG_EOI:
+            return []
+        if marker in JPEG_STANDALONE_MARKERS:
+            continue
+        if not skip_segment():
+            return [f"JPEG 段结构损坏（标记 0x{marker:02X}）"]
+
+
+def _verify_webp_stream(f, file_size):
+    """检查 RIFF 长度、各块的边界以及 VP8X 标志与实际元数据块是否一致"""
+    problems = []
+    head = f.read(12)
+    if len(head) != 12 or head[:4] != b'RIFF' or head[8:12] != b'WEBP':
+        return ["WebP 文件头无效"]
+    riff_end = 8 + int.from_bytes(head[4:8], 'little')
+    if riff_end > file_size:
+        return [f"RIFF 长度 ({riff_end}) 超出文件大小 ({file_size})"]
+    
+    vp8x_flags = None
+    present = set()
+    pos = 12
+    while pos < riff_end:
+        f.seek(pos)
+        chunk_head = f.read(8)
+        if len(chunk_head) != 8:
+            return problems + [f"块头被截断（偏移 {pos}）"]
+        size = int.from_bytes(chunk_head[4:8], 'little')
+        end = pos + 8 + size + (size & 1)
+        if end > riff_end:
+            return problems + [f"{chunk_head[:4].decode('latin-1')} 块超出 RIFF 范围（偏移 {pos}）"]
+        if chunk_head[:4] == b'VP8X':
+            vp8x_flags = f.read(1)[0]
+        present.add(chunk_head[:4])
+        pos = end
+    
+    if not present & {b'VP8 ', b'VP8L', b'ANIM'}:
+        problems.append("缺少图像数据块")
+    if vp8x_flags is not None:
+        for fourcc, flag in ((b'EXIF', WEBP_VP8X_FLAG_EXIF), (b'XMP ', WEBP_VP8X_FLAG_XMP)):
+            if bool(vp8x_flags & flag) != (fourcc in present):
+                problems.append(f"VP8X 的 {fourcc.decode().strip()} 标志与实际的块不一致")
+    elif present & {b'EXIF', b'XMP '}:
+        problems.append("含元数据块但缺少 VP8X 块")
+    return problems
+
+
+def _verify_ico_stream(f, file_size):
+    """检查 ICO 目录中每个图像的范围，内嵌的 PNG 图像逐块校验 CRC"""
+    try:
+        entries = _read_ico_directory(f)
+    except ValueError as e:
+        return [str(e)]
+    problems = []
+    for n, (_, offset, size) in enumerate(entries):
+        if offset + size > file_size:
+            problems.append(f"第 {n + 1} 个图像超出文件范围")
+            continue
+        f.seek(offset)
+        if f.read(8) == PNG_SIGNATURE:
+            f.seek(offset)
+            problems += [f"第 {n + 1} 个图像: {p}" for p in _verify_png_stream(f, offset + size)]
+    return problems
+
+
+def verify_file(image_path, expected=None):
+    """
+    顺序读取一遍文件，校验容器结构（PNG 块 CRC、JPEG 标记/段结构、WebP RIFF、ICO 目录），不解码像素
+    expected: 期望的元数据，给出时还会确认读回的字段与之一致
+    返回问题列表，为空表示校验通过
+    """
+    image_path = os.fspath(image_path)
+    start = _prof_start()
+    ext = os.path.splitext(image_path)[1].lower()
+    try:
+        with open(image_path, 'rb', buffering=VERIFY_BUFFER_SIZE) as f:
+            file_size = os.fstat(f.fileno()).st_size
+            if ext in ('.jpg', '.jpeg'):
+                problems = _verify_jpeg_stream(f)
+            elif ext == '.png':
+                problems = _verify_png_stream(f)
+            elif ext == '.webp':
+                problems = _verify_webp_stream(f, file_size)
+            elif ext == '.ico':
+                problems = _verify_ico_stream(f, file_size)
+            else:
+                return [f"不支持的图片格式: {ext}"]
+    except OSError as e:
+        return [f"读取失败: {e}"]
+    
+    if expected is not None and not problems:
+        try:
+            actual = read_metadata(image_path)
+        except (OSError, ValueError) as e:
+            return [f"读回字段失败: {e}"]
+        for key in METADATA_KEYS:
+            if actual.get(key, '') != (expected.get(key) or ''):
+                problems.append(f"{key} 读回的值与写入的不一致: {actual.get(key, '')!r} != {expected.get(key)!r}")
+    _prof_end('verify', start, file_size)
+    return problems
+
+
+# ============================================================
+# 内存数据接口（bytes / memoryview / 文件对象）
+# ============================================================
+
+class _BufferReader:
+    """
+    以文件对象的接口（read/seek/tell）读取内存中的图片数据，供各格式的规划函数使用
+    read 只复制请求的那一小段（文件头、元数据块），图像数据在输出时以 memoryview 切片引用
+    """
+    
+    def __init__(self, view):
+        self.view = view
+        self.pos = 0
+    
+    def read(self, size=-1):
+        end = len(self.view) if size is None or size < 0 else min(len(self.view), self.pos + size)
+        if end <= self.pos:
+            return b''
+        data = self.view[self.pos:end].tobytes()
+        self.pos = end
+        return data
+    
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.pos
+        elif whence == os.SEEK_END:
+            offset += len(self.view)
+        self.pos = max(0, offset)
+        return self.pos
+    
+    def tell(self):
+        return self.pos
+
+
+def _open_source(source):
+    """
+    把 bytes、bytearray、memoryview 等支持缓冲区协议的对象或文件对象包装为可随机读取的来源
+    返回 (f, view)：view 为整个数据的 memoryview；不能直接取得缓冲区的可定位文件对象 view 为 None
+    文件对象从开头读取
+    """
+    if hasattr(source, 'read'):
+        if getattr(source, 'seekable', lambda: False)():
+            source.seek(0)
+            return source, None
+        source = source.read()
+    view = memoryview(source)
+    if view.format != 'B' or view.ndim != 1:
+        view = view.cast('B')
+    return _BufferReader(view), view
+
+
+def _detect_format(head):
+    """根据文件签名识别格式: jpeg / png / webp / ico"""
+    head = bytes(head[:12])
+    if head.startswith(JPEG_SOI):
+        return 'jpeg'
+    if head.startswith(PNG_SIGNATURE):
+        return 'png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    if head[:4] == b'\0\0\x01\0':
+        return 'ico'
+    raise ValueError("无法识别的图片格式（支持 JPEG、PNG、WebP、ICO）")
+
+
+_FIELD_READERS = {'jpeg': _read_jpeg_fields, 'png': _read_png_fields,
+                  'webp': _read_webp_fields, 'ico': _read_ico_fields}
+_EDIT_PLANNERS = {'jpeg': _plan_jpeg_edit, 'png': _plan_png_edit,
+                  'webp': _plan_webp_edit, 'ico': _plan_ico_edit}
+
+
+def read_metadata_buffer(source):
+    """
+    读取内存中图片的元数据，格式由文件签名识别
+    source: bytes、bytearray、memoryview 或文件对象
+    返回字典: {'Comment': '', 'Description': '', 'Source': '', 'URL': ''}；无法识别格式或数据损坏时抛出 ValueError
+    """
+    f, view = _open_source(source)
+    if view is None:
+        view = memoryview(f.read())
+    metadata = {key: '' for key in METADATA_KEYS}
+    metadata.update(_FIELD_READERS[_detect_format(view)](view))
+    return metadata
+
+
+def _iter_plan_output(f, view, plan):
+    """按修改规划依次生成输出数据块：原数据区间为 memoryview 切片（文件对象则分块读取）"""
+    def copy_range(start, end):
+        if view is not None:
+            yield view[start:end]
+            return
+        f.seek(start)
+        while start < end:
+            block = f.read(min(COPY_BUFFER_SIZE, end - start))
+            if not block:
+                raise ValueError("源数据在复制过程中被截断")
+            start += len(block)
+            yield block
+    
+    size = len(view) if view is not None else _stream_size(f)
+    if plan is None:
+        yield from copy_range(0, size)
+    elif plan.patches is not None:
+        pos = 0
+        for offset, data in sorted(plan.patches):
+            yield from copy_range(pos, offset)
+            yield data
+            pos = offset + len(data)
+        yield from copy_range(pos, size)
+    else:
+        for piece in plan.pieces:
+            if isinstance(piece, (bytes, bytearray, memoryview)):
+                yield piece
+            else:
+                yield from copy_range(*piece)
+
+
+def update_metadata_buffer(source, metadata, output=None):
+    """
+    更新内存中图片的元数据，不经过临时文件，原数据不会被修改
+    source: bytes、bytearray、memoryview 或文件对象（格式由文件签名识别）
+    metadata: {'Comment': '', 'Description': '', 'Source': '', 'URL': ''}，缺少的字段视为空（删除）
+    output: 可写的流，给出时把新图片写入其中并返回写入的字节数；否则返回新图片的 bytes
+    与 update_metadata 不同，出错时直接抛出异常（ValueError 等），便于调用方处理
+    """
+    f, view = _open_source(source)
+    fmt = _detect_format(view if view is not None else f.read(12))
+    f.seek(0)
+    plan = _EDIT_PLANNERS[fmt](f, metadata)
+    if plan is None:
+        _prof_count('unchanged_skips')
+    if output is None:
+        if plan is None and isinstance(source, bytes):
+            return source
+        return b''.join(_iter_plan_output(f, view, plan))
+    written = 0
+    for block in _iter_plan_output(f, view, plan):
+        output.write(block)
+        written += len(block)
+    return written
@@ -0,0 +1,2555 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片元数据管理脚本（交互模式与批处理命令行）的实现，入口脚本为 add_image_metadata.py
+支持分别设置/删除 Comment、Description、Source、URL 字段，读写逻辑在 image_metadata.py 中
+支持 JPEG、PNG、WebP 和 ICO (内嵌 PNG) 格式
+字段默认保存在 XMP 数据包中（预留填充，之后的修改可原地覆盖），
+--format legacy 时沿用 EXIF 标签 (JPEG/WebP) 和 PNG 文本块；两种表示都能读取
+完全支持中文
+
+用法:
+    python add_image_metadata.py                                  # 交互模式
+    python add_image_metadata.py get assets/images web/icons      # 批量读取
+    python add_image_metadata.py set --description "说明" "*.png"  # 批量设置
+    python add_image_metadata.py delete -f URL -f Source DIR      # 批量删除字段
+    python add_image_metadata.py clear -j 8 DIR                   # 清空所有字段
+    python add_image_metadata.py strip -k URL build/web           # 删除其余全部元数据，缩小文件
+    python add_image_metadata.py optimize web/icons               # 无损重新压缩 PNG
+    python add_image_metadata.py set --sidecar merge --source S DIR  # 只写 .xmp 边车文件，不改写图片
+    python add_image_metadata.py embed DIR                        # 把边车文件中的字段写回图片
+    python add_image_metadata.py sync metadata.json --plan        # 按清单同步（仅预览）
+    python add_image_metadata.py set --source S --adaptive --max-bytes-per-sec 50M --ionice idle /mnt/nas
+    python add_image_metadata.py set --source S --progress --log run.tsv DIR  # 只显示进度行，明细写入日志
+    find assets -name "*.png" | python add_image_metadata.py dump > meta.jsonl
+    python add_image_metadata.py load < meta.jsonl                 # 应用编辑后的 JSON Lines
+    python add_image_metadata.py watch --manifest metadata.json    # 监视目录，新增/修改的图片自动应用清单
+    python add_image_metadata.py serve &                          # 常驻服务，之后的命令自动转发
+"""
+
+import itertools
+import os
+import sys
+import time
+from collections import Counter, namedtuple
+
+import image_metadata
+from image_metadata import (
+    FSYNC_MODES, METADATA_FORMATS, METADATA_KEYS, REPLICATE_MODES, SIDECAR_MODES,
+    _prof_count, _prof_end, _prof_start, _replicate_file,
+    enable_profiling, read_metadata, set_fsync_mode, set_metadata_format, set_sidecar_mode, set_verify_writes,
+    embed_sidecar, optimize_png, strip_metadata, update_metadata, verify_file,
+)
+
+# 修复 Windows 控制台编码问题
+if sys.platform == 'win32':
+    try:
+        sys.stdout.reconfigure(encoding='utf-8')
+        sys.stderr.reconfigure(encoding='utf-8')
+    except:
+        os.environ['PYTHONIOENCODING'] = 'utf-8'
+
+
+def select_file_gui():
+    """
+    使用图形界面选择文件
+    """
+    try:
+        import tkinter as tk
+        from tkinter import filedialog
+        
+        root = tk.Tk()
+        root.withdraw()
+        root.attributes('-topmost', True)
+        
+        file_path = filedialog.askopenfilename(
+            title="选择图片文件",
+            filetypes=[
+                ("图片文件", "*.jpg *.jpeg *.png *.webp *.ico *.JPG *.JPEG *.PNG *.WEBP *.ICO"),
+                ("JPEG 文件", "*.jpg *.jpeg *.JPG *.JPEG"),
+                ("PNG 文件", "*.png *.PNG"),
+                ("WebP 文件", "*.webp *.WEBP"),
+                ("ICO 图标", "*.ico *.ICO"),
+                ("所有文件", "*.*")
+            ]
+        )
+        root.destroy()
+        return file_path if file_path else None
+    except ImportError:
+        print("[ERROR] 需要 tkinter 库，请安装: pip install tk")
+        return None
+    except Exception as e:
+        print(f"[ERROR] 图形界面选择失败: {e}")
+        return None
+
+
+# ANSI 颜色代码和样式
+class Colors:
+    """ANSI 颜色和样式代码"""
+    # 基础重置
+    RESET = '\033[0m'
+    
+    # 文本样式
+    BOLD = '\033[1m'
+    DIM = '\033[2m'
+    ITALIC = '\033[3m'
+    UNDERLINE = '\033[4m'
+    BLINK = '\033[5m'
+    REVERSE = '\033[7m'
+    HIDDEN = '\033[8m'
+    
+    # 前景色 - 标准
+    BLACK = '\033[30m'
+    RED = '\033[31m'
+    GREEN = '\033[32m'
+    YELLOW = '\033[33m'
+    BLUE = '\033[34m'
+    MAGENTA = '\033[35m'
+    CYAN = '\033[36m'
+    WHITE = '\033[37m'
+    
+    # 前景色 - 明亮
+    BRIGHT_BLACK = '\033[90m'
+    BRIGHT_RED = '\033[91m'
+    BRIGHT_GREEN = '\033[92m'
+    BRIGHT_YELLOW = '\033[93m'
+    BRIGHT_BLUE = '\033[94m'
+    BRIGHT_MAGENTA = '\033[95m'
+    BRIGHT_CYAN = '\033[96m'
+    BRIGHT_WHITE = '\033[97m'
+    
+    # 背景色 - 标准
+    BG_BLACK = '\033[40m'
+    BG_RED = '\033[41m'
+    BG_GREEN = '\033[42m'
+    BG_YELLOW = '\033[43m'
+    BG_BLUE = '\033[44m'
+    BG_MAGENTA = '\033[45m'
+    BG_CYAN = '\033[46m'
+    BG_WHITE = '\033[47m'
+    
+    # 背景色 - 明亮
+    BG_BRIGHT_BLACK = '\033[100m'
+    BG_BRIGHT_RED = '\033[101m'
+    BG_BRIGHT_GREEN = '\033[102m'
+    BG_BRIGHT_YELLOW = '\033[103m'
+    BG_BRIGHT_BLUE = '\033[104m'
+    BG_BRIGHT_MAGENTA = '\033[105m'
+    BG_BRIGHT_CYAN = '\033[106m'
+    BG_BRIGHT_WHITE = '\033[107m'
+
+
+def supports_color():
+    """
+    检测终端是否支持颜色
+    Windows 上顺便启用控制台的 ANSI 转义序列支持（Windows 10 1607+ 和 Windows Terminal）
+    """
+    if sys.platform == 'win32':
+        try:
+            import ctypes
+            from ctypes import wintypes
+            kernel32 = ctypes.windll.kernel32
+            STD_OUTPUT_HANDLE = -11
+            ENABLE_VIRTUAL_TERMINAL_PROCESSING = 0x0004
+            
+            handle = kernel32.GetStdHandle(STD_OUTPUT_HANDLE)
+            mode = wintypes.DWORD()
+            if not kernel32.GetConsoleMode(handle, ctypes.byref(mode)):
+                return False
+            if not mode.value & ENABLE_VIRTUAL_TERMINAL_PROCESSING:
+                mode.value |= ENABLE_VIRTUAL_TERMINAL_PROCESSING
+                if not kernel32.SetConsoleMode(handle, mode):
+                    return False
+            return True
+        except:
+            return False
+    else:
+        return True  # Linux/Mac 通常支持
+
+
+# 首次输出彩色文本时才检测（None 表示尚未检测）
+SUPPORTS_COLOR = None
+
+
+def colorize(text, color_code):
+    """为文本添加颜色（如果支持）"""
+    global SUPPORTS_COLOR
+    if SUPPORTS_COLOR is None:
+        SUPPORTS_COLOR = supports_color()
+    if SUPPORTS_COLOR:
+        return f"{color_code}{text}{Colors.RESET}"
+    return text
+
+
+def print_header(title):
+    """打印标题"""
+    print()
+    print(colorize(f"| {title}", Colors.BRIGHT_CYAN + Colors.BOLD))
+    print()
+
+
+def print_section(title):
+    """打印章节标题"""
+    print()
+    print(colorize(f"| {title}", Colors.CYAN + Colors.BOLD))
+    print()
+
+
+def print_success(msg):
+    """打印成功消息"""
+    print(colorize(f" [OK] {msg}", Colors.BRIGHT_GREEN + Colors.BOLD))
+
+
+def print_error(msg, file=None):
+    """打印错误消息"""
+    print(colorize(f" [ERROR] {msg}", Colors.BRIGHT_RED + Colors.BOLD), file=file)
+
+
+def print_info(msg):
+    """打印信息消息"""
+    print(colorize(f" [INFO] {msg}", Colors.BRIGHT_CYAN))
+
+
+def print_warning(msg, file=None):
+    """打印警告消息"""
+    print(colorize(f" [WARN] {msg}", Colors.BRIGHT_YELLOW + Colors.BOLD), file=file)
+
+
+def print_tip(msg):
+    """打印提示消息"""
+    print(colorize(f" [TIP] {msg}", Colors.MAGENTA))
+
+
+def get_user_input(prompt, default=None, allow_empty=False):
+    """获取用户输入"""
+    default_text = f" [默认: {default}]" if default else ""
+    full_prompt = colorize(f"{prompt}{default_text}: ", Colors.BRIGHT_CYAN + Colors.BOLD)
+    
+    while True:
+        user_input = input(full_prompt).strip()
+        if not user_input:
+            if default:
+                return default
+            elif allow_empty:
+                return ""
+            else:
+                print_error("输入不能为空，请重新输入")
+                continue
+        return user_input
+
+
+def display_metadata(metadata):
+    """显示当前元数据"""
+    print_section("当前元数据")
+    
+    field_config = {
+        'Comment': Colors.BRIGHT_CYAN,
+        'Description': Colors.BRIGHT_BLUE,
+        'Source': Colors.BRIGHT_MAGENTA,
+        'URL': Colors.BRIGHT_YELLOW
+    }
+    
+    for key, value in metadata.items():
+        color = field_config.get(key, Colors.WHITE)
+        field_name = colorize(key, color + Colors.BOLD)
+        display_value = value if value else colorize("(空)", Colors.DIM)
+        print(colorize(f"| {field_name}: {display_value}", color))
+
+
+# ============================================================
+# 批处理命令行模式
+# ============================================================
+
+# 批处理模式识别的图片扩展名
+SUPPORTED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.ico')
+
+
+def iter_image_files(paths):
+    """
+    展开命令行给出的路径：文件、目录（递归）和通配符（惰性生成）
+    目录和通配符只收集支持的图片格式，显式给出的文件原样保留；
+    给出多个参数时重复路径只返回一次（只有一个参数时不可能重复，无需记录已见路径）
+    """
+    seen = set()
+    dedupe = len(paths) > 1
+    
+    def emit(path):
+        if not dedupe:
+            return True
+        key = os.path.abspath(path)
+        if key not in seen:
+            seen.add(key)
+            return True
+        return False
+    
+    def walk(directory):
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in SUPPORTED_EXTENSIONS:
+                    path = os.path.join(root, name)
+                    if emit(path):
+                        yield path
+    
+    for arg in paths:
+        if os.path.isdir(arg):
+            yield from walk(arg)
+        elif os.path.isfile(arg):
+            if emit(arg):
+                yield arg
+        else:
+            import glob
+            matches = sorted(glob.glob(arg, recursive=True))
+            if not matches:
+                print_warning(f"没有匹配的文件: {arg}", file=sys.stderr)
+            for match in matches:
+                if os.path.isdir(match):
+                    yield from walk(match)
+                elif os.path.splitext(match)[1].lower() in SUPPORTED_EXTENSIONS and emit(match):
+                    yield match
+
+
+# 单个文件的批处理结果
+# status: read / updated / unchanged / planned / verified / failed
+# saved: strip / optimize 节省的字节数（其他命令为 0）
+# error: 失败原因（写入检查点日志），成功时为 None
+BatchResult = namedtuple('BatchResult', 'path ok metadata status previous saved error', defaults=(0, None))
+
+
+def _apply_changes(metadata, command, changes):
+    """根据子命令计算新的元数据"""
+    metadata = dict(metadata)
+    if command in ('set', 'sync', 'plan'):
+        metadata.update(changes)
+    elif command == 'delete':
+        for key in changes:
+            metadata[key] = ''
+    elif command == 'clear':
+        metadata = {key: '' for key in METADATA_KEYS}
+    return metadata
+
+
+def _failed(path, reason, previous=None):
+    """把错误打印到 stderr（-q / --progress 时不打印）并返回带失败原因的 BatchResult"""
+    if not _QUIET_WORKERS:
+        print(f"[ERROR] {reason}", file=sys.stderr)
+    return BatchResult(path, False, None, 'failed', previous, error=reason)
+
+
+def _batch_worker(task):
+    """
+    在工作进程中处理单个文件
+    task: (command, path, changes)
+    返回 BatchResult；新值与现有值相同时不改写文件
+    """
+    command, path, changes = task
+    image_metadata.LAST_ERROR = None
+    start = _prof_start()
+    if image_metadata.PROFILER is not None:
+        image_metadata.PROFILER.path = path
+    try:
+        if command == 'verify':
+            problems = verify_file(path)
+            if problems:
+                return _failed(path, f"校验 {path} 失败: {'; '.join(problems)}")
+            return BatchResult(path, True, None, 'verified', None)
+        current = read_metadata(path)
+        if command == 'get':
+            return BatchResult(path, True, current, 'read', None)
+        if command == 'optimize':
+            if os.path.splitext(path)[1].lower() != '.png':
+                return BatchResult(path, True, current, 'unchanged', current)
+            saved = optimize_png(path, changes)
+            if saved is None:
+                return BatchResult(path, False, None, 'failed', current, error=image_metadata.LAST_ERROR)
+            problems = verify_file(path, current) if image_metadata.VERIFY_WRITES else []
+            if problems:
+                return _failed(path, f"写入后校验 {path} 失败: {'; '.join(problems)}", current)
+            return BatchResult(path, True, current, 'updated' if saved else 'unchanged', current, saved)
+        if command == 'embed':
+            embedded = embed_sidecar(path, changes)
+            if embedded is None:
+                return BatchResult(path, False, None, 'failed', current, error=image_metadata.LAST_ERROR)
+            if not embedded:
+                return BatchResult(path, True, current, 'unchanged', current)
+            metadata = read_metadata(path)
+            problems = verify_file(path, metadata) if image_metadata.VERIFY_WRITES else []
+            if problems:
+                return _failed(path, f"写入后校验 {path} 失败: {'; '.join(problems)}", current)
+            return BatchResult(path, True, metadata, 'updated', current)
+        if command == 'strip':
+            saved = strip_metadata(path, changes)
+            if saved is None:
+                return BatchResult(path, False, None, 'failed', current, error=image_metadata.LAST_ERROR)
+            metadata = {key: current[key] if key in changes else '' for key in METADATA_KEYS}
+            problems = verify_file(path, metadata) if image_metadata.VERIFY_WRITES else []
+            if problems:
+                return _failed(path, f"写入后校验 {path} 失败: {'; '.join(problems)}", current)
+            return BatchResult(path, True, metadata, 'updated' if saved else 'unchanged', current, saved)
+        metadata = _apply_changes(current, command, changes)
+        if metadata == current:
+            return BatchResult(path, True, metadata, 'unchanged', current)
+        if command == 'plan':
+            return BatchResult(path, True, metadata, 'planned', current)
+        if update_metadata(path, metadata):
+            # 元数据只改写文件头/文本块，像素数据不解码也不重新编码
+            _prof_count('pixel_reencodes_avoided')
+            problems = verify_file(path, metadata) if image_metadata.VERIFY_WRITES else []
+            if problems:
+                return _failed(path, f"写入后校验 {path} 失败: {'; '.join(problems)}", current)
+            return BatchResult(path, True, metadata, 'updated', current)
+        return BatchResult(path, False, None, 'failed', current, error=image_metadata.LAST_ERROR)
+    except Exception as e:
+        return _failed(path, f"处理 {path} 时出错: {e}")
+    finally:
+        _prof_end('file', start)
+        if image_metadata.PROFILER is not None:
+            image_metadata.PROFILER.path = None
+
+
+def _init_worker(fsync_mode, metadata_format='xmp', profile=False, verify=False, priority=None, quiet=False,
+                 sidecar='off', cwd=None):
+    """
+    在工作进程中应用主进程的写入策略、存储格式和开关（spawn 方式启动时不会继承全局变量）
+    设置随每批任务一起发送：serve 模式下进程池常驻，前后请求的设置可能不同
+    priority: (nice, ionice)，见 set_process_priority
+    quiet: 丢弃工作进程的输出（见 set_quiet_workers）
+    sidecar: 边车模式（见 image_metadata.set_sidecar_mode）
+    cwd: 提交任务时主进程的工作目录，任务中的相对路径以它为基准
+         （serve 模式下每个请求的工作目录不同，常驻的工作进程不能沿用创建时或上一个请求的目录）
+    """
+    if cwd is not None and cwd != os.getcwd():
+        os.chdir(cwd)
+    set_fsync_mode(fsync_mode)
+    set_metadata_format(metadata_format)
+    set_sidecar_mode(sidecar)
+    enable_profiling(profile)
+    set_verify_writes(verify)
+    set_quiet_workers(quiet)
+    if priority is not None:
+        set_process_priority(*priority)
+
+
+# 为 True 时处理文件时不向终端输出诊断信息（-q 和 --progress 使用，失败原因随 BatchResult.error 返回）
+_QUIET_WORKERS = False
+
+
+def set_quiet_workers(quiet):
+    """设置之后的批处理是否丢弃处理文件时的输出（stdout 和 stderr）"""
+    global _QUIET_WORKERS
+    _QUIET_WORKERS = quiet
+
+
+def _auto_chunksize(total, jobs):
+    """按每个进程约 4 批的粒度分配任务，单批最多 64 个文件"""
+    return max(1, min(64, total // (jobs * 4)))
+
+
+# 任务总数未知（流式输入）时每批分发的文件数
+STREAM_CHUNKSIZE = 16
+
+# serve 模式的常驻进程池（None 表示每次批处理临时创建）
+_SHARED_EXECUTOR = None
+
+
+def _quiet_output():
+    """丢弃 stdout 和 stderr 的上下文管理器"""
+    import io
+    from contextlib import ExitStack, redirect_stderr, redirect_stdout
+    
+    stack = ExitStack()
+    stack.enter_context(redirect_stdout(io.StringIO()))
+    stack.enter_context(redirect_stderr(io.StringIO()))
+    return stack
+
+
+def _batch_chunk_worker(tasks, settings=None):
+    """
+    在工作进程中处理一批任务，返回 (结果列表, 分析数据, 耗时秒数)；未启用分析时分析数据为 None
+    耗时只计处理本身，不含排队时间，供 BatchScheduler 估计存储延迟
+    """
+    if settings is not None:
+        _init_worker(*settings)
+    start = time.perf_counter()
+    if _QUIET_WORKERS:
+        with _quiet_output():
+            results = [_batch_worker(task) for task in tasks]
+    else:
+        results = [_batch_worker(task) for task in tasks]
+    elapsed = time.perf_counter() - start
+    return results, image_metadata.PROFILER.drain() if image_metadata.PROFILER is not None else None, elapsed
+
+
+def _chunked(iterable, size):
+    """把可迭代对象切成若干个长度不超过 size 的列表（惰性）"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# ==================== 调度与限速 ====================
+#
+# 共享存储（如 NAS）上批量改写时，并行过多会挤占其他服务的 I/O，单进程又太慢：
+# BatchScheduler 在提交任务前按每秒字节数/文件数限速，并按每个文件的处理延迟用 AIMD 调整并发数；
+# 工作进程可以降低 CPU（nice）和 I/O（ionice）优先级
+
+# ionice 调度类（realtime 需要 root，不提供）
+IOPRIO_CLASSES = {'best-effort': 2, 'idle': 3}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+# ioprio_set 的系统调用号（没有 libc 封装）
+IOPRIO_SET_SYSCALLS = {'x86_64': 251, 'i386': 289, 'i686': 289, 'aarch64': 30, 'armv7l': 314,
+                       'ppc64le': 273, 'riscv64': 30}
+
+# 当前进程已应用的优先级，避免每批任务重复设置和重复警告
+_APPLIED_PRIORITY = None
+
+
+def set_process_priority(nice=None, ionice=None):
+    """
+    降低当前进程的 CPU / I/O 优先级
+    nice: 绝对 nice 值（0-19）；ionice: (调度类, 级别)，如 ('idle', 0) 或 ('best-effort', 7)
+    不支持的平台或权限不足时打印警告并继续
+    """
+    global _APPLIED_PRIORITY
+    if (nice, ionice) == _APPLIED_PRIORITY:
+        return
+    _APPLIED_PRIORITY = (nice, ionice)
+    if nice is not None:
+        try:
+            os.setpriority(os.PRIO_PROCESS, 0, nice)
+        except (AttributeError, OSError) as e:
+            print(f"[WARN] 设置 nice {nice} 失败: {e}", file=sys.stderr)
+    if ionice is not None:
+        import ctypes
+        import platform
+        
+        io_class, level = ionice
+        syscall = IOPRIO_SET_SYSCALLS.get(platform.machine())
+        if not sys.platform.startswith('linux') or syscall is None:
+            print("[WARN] 当前平台不支持 ionice，已忽略", file=sys.stderr)
+            return
+        libc = ctypes.CDLL(None, use_errno=True)
+        value = IOPRIO_CLASSES[io_class] << IOPRIO_CLASS_SHIFT | level
+        if libc.syscall(syscall, IOPRIO_WHO_PROCESS, 0, value) != 0:
+            print(f"[WARN] 设置 ionice {io_class} 失败: {os.strerror(ctypes.get_errno())}", file=sys.stderr)
+
+
+def parse_byte_rate(text):
+    """解析 --max-bytes-per-sec 的取值，支持 K/M/G 后缀（1024 进制），如 20M"""
+    import argparse
+    
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    text = text.strip().upper()
+    text = text[:-1] if text.endswith('B') else text
+    try:
+        value = float(text[:-1]) * units[text[-1]] if text[-1:] in units else float(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无效的速率: {text}（示例: 500K、20M）")
+    if value <= 0:
+        raise argparse.ArgumentTypeError("速率必须大于 0")
+    return value
+
+
+def parse_ionice(text):
+    """解析 --ionice 的取值: idle 或 best-effort[:0-7]"""
+    import argparse
+    
+    io_class, _, level = text.partition(':')
+    if io_class not in IOPRIO_CLASSES or not (level or '7').isdigit() or int(level or 7) > 7:
+        raise argparse.ArgumentTypeError(f"无效的 ionice: {text}（可用: idle、best-effort[:0-7]）")
+    return io_class, int(level or 7)
+
+
+class BatchScheduler:
+    """
+    批处理调度器
+    - 限速：按每秒字节数（以文件大小计）和每秒文件数限制任务提交，允许 BURST_SECONDS 秒的突发
+    - 自适应并发（AIMD）：从 1 个在途文件开始，每完成一轮（等于当前并发数的文件）且延迟正常时加 1，
+      延迟超过基线的 LATENCY_TOLERANCE 倍时减半，上限为 -j 指定的进程数
+    延迟按文件大小归一化（秒 / (字节数 + FIXED_COST_BYTES)），并取指数滑动平均；
+    基线取观测到的最小值，每个文件上浮 BASELINE_DRIFT，存储整体变慢后能重新确定基线
+    """
+    
+    BURST_SECONDS = 1.0
+    LATENCY_TOLERANCE = 1.5
+    FIXED_COST_BYTES = 64 * 1024
+    EWMA_ALPHA = 0.3
+    BASELINE_DRIFT = 0.01
+    
+    def __init__(self, max_bytes_per_sec=None, max_files_per_sec=None, adaptive=False, priority=None):
+        self.max_bytes_per_sec = max_bytes_per_sec
+        self.max_files_per_sec = max_files_per_sec
+        self.adaptive = adaptive
+        self.priority = priority
+        self.bytes_time = self.files_time = 0.0
+        self.throttled = 0.0
+        self.limit = self.peak = self.max_jobs = 1
+        self.latency = self.baseline = None
+        self.since_change = 0
+    
+    def start(self, jobs):
+        """开始一次批处理，返回初始并发数"""
+        self.max_jobs = jobs
+        self.limit = 1 if self.adaptive else jobs
+        self.peak = max(self.peak, self.limit)
+        self.since_change = 0
+        return self.limit
+    
+    @property
+    def needs_sizes(self):
+        return bool(self.max_bytes_per_sec or self.adaptive)
+    
+    def acquire(self, tasks):
+        """提交一批任务前调用：超出速率时等待，返回这批文件的总字节数"""
+        nbytes = 0
+        if self.needs_sizes:
+            for task in tasks:
+                try:
+                    nbytes += os.path.getsize(task[1])
+                except OSError:
+                    pass
+        now = time.monotonic()
+        ready = now
+        # 虚拟时间：每个资源记录"额度用完的时刻"，落后当前时间超过突发窗口时从窗口起点算
+        if self.max_bytes_per_sec:
+            self.bytes_time = max(self.bytes_time, now - self.BURST_SECONDS) + nbytes / self.max_bytes_per_sec
+            ready = max(ready, self.bytes_time)
+        if self.max_files_per_sec:
+            self.files_time = max(self.files_time, now - self.BURST_SECONDS) + len(tasks) / self.max_files_per_sec
+            ready = max(ready, self.files_time)
+        if ready > now:
+            time.sleep(ready - now)
+            self.throttled += ready - now
+        return nbytes
+    
+    def observe(self, files, nbytes, elapsed):
+        """一批任务完成后调用，按延迟调整并发数"""
+        if not self.adaptive or not files:
+            return
+        sample = elapsed / (nbytes + files * self.FIXED_COST_BYTES)
+        if self.latency is None:
+            self.latency = self.baseline = sample
+        else:
+            self.latency += self.EWMA_ALPHA * (sample - self.latency)
+            self.baseline = min(self.baseline * (1 + self.BASELINE_DRIFT), self.latency)
+        self.since_change += files
+        if self.since_change < self.limit:
+            return
+        self.since_change = 0
+        if self.latency > self.baseline * self.LATENCY_TOLERANCE:
+            self.limit = max(1, self.limit // 2)
+        else:
+            self.limit = min(self.max_jobs, self.limit + 1)
+            self.peak = max(self.peak, self.limit)
+
+
+# 当前批处理使用的调度器（None 表示不限速、固定并发）
+_SCHEDULER = None
+
+
+def set_scheduler(scheduler):
+    """设置之后批处理使用的调度器（None 表示不使用）"""
+    global _SCHEDULER
+    _SCHEDULER = scheduler
+
+
+def run_tasks(tasks, jobs=None, chunksize=STREAM_CHUNKSIZE, on_result=None, max_pending=None):
+    """
+    流式执行任务 (command, path, changes)
+    任务按 chunksize 分批提交给进程池，同时在途的批次不超过 max_pending（默认每个进程 4 批），
+    因此 tasks 可以是无限长的生成器，内存占用与输入规模无关
+    返回各状态的计数
+    """
+    jobs = jobs or os.cpu_count() or 1
+    counts = Counter()
+    scheduler = _SCHEDULER
+    
+    def collect(result):
+        counts[result.status] += 1
+        if on_result:
+            on_result(result)
+    
+    def collect_chunk(chunk_result, nbytes):
+        results, profile, elapsed = chunk_result
+        if profile is not None and image_metadata.PROFILER is not None:
+            image_metadata.PROFILER.merge(profile)
+        if scheduler is not None:
+            scheduler.observe(len(results), nbytes, elapsed)
+        for result in results:
+            collect(result)
+    
+    if jobs == 1:
+        if scheduler is not None:
+            scheduler.start(1)
+            if scheduler.priority is not None:
+                set_process_priority(*scheduler.priority)
+        for task in tasks:
+            if scheduler is not None:
+                scheduler.acquire((task,))
+            if _QUIET_WORKERS:
+                # 只屏蔽处理过程中的输出，on_result 仍可写 stdout（如 dump）
+                with _quiet_output():
+                    result = _batch_worker(task)
+                collect(result)
+            else:
+                collect(_batch_worker(task))
+    else:
+        from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+        
+        max_pending = max_pending or jobs * 4
+        if scheduler is not None:
+            # 逐个文件提交，限速和并发控制的粒度才是单个文件
+            chunksize = 1
+            scheduler.start(jobs)
+        chunks = _chunked(tasks, chunksize)
+        settings = (image_metadata.FSYNC_MODE, image_metadata.METADATA_FORMAT,
+                    image_metadata.PROFILER is not None, image_metadata.VERIFY_WRITES,
+                    scheduler.priority if scheduler is not None else None, _QUIET_WORKERS,
+                    image_metadata.SIDECAR_MODE, os.getcwd())
+        # serve 模式下复用常驻进程池，否则为本次调用创建进程池
+        executor = _SHARED_EXECUTOR or ProcessPoolExecutor(jobs)
+        try:
+            pending = {}
+            for chunk in chunks:
+                nbytes = scheduler.acquire(chunk) if scheduler is not None else 0
+                pending[executor.submit(_batch_chunk_worker, chunk, settings)] = nbytes
+                # 自适应模式下并发上限随延迟变化，可能一次需要等待多个任务完成
+                while len(pending) >= (scheduler.limit if scheduler is not None and scheduler.adaptive
+                                       else max_pending):
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect_chunk(future.result(), pending.pop(future))
+            for future, nbytes in pending.items():
+                collect_chunk(future.result(), nbytes)
+        finally:
+            if executor is not _SHARED_EXECUTOR:
+                executor.shutdown()
+    
+    if image_metadata.FSYNC_MODE == 'batch' and counts['updated'] and hasattr(os, 'sync'):
+        # 批量模式：所有文件写完后统一落盘一次
+        os.sync()
+    
+    return counts
+
+
+def run_batch(command, files, changes=None, jobs=None, chunksize=None, on_result=None,
+              changes_by_path=None):
+    """
+    在进程池中批量执行 get/set/delete/clear/sync/plan
+    files: 文件路径列表
+    changes_by_path: 每个文件各自的修改（sync/plan 使用），优先于 changes
+    on_result: 每处理完一个文件调用一次 on_result(BatchResult)
+    返回各状态的计数 {'read': n, 'updated': n, ...}
+    """
+    files = list(files)
+    jobs = jobs or os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(files)))
+    if changes_by_path is not None:
+        tasks = ((command, path, changes_by_path[path]) for path in files)
+    else:
+        tasks = ((command, path, changes) for path in files)
+    chunksize = chunksize or _auto_chunksize(len(files), jobs)
+    return run_tasks(tasks, jobs, chunksize, on_result)
+
+
+# 计算内容哈希时每次读取的字节数
+HASH_BUFFER_SIZE = 1024 * 1024
+
+
+def _file_digest(path):
+    """流式计算文件内容的 BLAKE2b 摘要（不把整个文件读入内存）"""
+    import hashlib
+    
+    digest = hashlib.blake2b(digest_size=16)
+    buffer = bytearray(HASH_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            digest.update(view[:n])
+    return digest.digest()
+
+
+def find_duplicate_groups(files, jobs=None, changes_by_path=None):
+    """
+    按内容把文件分组：先按大小预筛，只对大小相同的文件计算哈希（多线程）
+    changes_by_path: 每个文件各自的修改，修改不同的文件不会分到同一组
+    返回 (groups, hashed_bytes)：groups 为 [[path, ...], ...]，每组第一个文件作为代表，
+    没有重复的文件自成一组
+    """
+    def group_key(path):
+        changes = changes_by_path[path] if changes_by_path is not None else None
+        return tuple(sorted(changes.items())) if isinstance(changes, dict) else changes
+    
+    files = list(files)
+    by_size = {}
+    groups = []
+    for path in files:
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            # 交给正常流程报告错误
+            groups.append([path])
+            continue
+        by_size.setdefault((size, group_key(path)), []).append(path)
+    
+    candidates = [path for same_size in by_size.values() if len(same_size) > 1 for path in same_size]
+    digests = {}
+    hashed_bytes = 0
+    if candidates:
+        from concurrent.futures import ThreadPoolExecutor
+        
+        # hashlib 计算大块数据时会释放 GIL，线程即可并行
+        with ThreadPoolExecutor(max(1, jobs or os.cpu_count() or 1)) as executor:
+            for path, digest in zip(candidates, executor.map(_safe_digest, candidates)):
+                digests[path] = digest
+                if digest is not None:
+                    hashed_bytes += os.path.getsize(path)
+    
+    for (size, key), same_size in by_size.items():
+        if len(same_size) == 1:
+            groups.append(same_size)
+            continue
+        by_digest = {}
+        for path in same_size:
+            digest = digests.get(path)
+            if digest is None:
+                groups.append([path])
+            else:
+                by_digest.setdefault(digest, []).append(path)
+        groups.extend(by_digest.values())
+    order = {path: i for i, path in enumerate(files)}
+    groups.sort(key=lambda group: order[group[0]])
+    return groups, hashed_bytes
+
+
+def _safe_digest(path):
+    """计算摘要，读取失败时返回 None（该文件不参与去重）"""
+    try:
+        return _file_digest(path)
+    except OSError:
+        return None
+
+
+def _same_file(a, b):
+    """两个路径是否指向同一个文件（如已经是硬链接）"""
+    try:
+        return os.path.samefile(a, b)
+    except OSError:
+        return False
+
+
+def run_batch_dedup(command, files, changes=None, jobs=None, chunksize=None, on_result=None,
+                    changes_by_path=None, link='copy'):
+    """
+    带内容去重的 run_batch：每组内容相同的文件只处理第一个，修改后把结果复制（或克隆/硬链接）给其余文件
+    第一个文件处理失败的组，其余文件退回逐个处理
+    返回 (counts, stats)，stats 记录去重节省的工作量和实际写入量
+    """
+    start = _prof_start()
+    groups, hashed_bytes = find_duplicate_groups(files, jobs, changes_by_path)
+    _prof_end('hash', start, hashed_bytes)
+    members = {group[0]: group[1:] for group in groups if len(group) > 1}
+    stats = Counter(groups=len(members), hashed_bytes=hashed_bytes)
+    counts = Counter()
+    retry = []
+    
+    def emit(result):
+        counts[result.status] += 1
+        if on_result:
+            on_result(result)
+    
+    def on_leader_result(result):
+        emit(result)
+        for member in members.get(result.path, ()):
+            if not result.ok:
+                retry.append(member)
+                continue
+            if result.status == 'updated' and not _same_file(result.path, member):
+                try:
+                    written, linked = _replicate_file(result.path, member, link)
+                except OSError as e:
+                    emit(_failed(member, f"写入重复文件 {member} 时出错: {e}", result.previous))
+                    continue
+                stats['copied_bytes'] += written
+                if linked:
+                    stats['linked'] += 1
+                    stats['linked_bytes'] += os.path.getsize(member)
+                problems = verify_file(member, result.metadata) if image_metadata.VERIFY_WRITES else []
+                if problems:
+                    emit(_failed(member, f"写入后校验 {member} 失败: {'; '.join(problems)}", result.previous))
+                    continue
+            stats['skipped'] += 1
+            emit(result._replace(path=member))
+    
+    run_batch(command, [group[0] for group in groups], changes, jobs, chunksize, on_leader_result,
+              changes_by_path)
+    if retry:
+        run_batch(command, retry, changes, jobs, chunksize, emit, changes_by_path)
+    _prof_count('dedup_skipped', stats['skipped'])
+    return counts, stats
+
+
+class BatchJournal:
+    """
+    批处理检查点日志（JSON Lines，只追加），用于 --resume / --retry-failed
+    第一行记录命令和参数，之后每处理完一个文件追加一行 [状态, 路径, 原因]：
+    done 已完成（原因为 updated/read/verified 等），skipped 无需修改，failed 失败（原因为错误信息）
+    写入经过缓冲，每 FLUSH_RECORDS 条或 FLUSH_INTERVAL 秒刷新一次，关闭时 fsync；
+    进程被杀死时最多丢失最后一次刷新之后的记录，这些文件续跑时会重新处理（修改是幂等的）
+    """
+    
+    VERSION = 1
+    FLUSH_RECORDS = 256
+    FLUSH_INTERVAL = 1.0
+    
+    def __init__(self, journal_path, header, resume=False):
+        """resume 为 False 时清空已有日志；为 True 时载入已有记录并继续追加，参数不一致时抛出 ValueError"""
+        import json
+        
+        self._dumps = json.dumps
+        self.path = os.fspath(journal_path)
+        self.header = json.loads(json.dumps(dict(header, journal=self.VERSION), ensure_ascii=False))
+        self.states = {}
+        if resume and os.path.exists(self.path):
+            self._load()
+            self.file = open(self.path, 'a', encoding='utf-8', buffering=64 * 1024)
+        else:
+            self.file = open(self.path, 'w', encoding='utf-8', buffering=64 * 1024)
+            self._write(self.header)
+            self.file.flush()
+        self.pending = 0
+        self.last_flush = time.monotonic()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+    
+    def _load(self):
+        import json
+        
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        # 最后一行没有换行符说明写到一半被中断，丢弃并截断，之后的追加从完整的行开始
+        end = data.rfind(b'\n') + 1
+        if end < len(data):
+            os.truncate(self.path, end)
+        lines = data[:end].decode('utf-8').splitlines()
+        if not lines:
+            raise ValueError(f"检查点日志为空: {self.path}")
+        if json.loads(lines[0]) != self.header:
+            raise ValueError(f"检查点日志 {self.path} 记录的命令或参数与本次不同，请换一个日志文件或去掉 --resume / --retry-failed")
+        for line in lines[1:]:
+            state, path, _ = json.loads(line)
+            # 同一文件有多条记录时以最后一条为准（--retry-failed 之后的结果覆盖之前的失败）
+            self.states[path] = state
+    
+    def _write(self, record):
+        self.file.write(self._dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+    
+    def select(self, files, resume=False, retry_failed=False):
+        """
+        按日志筛选本次要处理的文件，返回 (files, skipped)，skipped 为 {状态: 跳过的文件数}
+        resume: 跳过已完成和无需修改的文件，失败的文件只在同时指定 retry_failed 时重试
+        只指定 retry_failed: 只处理日志中失败的文件
+        """
+        selected = []
+        skipped = Counter()
+        for path in files:
+            state = self.states.get(os.path.abspath(path))
+            if state == 'failed' and retry_failed or state is None and resume:
+                selected.append(path)
+            else:
+                skipped[state or 'unlisted'] += 1
+        return selected, skipped
+    
+    def record(self, result):
+        """记录一个 BatchResult，按条数或时间间隔批量刷新"""
+        if not result.ok:
+            record = ['failed', os.path.abspath(result.path), result.error or 'failed']
+        elif result.status == 'unchanged':
+            record = ['skipped', os.path.abspath(result.path), 'unchanged']
+        else:
+            record = ['done', os.path.abspath(result.path), result.status]
+        self._write(record)
+        self.pending += 1
+        if self.pending >= self.FLUSH_RECORDS or time.monotonic() - self.last_flush >= self.FLUSH_INTERVAL:
+            self.file.flush()
+            self.pending = 0
+            self.last_flush = time.monotonic()
+    
+    def close(self):
+        if self.file.closed:
+            return
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+
+def iter_stdin_paths(stream=None):
+    """逐行读取路径（如 find 的输出），跳过空行"""
+    for line in stream or sys.stdin:
+        line = line.rstrip('\r\n')
+        if line:
+            yield line
+
+
+def iter_jsonl_tasks(stream, on_error=None):
+    """
+    逐行解析 JSON Lines 输入，生成 ('sync', path, fields) 任务
+    每行格式: {"path": "...", "Description": "...", ...}，未出现的字段保持不变
+    无法解析的行交给 on_error(行号, 原因) 并跳过
+    """
+    import json
+    
+    for lineno, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+            path = record['path']
+            fields = {key: record[key] for key in METADATA_KEYS if key in record}
+            if not isinstance(path, str) or not all(isinstance(v, str) for v in fields.values()):
+                raise ValueError("path 和字段值必须是字符串")
+            if 'error' in record:
+                # dump 读取失败的记录，没有可应用的字段
+                raise ValueError(f"记录带有读取错误: {record['error']}")
+        except (ValueError, KeyError, TypeError) as e:
+            if on_error:
+                on_error(lineno, e)
+            continue
+        yield 'sync', path, fields
+
+
+def run_stream_cli(args):
+    """
+    dump / load 子命令：全程流式处理，适合 find ... | dump 和 load < edited.jsonl
+    dump 的 JSON 输出独占 stdout，状态和汇总信息写到 stderr
+    """
+    import json
+    
+    counts = Counter()
+    start = time.perf_counter()
+    set_quiet_workers(args.quiet)
+    
+    if args.command == 'dump':
+        if not args.paths or args.paths == ['-']:
+            files = iter_stdin_paths()
+        else:
+            files = iter_image_files(args.paths)
+        tasks = (('get', path, None) for path in files)
+        
+        def on_result(result):
+            counts[result.status] += 1
+            record = {'path': result.path}
+            if result.ok:
+                record.update(result.metadata)
+            else:
+                record['error'] = result.error or 'failed'
+            sys.stdout.write(json.dumps(record, ensure_ascii=False) + '\n')
+        
+        run_tasks(tasks, args.jobs, args.chunksize or STREAM_CHUNKSIZE, on_result)
+        sys.stdout.flush()
+        summary = sys.stderr
+    else:
+        def on_error(lineno, error):
+            counts['invalid'] += 1
+            if not args.quiet:
+                print_error(f"第 {lineno} 行无效，已跳过: {error}", file=sys.stderr)
+        
+        stream = sys.stdin if args.input == '-' else open(args.input, 'r', encoding='utf-8')
+        
+        def on_result(result):
+            counts[result.status] += 1
+            if not args.quiet and result.status != 'unchanged':
+                _print_batch_result('load', result)
+        
+        try:
+            run_tasks(iter_jsonl_tasks(stream, on_error), args.jobs,
+                      args.chunksize or STREAM_CHUNKSIZE, on_result)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        summary = sys.stdout
+    
+    set_quiet_workers(False)
+    elapsed = time.perf_counter() - start
+    total = sum(counts.values())
+    rate = total / elapsed if elapsed > 0 else 0
+    print(f"[INFO] 共 {total} 项：读取 {counts['read']}，已修改 {counts['updated']}，"
+          f"无需修改 {counts['unchanged']}，失败 {counts['failed']}，无效 {counts['invalid']}，"
+          f"耗时 {elapsed:.2f} 秒（{rate:.1f} 个/秒）", file=summary)
+    return 1 if counts['failed'] or counts['invalid'] else 0
+
+
+def _print_batch_result(command, result):
+    """打印单个文件的处理结果"""
+    if not result.ok:
+        print_error(f"{result.path}")
+        return
+    if result.status == 'planned':
+        print(colorize(f"| {result.path}", Colors.BRIGHT_YELLOW + Colors.BOLD))
+        for key in METADATA_KEYS:
+            old, new = result.previous.get(key, ''), result.metadata.get(key, '')
+            if old != new:
+                print(f"|   {key}: {old!r} -> {new!r}")
+        return
+    if result.status == 'unchanged':
+        print(colorize(f" [SKIP] {result.path}", Colors.DIM))
+        return
+    if command in ('strip', 'optimize'):
+        print_success(f"{result.path}（节省 {result.saved / 1024:.1f} KB）")
+        return
+    if command != 'get':
+        print_success(f"{result.path}")
+        return
+    print(colorize(f"| {result.path}", Colors.BRIGHT_CYAN + Colors.BOLD))
+    for key in METADATA_KEYS:
+        value = result.metadata.get(key, '')
+        print(f"|   {key}: {value if value else colorize('(空)', Colors.DIM)}")
+
+
+def _format_duration(seconds):
+    """把秒数格式化为 H:MM:SS"""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+class BatchProgress:
+    """
+    批处理的实时进度行（--progress）：已处理/总数、文件/秒、MB/秒、预计剩余时间、失败数和跳过数
+    输出是终端且支持颜色时由后台线程每 TTY_INTERVAL 秒原地重绘一行，
+    否则每 PLAIN_INTERVAL 秒打印一行纯文本；每个文件只累加计数，刷新开销与文件数无关
+    """
+    
+    TTY_INTERVAL = 0.25
+    PLAIN_INTERVAL = 10.0
+    
+    def __init__(self, total, stream=None):
+        import threading
+        
+        self.total = total
+        self.stream = stream or sys.stdout
+        color = SUPPORTS_COLOR if SUPPORTS_COLOR is not None else supports_color()
+        self.live = bool(color) and self.stream.isatty()
+        self.done = self.failed = self.skipped = self.bytes = 0
+        self.start = time.monotonic()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+    
+    def update(self, result):
+        """记录一个 BatchResult（大小取自刚处理过的文件，stat 命中缓存）"""
+        self.done += 1
+        if not result.ok:
+            self.failed += 1
+        elif result.status == 'unchanged':
+            self.skipped += 1
+        try:
+            self.bytes += os.path.getsize(result.path)
+        except OSError:
+            pass
+    
+    def line(self):
+        elapsed = max(time.monotonic() - self.start, 1e-6)
+        rate = self.done / elapsed
+        percent = self.done * 100 / self.total if self.total else 100.0
+        eta = _format_duration((self.total - self.done) / rate) if rate else '-:--:--'
+        return (f"| {self.done}/{self.total} ({percent:.1f}%)  {rate:.1f} 文件/秒  "
+                f"{self.bytes / elapsed / (1024 * 1024):.1f} MB/秒  剩余 {eta}  "
+                f"失败 {self.failed}  跳过 {self.skipped}")
+    
+    def _draw(self):
+        if self.live:
+            self.stream.write(f"\r\033[K{self.line()}")
+        else:
+            self.stream.write(f"{self.line()}\n")
+        self.stream.flush()
+    
+    def _run(self):
+        interval = self.TTY_INTERVAL if self.live else self.PLAIN_INTERVAL
+        while not self.stopped.wait(interval):
+            self._draw()
+    
+    def close(self):
+        """停止刷新；终端上清除进度行（之后打印汇总）"""
+        self.stopped.set()
+        self.thread.join()
+        if self.live:
+            self.stream.write("\r\033[K")
+            self.stream.flush()
+
+
+def _write_log_record(log, command, result):
+    """向 --log 文件写一行: 状态<TAB>路径<TAB>详情（失败原因、节省字节数或字段 JSON）"""
+    import json
+    
+    if not result.ok:
+        detail = result.error or ''
+    elif command in ('strip', 'optimize'):
+        detail = f"saved={result.saved}"
+    elif result.metadata is not None and result.status != 'unchanged':
+        detail = json.dumps(result.metadata, ensure_ascii=False)
+    else:
+        detail = ''
+    log.write(f"{result.status}\t{result.path}\t{detail}\n")
+
+
+def load_manifest(manifest_path):
+    """
+    读取元数据清单（JSON，安装 PyYAML 后也支持 YAML）
+    格式: {"路径通配符": {"Description": "...", "Source": "..."}, ...}
+    通配符相对于清单文件所在目录；未列出的字段保持不变，值为空字符串表示删除该字段
+    返回 [(pattern, fields), ...]
+    """
+    import json
+    
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        if os.path.splitext(manifest_path)[1].lower() in ('.yml', '.yaml'):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError("读取 YAML 清单需要 PyYAML 库，请安装: pip install pyyaml")
+            data = yaml.safe_load(f)
+        else:
+            data = json.load(f)
+    
+    if not isinstance(data, dict):
+        raise ValueError("清单顶层必须是 {路径通配符: 字段} 的映射")
+    
+    entries = []
+    for pattern, fields in data.items():
+        if not isinstance(fields, dict):
+            raise ValueError(f"清单条目 {pattern!r} 的值必须是字段映射")
+        for key, value in fields.items():
+            if key not in METADATA_KEYS:
+                raise ValueError(f"清单条目 {pattern!r} 包含未知字段: {key}")
+            if not isinstance(value, str):
+                raise ValueError(f"清单条目 {pattern!r} 的字段 {key} 必须是字符串")
+        entries.append((pattern, fields))
+    return entries
+
+
+def resolve_manifest(entries, base_dir):
+    """
+    将清单展开为 {文件路径: 期望字段}
+    同一文件匹配多个条目时按清单顺序合并，后面的条目覆盖前面的
+    """
+    desired = {}
+    for pattern, fields in entries:
+        for path in iter_image_files([os.path.join(base_dir, pattern)]):
+            desired.setdefault(path, {}).update(fields)
+    return desired
+
+
+class MetadataIndex:
+    """
+    持久化的元数据索引（SQLite）
+    以绝对路径为键，文件大小、mtime_ns 和 inode 都未变化时直接返回缓存的字段，
+    否则视为失效，需要重新读取图片
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS metadata (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            comment TEXT NOT NULL,
+            description TEXT NOT NULL,
+            source TEXT NOT NULL,
+            url TEXT NOT NULL
+        )
+    """
+    COLUMNS = {'Comment': 'comment', 'Description': 'description', 'Source': 'source', 'URL': 'url'}
+    
+    def __init__(self, db_path):
+        import sqlite3
+        
+        self.db_path = os.fspath(db_path)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(self.SCHEMA)
+        self.hits = 0
+        self.misses = 0
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+    
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+    
+    @staticmethod
+    def _key(path):
+        return os.path.abspath(path)
+    
+    def lookup(self, path, st=None):
+        """文件未变化时返回缓存的元数据，否则返回 None"""
+        try:
+            st = st or os.stat(path)
+        except OSError:
+            return None
+        row = self.conn.execute(
+            "SELECT size, mtime_ns, inode, comment, description, source, url FROM metadata WHERE path = ?",
+            (self._key(path),)
+        ).fetchone()
+        if row is None or tuple(row[:3]) != (st.st_size, st.st_mtime_ns, st.st_ino):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return dict(zip(METADATA_KEYS, row[3:]))
+    
+    def store(self, path, metadata, st=None):
+        """写入（或覆盖）一个文件的索引记录"""
+        try:
+            st = st or os.stat(path)
+        except OSError:
+            return
+        self.conn.execute(
+            "INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (self._key(path), st.st_size, st.st_mtime_ns, st.st_ino,
+             *(metadata.get(key, '') for key in METADATA_KEYS))
+        )
+    
+    def invalidate(self, paths=None):
+        """删除指定文件（或目录下所有文件）的记录，paths 为空时清空整个索引；返回删除的记录数"""
+        with self.conn:
+            if not paths:
+                return self.conn.execute("DELETE FROM metadata").rowcount
+            removed = 0
+            for path in paths:
+                key = self._key(path)
+                prefix = key.rstrip(os.sep) + os.sep
+                removed += self.conn.execute(
+                    "DELETE FROM metadata WHERE path = ? OR substr(path, 1, ?) = ?",
+                    (key, len(prefix), prefix)
+                ).rowcount
+            return removed
+    
+    def compact(self):
+        """删除已不存在或已变化文件的记录并压缩数据库文件；返回删除的记录数"""
+        stale = []
+        for path, size, mtime_ns, inode in self.conn.execute(
+                "SELECT path, size, mtime_ns, inode FROM metadata"):
+            try:
+                st = os.stat(path)
+            except OSError:
+                stale.append((path,))
+                continue
+            if (st.st_size, st.st_mtime_ns, st.st_ino) != (size, mtime_ns, inode):
+                stale.append((path,))
+        with self.conn:
+            self.conn.executemany("DELETE FROM metadata WHERE path = ?", stale)
+        self.conn.execute("VACUUM")
+        return len(stale)
+    
+    def query(self, missing=(), present=()):
+        """只查询索引（不访问图片文件），返回 [(path, metadata), ...]"""
+        conditions = [f"{self.COLUMNS[key]} = ''" for key in missing]
+        conditions += [f"{self.COLUMNS[key]} != ''" for key in present]
+        sql = "SELECT path, comment, description, source, url FROM metadata"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY path"
+        return [(row[0], dict(zip(METADATA_KEYS, row[1:]))) for row in self.conn.execute(sql)]
+
+
+def run_index_command(args):
+    """处理 query / index 子命令，只访问索引文件"""
+    with MetadataIndex(args.index) as index:
+        if args.command == 'query':
+            results = index.query(args.missing or (), args.present or ())
+            for path, metadata in results:
+                if args.quiet:
+                    print(path)
+                else:
+                    _print_batch_result('get', BatchResult(path, True, metadata, 'read', None))
+            if not args.quiet:
+                # -q 时只输出路径，便于管道处理
+                print_info(f"共 {len(results)} 条记录")
+        elif args.action == 'invalidate':
+            print_success(f"已失效 {index.invalidate(args.paths)} 条记录")
+        elif args.action == 'compact':
+            print_success(f"已清理 {index.compact()} 条过期记录，索引已压缩")
+    return 0
+
+
+# ==================== 常驻服务模式 ====================
+#
+# serve 在本地 Unix 套接字上监听，保持导入好的模块和进程池常驻。
+# 协议为按行分隔的 JSON，一个连接上可以连续发送多个请求：
+#   {"op": "get", "paths": [...]}
+#   {"op": "set", "paths": [...], "fields": {"Description": "..."}}
+#   {"op": "delete", "paths": [...], "fields": ["URL"]}
+#   {"op": "clear" | "verify", "paths": [...]}
+# 可选键: cwd（相对路径的基准目录）、jobs、format、fsync、verify
+# 回复一行 {"ok": true, "results": [{"path", "ok", "status", "metadata"}, ...], "counts": {...}}
+# 命令行客户端使用 {"op": "cli", "argv": [...], "cwd": ...}，服务端以多行
+# {"stdout": ...} / {"stderr": ...} 转发输出，最后一行 {"exit": 退出码}
+# 请求按到达顺序逐个处理（切换工作目录等全局状态不允许并发）
+
+# 可以转发给常驻服务的子命令（dump/load 读取客户端的标准输入，不转发）
+DAEMON_COMMANDS = ('get', 'set', 'delete', 'clear', 'strip', 'optimize', 'embed', 'verify', 'sync')
+
+
+def daemon_socket_path():
+    """常驻服务的套接字路径：IMAGE_METADATA_SOCKET > $XDG_RUNTIME_DIR > 临时目录（按用户区分）"""
+    path = os.environ.get('IMAGE_METADATA_SOCKET')
+    if path:
+        return path
+    directory = os.environ.get('XDG_RUNTIME_DIR') or os.environ.get('TMPDIR') or '/tmp'
+    return os.path.join(directory, f"add_image_metadata-{os.getuid()}.sock")
+
+
+def _daemon_available(path):
+    """套接字存在且属于当前用户时才尝试连接（不连接其他用户放置的套接字）"""
+    import stat
+    
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return stat.S_ISSOCK(st.st_mode) and st.st_uid == os.getuid()
+
+
+def _connect_daemon(path):
+    """连接常驻服务，失败时返回 None"""
+    import socket
+    
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def forward_to_daemon(argv):
+    """
+    常驻服务运行时把命令行转发给它执行，返回退出码
+    服务未运行、平台不支持或设置了 IMAGE_METADATA_NO_DAEMON 时返回 None，由调用方在本进程中执行
+    """
+    if sys.platform == 'win32' or os.environ.get('IMAGE_METADATA_NO_DAEMON'):
+        return None
+    path = daemon_socket_path()
+    if not _daemon_available(path):
+        return None
+    sock = _connect_daemon(path)
+    if sock is None:
+        return None
+    import json
+    
+    request = {'op': 'cli', 'argv': argv, 'cwd': os.getcwd(), 'color': supports_color()}
+    code = None
+    with sock, sock.makefile('rb') as reader:
+        try:
+            sock.sendall(json.dumps(request, ensure_ascii=False).encode('utf-8') + b'\n')
+            for line in reader:
+                message = json.loads(line)
+                if 'stdout' in message:
+                    sys.stdout.write(message['stdout'])
+                    sys.stdout.flush()
+                elif 'stderr' in message:
+                    sys.stderr.write(message['stderr'])
+                elif 'exit' in message:
+                    code = message['exit']
+                    break
+                elif 'error' in message:
+                    print_error(f"常驻服务: {message['error']}", file=sys.stderr)
+                    return 1
+        except OSError:
+            pass
+    if code is None:
+        # 服务在执行中途退出：输出可能不完整，不再本地重试以免重复修改
+        print_error("常驻服务连接中断", file=sys.stderr)
+        return 1
+    return code
+
+
+class _StreamForwarder:
+    """把 print 的输出按块转发给客户端的类文件对象（攒够 8 KB 或 flush 时发送）"""
+    
+    def __init__(self, send, stream):
+        self.send = send
+        self.stream = stream
+        self.buffer = []
+        self.size = 0
+    
+    def write(self, text):
+        self.buffer.append(text)
+        self.size += len(text)
+        if self.size >= 8192:
+            self.flush()
+        return len(text)
+    
+    def flush(self):
+        if self.buffer:
+            self.send({self.stream: ''.join(self.buffer)})
+            self.buffer = []
+            self.size = 0
+    
+    def isatty(self):
+        return False
+
+
+def _serve_cli(request, send):
+    """执行转发来的命令行，输出实时转发给客户端，返回退出码"""
+    from contextlib import redirect_stderr, redirect_stdout
+    
+    global SUPPORTS_COLOR
+    stdout = _StreamForwarder(send, 'stdout')
+    stderr = _StreamForwarder(send, 'stderr')
+    saved_color = SUPPORTS_COLOR
+    SUPPORTS_COLOR = bool(request.get('color'))
+    try:
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            try:
+                code = run_batch_cli(list(request['argv']))
+            except SystemExit as e:
+                # argparse 的 --help 和参数错误
+                code = e.code if isinstance(e.code, int) else (0 if e.code is None else 2)
+            except Exception as e:
+                print_error(f"执行失败: {e}")
+                code = 1
+    finally:
+        SUPPORTS_COLOR = saved_color
+        stdout.flush()
+        stderr.flush()
+    return code
+
+
+def _serve_request(request):
+    """处理结构化的 get/set/delete/clear/verify 请求，返回回复字典"""
+    import io
+    from contextlib import redirect_stderr, redirect_stdout
+    
+    op = request.get('op')
+    paths = request.get('paths')
+    if not isinstance(paths, list) or not paths:
+        return {'ok': False, 'error': "paths 必须是非空列表"}
+    changes = None
+    if op == 'set':
+        changes = request.get('fields')
+        if not isinstance(changes, dict) or not changes or not set(changes) <= set(METADATA_KEYS):
+            return {'ok': False, 'error': f"fields 必须是字段到文本的映射，可用字段: {', '.join(METADATA_KEYS)}"}
+        changes = {key: str(value) for key, value in changes.items()}
+    elif op == 'delete':
+        changes = request.get('fields')
+        if not isinstance(changes, list) or not changes or not set(changes) <= set(METADATA_KEYS):
+            return {'ok': False, 'error': f"fields 必须是字段名列表，可用字段: {', '.join(METADATA_KEYS)}"}
+    
+    fsync_mode = request.get('fsync', 'always')
+    metadata_format = request.get('format', 'xmp')
+    sidecar = request.get('sidecar', 'off')
+    if fsync_mode not in FSYNC_MODES or metadata_format not in METADATA_FORMATS or sidecar not in SIDECAR_MODES:
+        return {'ok': False, 'error': "fsync、format 或 sidecar 取值无效"}
+    set_fsync_mode(fsync_mode)
+    set_metadata_format(metadata_format)
+    set_sidecar_mode(sidecar)
+    set_verify_writes(bool(request.get('verify')))
+    enable_profiling(False)
+    set_scheduler(None)
+    
+    results = []
+    log = io.StringIO()
+    with redirect_stdout(log), redirect_stderr(log):
+        files = list(iter_image_files(paths))
+        counts = run_batch(op, files, changes, request.get('jobs'), on_result=results.append)
+    reply = {
+        'ok': not counts['failed'],
+        'results': [{'path': r.path, 'ok': r.ok, 'status': r.status, 'metadata': r.metadata} for r in results],
+        'counts': dict(counts),
+    }
+    if log.getvalue():
+        reply['log'] = log.getvalue()
+    return reply
+
+
+def _serve_connection(conn):
+    """处理一个客户端连接上的所有请求（每行一个 JSON 请求），返回是否收到停止请求"""
+    import json
+    
+    def send(message):
+        conn.sendall(json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n')
+    
+    base_dir = os.getcwd()
+    with conn.makefile('rb') as reader:
+        for line in reader:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("请求必须是 JSON 对象")
+            except ValueError as e:
+                send({'ok': False, 'error': f"无效的请求: {e}"})
+                continue
+            op = request.get('op')
+            if op == 'ping':
+                send({'ok': True, 'pid': os.getpid()})
+                continue
+            if op == 'shutdown':
+                send({'ok': True})
+                return True
+            try:
+                if request.get('cwd'):
+                    os.chdir(request['cwd'])
+                if op == 'cli':
+                    send({'exit': _serve_cli(request, send)})
+                elif op in ('get', 'set', 'delete', 'clear', 'verify'):
+                    send(_serve_request(request))
+                else:
+                    send({'ok': False, 'error': f"未知的操作: {op}"})
+            except OSError as e:
+                send({'ok': False, 'error': str(e)})
+            finally:
+                os.chdir(base_dir)
+    return False
+
+
+def run_serve(socket_path=None, jobs=None):
+    """
+    启动常驻服务，直到收到 shutdown 请求或 SIGTERM/SIGINT
+    jobs > 1 时预先创建进程池供各请求复用
+    """
+    global _SHARED_EXECUTOR
+    import signal
+    import socket
+    
+    if not hasattr(socket, 'AF_UNIX'):
+        print_error("当前平台不支持 Unix 套接字，无法启动常驻服务")
+        return 2
+    socket_path = socket_path or daemon_socket_path()
+    if os.path.exists(socket_path):
+        probe = _connect_daemon(socket_path)
+        if probe is not None:
+            probe.close()
+            print_error(f"常驻服务已在运行: {socket_path}")
+            return 1
+        # 上次异常退出留下的套接字文件
+        os.unlink(socket_path)
+    
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o177)
+    try:
+        server.bind(socket_path)
+    finally:
+        os.umask(old_umask)
+    server.listen(64)
+    
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+    
+    jobs = jobs or os.cpu_count() or 1
+    if jobs > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        _SHARED_EXECUTOR = ProcessPoolExecutor(jobs)
+    print_info(f"常驻服务已启动: {socket_path}（进程 {os.getpid()}，{jobs} 个工作进程）")
+    try:
+        while True:
+            conn, _ = server.accept()
+            with conn:
+                try:
+                    if _serve_connection(conn):
+                        break
+                except (BrokenPipeError, ConnectionResetError):
+                    # 客户端提前断开
+                    pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        try:
+            os.unlink(socket_path)
+        except OSError:
+            pass
+        if _SHARED_EXECUTOR is not None:
+            _SHARED_EXECUTOR.shutdown()
+            _SHARED_EXECUTOR = None
+    print_info("常驻服务已停止")
+    return 0
+
+
+def stop_daemon(socket_path=None):
+    """请求常驻服务退出"""
+    socket_path = socket_path or daemon_socket_path()
+    sock = _connect_daemon(socket_path) if os.path.exists(socket_path) else None
+    if sock is None:
+        print_warning(f"常驻服务未运行: {socket_path}")
+        return 1
+    with sock:
+        sock.sendall(b'{"op": "shutdown"}\n')
+        sock.recv(64)
+    print_success("常驻服务已停止")
+    return 0
+
+
+# ==================== 监视模式 ====================
+
+# inotify 事件掩码（<sys/inotify.h>）
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+# 只关心写完关闭和移入的文件；目录的 IN_CREATE 用于给新建的子目录添加监视
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+
+class Inotify:
+    """基于 ctypes 调用 libc 的最小 inotify 封装（仅 Linux）"""
+    
+    def __init__(self):
+        import ctypes
+        
+        libc = ctypes.CDLL(None, use_errno=True)
+        self._get_errno = ctypes.get_errno
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            self._raise()
+        self.watches = {}  # 监视描述符 -> 目录
+    
+    def _raise(self):
+        err = self._get_errno()
+        raise OSError(err, os.strerror(err))
+    
+    def add_watch(self, directory):
+        """监视一个目录（inotify 不递归，子目录需要分别添加）"""
+        wd = self._add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            self._raise()
+        self.watches[wd] = directory
+    
+    def read_events(self):
+        """读取已就绪的事件，返回 [(路径, 掩码), ...]；事件队列溢出时路径为 None"""
+        import struct
+        
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + 16 <= len(data):
+            # struct inotify_event { int wd; uint32_t mask, cookie, len; char name[]; }
+            wd, mask, _, length = struct.unpack_from('iIII', data, offset)
+            name = data[offset + 16:offset + 16 + length].rstrip(b'\0')
+            offset += 16 + length
+            if mask & IN_Q_OVERFLOW:
+                events.append((None, mask))
+            elif mask & IN_IGNORED:
+                # 目录被删除或移走，监视已自动移除
+                self.watches.pop(wd, None)
+            elif wd in self.watches:
+                directory = self.watches[wd]
+                events.append((os.path.join(directory, os.fsdecode(name)) if name else directory, mask))
+        return events
+    
+    def close(self):
+        os.close(self.fd)
+
+
+def _glob_regex(pattern):
+    """把 glob 通配符转换为匹配完整路径的正则（* 和 ? 不跨目录，**/ 匹配任意层目录）"""
+    import re
+    
+    parts = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            parts.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('**', i):
+            parts.append('.*')
+            i += 2
+        elif pattern[i] == '*':
+            parts.append('[^/]*')
+            i += 1
+        elif pattern[i] == '?':
+            parts.append('[^/]')
+            i += 1
+        elif pattern[i] == '[' and pattern.find(']', i + 2) > 0:
+            end = pattern.find(']', i + 2)
+            body = pattern[i + 1:end].replace('\\', '\\\\')
+            parts.append('[' + ('^' + body[1:] if body.startswith('!') else body) + ']')
+            i = end + 1
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+    return re.compile(''.join(parts) + r'\Z')
+
+
+def _manifest_fields(entries, base_dir, path):
+    """
+    不展开通配符，直接计算单个文件按清单应有的字段（合并规则同 resolve_manifest）
+    没有匹配的条目时返回 None
+    """
+    path = os.path.abspath(path)
+    fields = None
+    for pattern, values in entries:
+        full = os.path.abspath(os.path.join(base_dir, pattern))
+        if os.path.isdir(full):
+            matched = path.startswith(full.rstrip(os.sep) + os.sep)
+        else:
+            matched = path == full or bool(_glob_regex(full).match(path))
+        if matched:
+            fields = dict(fields or {}, **values)
+    return fields
+
+
+def _file_signature(path):
+    """文件的 (inode, 大小, 修改时间)，用于识别自己写入产生的事件；文件不存在时返回 None"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def run_watch(directories, changes=None, manifest=None, debounce=0.5, jobs=None, on_result=None):
+    """
+    监视目录（递归），新建或修改的图片在事件平息 debounce 秒后应用元数据
+    changes: 对每个文件设置的字段；manifest: (清单条目, 清单所在目录)，按清单匹配每个文件的期望字段
+    每次只处理发生变化的文件；处理后记录文件签名，自己写入触发的事件签名一致，直接忽略
+    一直运行到 KeyboardInterrupt，返回各状态的计数
+    """
+    import select
+    
+    inotify = Inotify()
+    pending = {}  # 路径 -> 最近一次事件的时间
+    own_writes = {}  # 路径 -> 处理后的文件签名
+    counts = Counter()
+    
+    def watch_tree(root, scan):
+        # scan: 新出现的目录在添加监视前可能已经写入了文件，需要补扫一次
+        for directory, dirs, files in os.walk(root):
+            dirs.sort()
+            inotify.add_watch(directory)
+            if scan:
+                for name in files:
+                    if os.path.splitext(name)[1].lower() in SUPPORTED_EXTENSIONS:
+                        pending[os.path.join(directory, name)] = time.monotonic()
+    
+    def collect(result):
+        counts[result.status] += 1
+        if result.ok:
+            own_writes[result.path] = _file_signature(result.path)
+        if on_result:
+            on_result(result)
+    
+    try:
+        for directory in directories:
+            watch_tree(directory, False)
+        while True:
+            timeout = None
+            if pending:
+                timeout = max(0.0, min(pending.values()) + debounce - time.monotonic())
+            readable, _, _ = select.select([inotify.fd], [], [], timeout)
+            now = time.monotonic()
+            if readable:
+                for path, mask in inotify.read_events():
+                    if path is None:
+                        print_warning("inotify 事件队列溢出，部分修改可能被遗漏", file=sys.stderr)
+                    elif mask & IN_ISDIR:
+                        if mask & (IN_CREATE | IN_MOVED_TO):
+                            watch_tree(path, True)
+                    elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                        if os.path.splitext(path)[1].lower() in SUPPORTED_EXTENSIONS:
+                            pending[path] = now
+            
+            ready = [path for path, last in pending.items() if now - last >= debounce]
+            if not ready:
+                continue
+            files = []
+            changes_by_path = {} if manifest is not None else None
+            for path in ready:
+                del pending[path]
+                signature = _file_signature(path)
+                if signature is None or own_writes.get(path) == signature:
+                    continue
+                if manifest is not None:
+                    fields = _manifest_fields(manifest[0], manifest[1], path)
+                    if fields is None:
+                        continue
+                    changes_by_path[path] = fields
+                files.append(path)
+            if files:
+                run_batch('sync' if manifest is not None else 'set', files, changes, jobs,
+                          on_result=collect, changes_by_path=changes_by_path)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        inotify.close()
+    return counts
+
+
+def run_watch_cli(args, parser):
+    """watch 子命令：解析配置的元数据后进入监视循环，退出时打印汇总"""
+    changes = {key: getattr(args, key) for key in METADATA_KEYS if getattr(args, key) is not None}
+    manifest = None
+    if args.manifest:
+        if changes:
+            parser.error("--manifest 不能与字段参数同时使用")
+        try:
+            manifest = (load_manifest(args.manifest), os.path.dirname(os.path.abspath(args.manifest)))
+        except (OSError, ValueError) as e:
+            print_error(f"读取清单失败: {e}")
+            return 2
+    elif not changes:
+        parser.error("watch 需要 --manifest 或至少一个字段，例如 --source TEXT")
+    
+    directories = args.paths or ([manifest[1]] if manifest else [])
+    if not directories:
+        parser.error("请指定要监视的目录")
+    for directory in directories:
+        if not os.path.isdir(directory):
+            parser.error(f"不是目录: {directory}")
+    if not sys.platform.startswith('linux'):
+        print_error("watch 依赖 inotify，仅支持 Linux")
+        return 2
+    
+    index = MetadataIndex(args.index) if args.index else None
+    
+    def on_result(result):
+        if index is not None and result.ok:
+            index.store(result.path, result.metadata)
+        if not args.quiet:
+            _print_batch_result('set', result)
+    
+    print_info(f"正在监视 {len(directories)} 个目录（按 Ctrl+C 退出）: {', '.join(directories)}")
+    start = time.perf_counter()
+    try:
+        counts = run_watch(directories, changes or None, manifest, args.debounce, args.jobs, on_result)
+    finally:
+        if index is not None:
+            index.close()
+    elapsed = time.perf_counter() - start
+    
+    print_section("汇总")
+    print(colorize(f"| 已修改: {counts['updated']}，无需修改: {counts['unchanged']}", Colors.BRIGHT_CYAN))
+    print(colorize(f"| 失败: {counts['failed']}", Colors.BRIGHT_RED if counts['failed'] else Colors.BRIGHT_CYAN))
+    _write_profile(args, elapsed)
+    return 1 if counts['failed'] else 0
+
+
+# 批处理模式的全部子命令（按帮助中的顺序）
+CLI_COMMANDS = ('get', 'set', 'delete', 'clear', 'strip', 'optimize', 'embed', 'verify', 'dump', 'load', 'sync',
+                'query', 'index', 'watch', 'serve')
+
+
+def build_arg_parser(command=None):
+    """
+    构建批处理模式的命令行参数解析器
+    command: 只添加该子命令的解析器（构建全部子命令约占 get 单个文件启动耗时的三分之一）；
+             None 时添加全部子命令，用于顶层 --help 和无效子命令的报错
+    """
+    import argparse
+    
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(sys.argv[0]) or 'add_image_metadata.py',
+        description="图片元数据管理工具（批处理模式）。不带参数运行时进入交互模式。",
+    )
+    
+    options = argparse.ArgumentParser(add_help=False)
+    options.add_argument('-j', '--jobs', type=int, default=None,
+                         help="工作进程数（默认: CPU 核心数）")
+    options.add_argument('--chunksize', type=int, default=None,
+                         help="每次分发给工作进程的文件数（默认: 自动）")
+    options.add_argument('-q', '--quiet', action='store_true', help="只输出汇总信息")
+    options.add_argument('--index', metavar='FILE',
+                         help="元数据索引文件（SQLite），未变化的文件直接从索引读取")
+    options.add_argument('--fsync', choices=FSYNC_MODES, default='always',
+                         help="写入后的同步策略: always 每个文件 fsync（默认）；batch 全部完成后统一 sync；never 不同步")
+    options.add_argument('--profile', metavar='JSON',
+                         help="记录每个文件各阶段（open/parse/build/write/fsync）的耗时和字节数，汇总写入 JSON")
+    options.add_argument('--profile-trace', metavar='TRACE',
+                         help="同时写出 Chrome trace-event 文件（chrome://tracing 或 Perfetto 打开）")
+    options.add_argument('--verify', action='store_true',
+                         help="写入后顺序读取一遍文件，校验结构（PNG CRC、JPEG 段结构等）并确认字段读回一致")
+    options.add_argument('--format', choices=METADATA_FORMATS, default='xmp',
+                         help="字段的存储格式: xmp 写入 XMP 数据包（默认，修改能放进预留填充时原地覆盖）；"
+                              "legacy 写入 EXIF 标签 / PNG 文本块")
+    options.add_argument('--max-bytes-per-sec', type=parse_byte_rate, metavar='RATE',
+                         help="限制每秒处理的文件字节数，支持 K/M/G 后缀（如 20M），避免占满共享存储")
+    options.add_argument('--max-files-per-sec', type=float, metavar='N', help="限制每秒处理的文件数")
+    options.add_argument('--adaptive', action='store_true',
+                         help="按每个文件的处理延迟自动调整并发数（AIMD，-j 为上限）：延迟升高时减半，正常时逐个增加")
+    options.add_argument('--nice', type=int, choices=range(20), metavar='0-19', help="降低工作进程的 CPU 优先级")
+    options.add_argument('--ionice', type=parse_ionice, metavar='CLASS',
+                         help="降低工作进程的 I/O 优先级: idle 或 best-effort[:0-7]（仅 Linux）")
+    
+    # 逐个文件处理的命令共用的检查点选项
+    journal = argparse.ArgumentParser(add_help=False)
+    journal.add_argument('--journal', metavar='FILE',
+                         help="检查点日志（JSON Lines，只追加），记录每个文件已完成、无需修改或失败及原因")
+    journal.add_argument('--resume', action='store_true',
+                         help="按 --journal 续跑：跳过已完成和无需修改的文件（失败的文件需同时指定 --retry-failed）")
+    journal.add_argument('--retry-failed', action='store_true',
+                         help="按 --journal 只重新处理之前失败的文件（与 --resume 同时指定时也处理未完成的文件）")
+    
+    # 逐个文件处理的命令共用的输出选项
+    output = argparse.ArgumentParser(add_help=False)
+    output.add_argument('--progress', action='store_true',
+                        help="不逐个打印文件，只显示一行实时进度（文件/秒、MB/秒、剩余时间、失败和跳过数）；"
+                             "输出不是终端时每 10 秒打印一行")
+    output.add_argument('--log', metavar='FILE',
+                        help="逐个文件的结果写入日志文件（状态、路径、失败原因或字段，制表符分隔）")
+    
+    common = argparse.ArgumentParser(add_help=False, parents=[options, journal, output])
+    common.add_argument('paths', nargs='+', help="图片文件、目录（递归处理）或通配符")
+    
+    # 读写字段的命令共用的边车选项
+    sidecar = argparse.ArgumentParser(add_help=False)
+    sidecar.add_argument('--sidecar', choices=SIDECAR_MODES[1:],
+                         help="字段保存在图片旁的 .xmp 边车文件（photo.jpg.xmp）中，图片本身不改写: "
+                              "only 只读写边车；merge 读取时边车中的字段覆盖图片内嵌的值（之后可用 embed 写回图片）")
+    
+    # 写入类命令共用的去重选项
+    dedup = argparse.ArgumentParser(add_help=False)
+    dedup.add_argument('--dedup', action='store_true',
+                       help="内容相同的文件只修改一次，再把结果复制给其余文件（需要读取完整文件计算哈希）")
+    dedup.add_argument('--link', choices=REPLICATE_MODES, default='copy',
+                       help="去重时重复文件的写入方式: copy 复制（默认）；reflink 写时复制克隆，不支持时复制；"
+                            "hardlink 改为硬链接")
+    
+    # 显式给出 metavar：只构建单个子命令时用法行仍列出全部子命令
+    subparsers = parser.add_subparsers(dest='command', required=True, metavar='{' + ','.join(CLI_COMMANDS) + '}')
+    
+    def wanted(name):
+        return command is None or command == name
+    
+    if wanted('get'):
+        subparsers.add_parser('get', parents=[common, sidecar], help="读取元数据")
+    
+    if wanted('set'):
+        set_parser = subparsers.add_parser('set', parents=[common, sidecar, dedup], help="设置元数据字段")
+        for key in METADATA_KEYS:
+            set_parser.add_argument(f'--{key.lower()}', dest=key, metavar='TEXT', help=f"设置 {key}")
+    
+    if wanted('delete'):
+        delete_parser = subparsers.add_parser('delete', parents=[common, sidecar, dedup], help="删除指定的元数据字段")
+        delete_parser.add_argument('-f', '--field', dest='fields', action='append', required=True,
+                                   choices=METADATA_KEYS, help="要删除的字段，可重复指定")
+    
+    if wanted('clear'):
+        subparsers.add_parser('clear', parents=[common, sidecar, dedup], help="删除所有元数据字段")
+    if wanted('strip'):
+        strip_parser = subparsers.add_parser('strip', parents=[common],
+                                             help="删除所有非必要的元数据（EXIF 缩略图、厂商注释、GPS、注释、文本块、"
+                                                  "时间戳等），保留 ICC 配置和方向，报告节省的字节数")
+        strip_parser.add_argument('-k', '--keep', action='append', default=[], choices=METADATA_KEYS,
+                                  help="保留的字段（写回不带填充的 XMP 数据包），可重复指定")
+    if wanted('optimize'):
+        subparsers.add_parser('optimize', parents=[common],
+                              help="无损重新压缩 PNG（多种滤波/zlib 策略和无损颜色缩减并行尝试），"
+                                   "只在更小且像素一致时替换，元数据保留")
+    if wanted('embed'):
+        embed_parser = subparsers.add_parser('embed', parents=[common],
+                                             help="把 .xmp 边车文件中的字段写入图片本身（按 --format），然后删除边车文件")
+        embed_parser.add_argument('--keep-sidecar', action='store_true', help="写入后保留边车文件")
+    if wanted('verify'):
+        subparsers.add_parser('verify', parents=[common],
+                              help="校验文件结构（PNG 块 CRC、JPEG 标记/段结构、WebP RIFF、ICO 目录），不解码像素")
+    
+    if wanted('dump'):
+        dump_parser = subparsers.add_parser('dump', parents=[options, sidecar],
+                                            help="以 JSON Lines 格式流式输出元数据（每个文件一行）")
+        dump_parser.add_argument('paths', nargs='*',
+                                 help="图片文件、目录或通配符；省略或为 - 时从标准输入逐行读取路径")
+    
+    if wanted('load'):
+        load_parser = subparsers.add_parser('load', parents=[options, sidecar],
+                                            help="从 JSON Lines 流式读取并应用元数据")
+        load_parser.add_argument('input', nargs='?', default='-', help="JSON Lines 文件（默认: 标准输入）")
+    
+    if wanted('sync'):
+        sync_parser = subparsers.add_parser('sync', parents=[options, journal, output, sidecar, dedup],
+                                            help="按清单同步元数据，只改写与清单不一致的文件")
+        sync_parser.add_argument('manifest', help="元数据清单文件（JSON 或 YAML），通配符相对于清单所在目录")
+        sync_parser.add_argument('--plan', action='store_true', help="只列出将要进行的修改，不写入文件")
+    
+    if wanted('query'):
+        query_parser = subparsers.add_parser('query', help="只从索引中查询，不读取图片文件")
+        query_parser.add_argument('--index', metavar='FILE', required=True, help="元数据索引文件")
+        query_parser.add_argument('--missing', action='append', choices=METADATA_KEYS,
+                                  help="筛选缺少该字段的图片，可重复指定")
+        query_parser.add_argument('--present', action='append', choices=METADATA_KEYS,
+                                  help="筛选已设置该字段的图片，可重复指定")
+        query_parser.add_argument('-q', '--quiet', action='store_true', help="只输出路径")
+    
+    if wanted('index'):
+        index_parser = subparsers.add_parser('index', help="维护元数据索引")
+        index_parser.add_argument('action', choices=('invalidate', 'compact'),
+                                  help="invalidate: 使指定路径（默认全部）的记录失效；compact: 清理过期记录并压缩")
+        index_parser.add_argument('paths', nargs='*', help="invalidate 的文件或目录")
+        index_parser.add_argument('--index', metavar='FILE', required=True, help="元数据索引文件")
+    
+    if wanted('watch'):
+        watch_parser = subparsers.add_parser('watch', parents=[options, sidecar],
+                                             help="监视目录，新建或修改的图片自动应用元数据（基于 inotify，仅 Linux）")
+        watch_parser.add_argument('paths', nargs='*', help="要监视的目录（递归），使用 --manifest 时默认为清单所在目录")
+        watch_parser.add_argument('--manifest', metavar='FILE', help="按清单（格式同 sync）为匹配的文件设置字段")
+        for key in METADATA_KEYS:
+            watch_parser.add_argument(f'--{key.lower()}', dest=key, metavar='TEXT', help=f"设置 {key}")
+        watch_parser.add_argument('--debounce', type=float, default=0.5, metavar='SECONDS',
+                                  help="文件最后一次变化后等待的秒数，合并连续写入产生的事件（默认 0.5）")
+    
+    if wanted('serve'):
+        serve_parser = subparsers.add_parser('serve', help="启动常驻服务，之后的 get/set/delete/clear/verify/sync "
+                                                           "命令自动转发给它执行（省去启动开销）")
+        serve_parser.add_argument('--socket', metavar='PATH',
+                                  help="Unix 套接字路径（默认: IMAGE_METADATA_SOCKET 或 $XDG_RUNTIME_DIR 下）")
+        serve_parser.add_argument('-j', '--jobs', type=int, default=None,
+                                  help="常驻进程池的工作进程数（默认: CPU 核心数，1 表示不使用进程池）")
+        serve_parser.add_argument('--stop', action='store_true', help="停止正在运行的常驻服务")
+    return parser
+
+
+def run_batch_cli(argv):
+    """
+    批处理模式入口
+    返回进程退出码：全部成功为 0，有失败为 1，参数错误为 2
+    """
+    # 子命令在最前面时只构建它的解析器；否则（--help、拼写错误等）构建完整的解析器以便列出全部子命令
+    parser = build_arg_parser(argv[0] if argv and argv[0] in CLI_COMMANDS else None)
+    args = parser.parse_args(argv)
+    
+    if args.command in ('query', 'index'):
+        return run_index_command(args)
+    if args.command == 'serve':
+        if args.stop:
+            return stop_daemon(args.socket)
+        if args.jobs is not None and args.jobs < 1:
+            parser.error("--jobs 必须大于 0")
+        return run_serve(args.socket, args.jobs)
+    
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs 必须大于 0")
+    set_fsync_mode(args.fsync)
+    set_metadata_format(args.format)
+    set_verify_writes(args.verify)
+    sidecar = getattr(args, 'sidecar', None)
+    if sidecar and args.index:
+        parser.error("--sidecar 不能与 --index 同时使用（索引按图片文件的变化判断是否失效）")
+    if sidecar and getattr(args, 'dedup', False):
+        parser.error("--sidecar 不能与 --dedup 同时使用（边车模式不改写图片，无需去重）")
+    set_sidecar_mode(sidecar or 'off')
+    # 显式关闭：serve 模式下同一进程会处理多个请求
+    enable_profiling(bool(args.profile or args.profile_trace))
+    if args.max_files_per_sec is not None and args.max_files_per_sec <= 0:
+        parser.error("--max-files-per-sec 必须大于 0")
+    scheduler = None
+    if args.max_bytes_per_sec or args.max_files_per_sec or args.adaptive or args.nice or args.ionice:
+        priority = (args.nice, args.ionice) if args.nice or args.ionice else None
+        scheduler = BatchScheduler(args.max_bytes_per_sec, args.max_files_per_sec, args.adaptive, priority)
+    set_scheduler(scheduler)
+    
+    if args.command == 'watch':
+        return run_watch_cli(args, parser)
+    
+    if args.command in ('dump', 'load'):
+        start = time.perf_counter()
+        code = run_stream_cli(args)
+        _write_profile(args, time.perf_counter() - start)
+        return code
+    
+    if (args.resume or args.retry_failed) and not args.journal:
+        parser.error("--resume / --retry-failed 需要同时指定 --journal")
+    
+    command = args.command
+    changes = None
+    changes_by_path = None
+    if command == 'set':
+        changes = {key: getattr(args, key) for key in METADATA_KEYS if getattr(args, key) is not None}
+        if not changes:
+            parser.error("set 至少需要指定一个字段，例如 --description TEXT")
+    elif command == 'delete':
+        changes = list(dict.fromkeys(args.fields))
+    elif command == 'strip':
+        changes = list(dict.fromkeys(args.keep))
+    elif command == 'embed':
+        changes = args.keep_sidecar
+    
+    if command == 'sync':
+        try:
+            entries = load_manifest(args.manifest)
+        except (OSError, ValueError) as e:
+            print_error(f"读取清单失败: {e}")
+            return 2
+        changes_by_path = resolve_manifest(entries, os.path.dirname(os.path.abspath(args.manifest)))
+        files = list(changes_by_path)
+        if args.plan:
+            command = 'plan'
+    else:
+        files = list(iter_image_files(args.paths))
+    
+    if not files:
+        print_warning("没有找到可处理的图片文件")
+        return 1
+    
+    try:
+        log = open(args.log, 'w', encoding='utf-8') if args.log else None
+    except OSError as e:
+        print_error(f"打开日志文件失败: {e}")
+        return 2
+    journal = None
+    journal_skipped = Counter()
+    if args.journal:
+        header = {'command': command, 'changes': changes}
+        if command in ('sync', 'plan'):
+            header = {'command': command, 'manifest': os.path.abspath(args.manifest)}
+        try:
+            journal = BatchJournal(args.journal, header, args.resume or args.retry_failed)
+        except (OSError, ValueError) as e:
+            print_error(f"打开检查点日志失败: {e}")
+            if log is not None:
+                log.close()
+            return 2
+        if args.resume or args.retry_failed:
+            files, journal_skipped = journal.select(files, args.resume, args.retry_failed)
+    if command == 'optimize':
+        # 每个文件的多种策略在线程中并行；文件数少于核心数时把剩余的核心分给线程
+        cpus = os.cpu_count() or 1
+        changes = max(1, cpus // min(args.jobs or cpus, len(files)))
+    
+    index = MetadataIndex(args.index) if args.index else None
+    counts = Counter()
+    
+    def on_result(result):
+        counts[result.status] += 1
+        counts['saved_bytes'] += result.saved
+        if journal is not None:
+            journal.record(result)
+        if index is not None and result.ok and result.status not in ('planned', 'verified'):
+            index.store(result.path, result.metadata)
+        if progress is not None:
+            progress.update(result)
+        elif not args.quiet:
+            _print_batch_result(command, result)
+        if log is not None:
+            _write_log_record(log, command, result)
+    
+    progress = BatchProgress(len(files)) if args.progress else None
+    # 进度行独占终端：主进程和工作进程的逐文件输出都丢弃（失败原因记入 --log）；-q 时也不打印错误
+    set_quiet_workers(progress is not None or args.quiet)
+    saved_stdout = sys.stdout
+    if progress is not None:
+        sys.stdout = open(os.devnull, 'w', encoding='utf-8')
+    dedup_stats = None
+    start = time.perf_counter()
+    try:
+        pending = files
+        if index is not None and command in ('get', 'sync', 'plan'):
+            # 命中索引且无需修改的文件不再读取图片
+            pending = []
+            for path in files:
+                cached = index.lookup(path)
+                if cached is None:
+                    pending.append(path)
+                elif command == 'get':
+                    on_result(BatchResult(path, True, cached, 'read', None))
+                elif _apply_changes(cached, command, changes_by_path[path]) == cached:
+                    on_result(BatchResult(path, True, cached, 'unchanged', cached))
+                else:
+                    pending.append(path)
+        if getattr(args, 'dedup', False) and command != 'plan':
+            _, dedup_stats = run_batch_dedup(command, pending, changes, args.jobs, args.chunksize, on_result,
+                                             changes_by_path, args.link)
+        else:
+            run_batch(command, pending, changes, args.jobs, args.chunksize, on_result, changes_by_path)
+    finally:
+        set_quiet_workers(False)
+        if progress is not None:
+            sys.stdout.close()
+            sys.stdout = saved_stdout
+            progress.close()
+        if log is not None:
+            log.close()
+        if index is not None:
+            index.close()
+        if journal is not None:
+            journal.close()
+    elapsed = time.perf_counter() - start
+    
+    failed = counts['failed']
+    print_section("汇总")
+    rate = len(files) / elapsed if elapsed > 0 else 0
+    print(colorize(f"| 文件总数: {len(files)}", Colors.BRIGHT_CYAN))
+    print(colorize(f"| 成功: {len(files) - failed}", Colors.BRIGHT_GREEN))
+    if command == 'verify':
+        print(colorize(f"| 校验通过: {counts['verified']}", Colors.BRIGHT_CYAN))
+    elif command == 'embed':
+        print(colorize(f"| 已写入图片: {counts['updated']}，没有边车文件: {counts['unchanged']}", Colors.BRIGHT_CYAN))
+    elif command in ('strip', 'optimize'):
+        label = "已精简" if command == 'strip' else "已优化"
+        print(colorize(f"| {label}: {counts['updated']}，无需修改: {counts['unchanged']}", Colors.BRIGHT_CYAN))
+        print(colorize(f"| 节省: {counts['saved_bytes'] / 1024:.1f} KB", Colors.BRIGHT_CYAN))
+    elif command != 'get':
+        label = "待修改" if command == 'plan' else "已修改"
+        print(colorize(f"| {label}: {counts['planned'] + counts['updated']}，无需修改: {counts['unchanged']}",
+                       Colors.BRIGHT_CYAN))
+    print(colorize(f"| 失败: {failed}", Colors.BRIGHT_RED if failed else Colors.BRIGHT_CYAN))
+    if journal_skipped:
+        detail = "，".join(f"{label} {journal_skipped[state]}" for state, label in (
+            ('done', "已完成"), ('skipped', "无需修改"), ('failed', "之前失败"), ('unlisted', "未失败"))
+            if journal_skipped[state])
+        print(colorize(f"| 按检查点跳过: {sum(journal_skipped.values())}（{detail}）", Colors.BRIGHT_CYAN))
+    if index is not None and command in ('get', 'sync', 'plan'):
+        print(colorize(f"| 索引命中: {index.hits}，重新解析: {index.misses}", Colors.BRIGHT_CYAN))
+    if dedup_stats is not None:
+        mb = 1024 * 1024
+        print(colorize(f"| 去重: {dedup_stats['groups']} 组重复文件，{dedup_stats['skipped']} 个文件免于读取和修改，"
+                       f"哈希读取 {dedup_stats['hashed_bytes'] / mb:.1f} MB", Colors.BRIGHT_CYAN))
+        print(colorize(f"| 重复文件写入: 复制 {dedup_stats['copied_bytes'] / mb:.1f} MB，"
+                       f"克隆/硬链接 {dedup_stats['linked']} 个（免写 {dedup_stats['linked_bytes'] / mb:.1f} MB）",
+                       Colors.BRIGHT_CYAN))
+    if scheduler is not None and (scheduler.adaptive or scheduler.throttled):
+        print(colorize(f"| 调度: 并发 {scheduler.limit}（最高 {scheduler.peak}），限速等待 {scheduler.throttled:.2f} 秒",
+                       Colors.BRIGHT_CYAN))
+    print(colorize(f"| 耗时: {elapsed:.2f} 秒（{rate:.1f} 个文件/秒）", Colors.BRIGHT_CYAN))
+    if index is not None and command in ('get', 'sync', 'plan'):
+        _prof_count('index_hits', index.hits)
+        _prof_count('index_misses', index.misses)
+    _write_profile(args, elapsed)
+    return 1 if failed else 0
+
+
+def _write_profile(args, elapsed):
+    """写出 --profile 汇总和 --profile-trace 文件（提示信息写到 stderr，不干扰 dump 的输出）"""
+    if image_metadata.PROFILER is None:
+        return
+    import json
+    
+    if args.profile:
+        with open(args.profile, 'w', encoding='utf-8') as f:
+            json.dump(image_metadata.PROFILER.summary(elapsed), f, ensure_ascii=False, indent=2)
+        print(f"[INFO] 性能分析汇总已写入: {args.profile}", file=sys.stderr)
+    if args.profile_trace:
+        image_metadata.PROFILER.write_trace(args.profile_trace)
+        print(f"[INFO] trace 文件已写入: {args.profile_trace}", file=sys.stderr)
+
+
+def main(argv=None):
+    """
+    主函数
+    带命令行参数时以批处理模式运行，否则进入交互式元数据管理
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv:
+        if argv[0] in DAEMON_COMMANDS:
+            code = forward_to_daemon(argv)
+            if code is not None:
+                return code
+        return run_batch_cli(argv)
+    
+    print_header("图片元数据管理工具")
+    
+    # 1. 选择文件
+    print_info("请选择图片文件...")
+    file_path = select_file_gui()
+    
+    if not file_path:
+        print_warning("未选择文件，已退出")
+        return
+    
+    from pathlib import Path
+    
+    file_path = Path(file_path)
+    
+    # 显示文件信息
+    print_section("文件信息")
+    
+    file_size = file_path.stat().st_size
+    if file_size >= 1024 * 1024:
+        file_size_str = f"{file_size / (1024 * 1024):.2f} MB"
+    elif file_size >= 1024:
+        file_size_str = f"{file_size / 1024:.2f} KB"
+    else:
+        file_size_str = f"{file_size} B"
+    
+    file_type = file_path.suffix.upper()[1:] if file_path.suffix else "未知"
+    
+    details = [
+        ("文件路径", str(file_path)),
+        ("文件名", file_path.name),
+        ("文件大小", file_size_str),
+        ("文件类型", file_type),
+        ("文件位置", str(file_path.parent))
+    ]
+    
+    for label, value in details:
+        print(colorize(f"| {label}: {value}", Colors.BRIGHT_CYAN))
+    
+    print_success("文件已成功加载！")
+    
+    # 2. 读取现有元数据
+    try:
+        metadata = read_metadata(file_path)
+    except (OSError, ValueError) as e:
+        print_error(f"读取元数据失败: {e}")
+        return
+    
+    # 主循环
+    while True:
+        display_metadata(metadata)
+        
+        print_section("操作菜单")
+        
+        # 设置操作组
+        print(colorize("| 设置操作", Colors.BRIGHT_CYAN + Colors.BOLD))
+        menu_items = [
+            ("1", "设置 Comment", Colors.BRIGHT_CYAN),
+            ("2", "设置 Description", Colors.BRIGHT_BLUE),
+            ("3", "设置 Source", Colors.BRIGHT_MAGENTA),
+            ("4", "设置 URL", Colors.BRIGHT_YELLOW),
+        ]
+        for key, desc, color in menu_items:
+            print(colorize(f"|   {key}. {desc}", color))
+        
+        # 删除操作组
+        print(colorize("| 删除操作", Colors.BRIGHT_CYAN + Colors.BOLD))
+        menu_items = [
+            ("5", "删除 Comment", Colors.BRIGHT_RED),
+            ("6", "删除 Description", Colors.BRIGHT_RED),
+            ("7", "删除 Source", Colors.BRIGHT_RED),
+            ("8", "删除 URL", Colors.BRIGHT_RED),
+            ("9", "删除所有元数据", Colors.BRIGHT_RED + Colors.BOLD),
+        ]
+        for key, desc, color in menu_items:
+            print(colorize(f"|   {key}. {desc}", color))
+        
+        # 快捷操作组
+        print(colorize("| 快捷操作", Colors.BRIGHT_CYAN + Colors.BOLD))
+        menu_items = [
+            ("d", "快捷添加 Description", Colors.BRIGHT_GREEN),
+            ("s", "保存并退出", Colors.BRIGHT_GREEN + Colors.BOLD),
+            ("q", "退出（不保存）", Colors.DIM),
+        ]
+        for key, desc, color in menu_items:
+            print(colorize(f"|   {key}. {desc}", color))
+        
+        print()
+        
+        choice = get_user_input("请选择操作选项", allow_empty=False).lower()
+        
+        if choice == '1':
+            # 设置 Comment
+            value = get_user_input("请输入 Comment", allow_empty=True)
+            metadata['Comment'] = value
+            if value:
+                print_success(f"Comment 已设置为: {colorize(value, Colors.CYAN)}")
+            else:
+                print_success("Comment 已清空")
+        
+        elif choice == '2':
+            # 设置 Description
+            value = get_user_input("请输入 Description", allow_empty=True)
+            metadata['Description'] = value
+            if value:
+                print_success(f"Description 已设置为: {colorize(value, Colors.BLUE)}")
+            else:
+                print_success("Description 已清空")
+        
+        elif choice == '3':
+            # 设置 Source
+            value = get_user_input("请输入 Source", allow_empty=True)
+            metadata['Source'] = value
+            if value:
+                print_success(f"Source 已设置为: {colorize(value, Colors.MAGENTA)}")
+            else:
+                print_success("Source 已清空")
+        
+        elif choice == '4':
+            # 设置 URL
+            value = get_user_input("请输入 URL", allow_empty=True)
+            metadata['URL'] = value
+            if value:
+                print_success(f"URL 已设置为: {colorize(value, Colors.YELLOW)}")
+            else:
+                print_success("URL 已清空")
+        
+        elif choice == '5':
+            # 删除 Comment
+            metadata['Comment'] = ''
+            print_success("Comment 已删除")
+        
+        elif choice == '6':
+            # 删除 Description
+            metadata['Description'] = ''
+            print_success("Description 已删除")
+        
+        elif choice == '7':
+            # 删除 Source
+            metadata['Source'] = ''
+            print_success("Source 已删除")
+        
+        elif choice == '8':
+            # 删除 URL
+            metadata['URL'] = ''
+            print_success("URL 已删除")
+        
+        elif choice == '9':
+            # 删除所有元数据
+            print_warning("此操作将删除所有元数据！")
+            confirm = get_user_input("确认删除? (y/n)", default="n")
+            if confirm.lower() == 'y':
+                metadata = {'Comment': '', 'Description': '', 'Source': '', 'URL': ''}
+                print_success("所有元数据已清空")
+            else:
+                print_info("操作已取消")
+        
+        elif choice == 'd':
+            # 快捷添加 Description
+            value = get_user_input("请输入 Description", allow_empty=False)
+            metadata['Description'] = value
+            print_success(f"Description 已设置为: {colorize(value, Colors.GREEN)}")
+        
+        elif choice == 's':
+            # 保存并退出
+            print()
+            print_info("正在保存元数据...")
+            if update_metadata(file_path, metadata):
+                print_success(f"元数据已成功保存到: {colorize(str(file_path), Colors.CYAN)}")
+                print()
+                print_section("提示信息")
+                print(colorize("| 可以使用以下工具查看元数据:", Colors.CYAN))
+                exifinfo_url = colorize("https://exifinfo.org", Colors.BLUE)
+                print(colorize(f"| 在线工具: {exifinfo_url}", Colors.CYAN))
+            else:
+                print_error("保存失败")
+            break
+        
+        elif choice == 'q':
+            # 退出不保存
+            print_warning("未保存的更改将丢失！")
+            confirm = get_user_input("确认退出? (y/n)", default="n")
+            if confirm.lower() == 'y':
+                print_info("已退出，未保存更改")
+                break
+            else:
+                print_info("操作已取消")
+        
+        else:
+            print_error(f"无效的选项: {choice}")
+